@@ -55,28 +55,48 @@ class Router(wsgi.Router):
     def db(self, request):
         '''Single Database Query'''
         with self.mapper.begin() as session:
-            world = session.query(World).get(randint(1, 10000))
+            world = session.get(self.mapper.world, randint(1, 10000))
         return Json(self.get_json(world)).http_response(request)
 
     @route()
     def queries(self, request):
         '''Multiple Database Queries'''
         queries = self.get_queries(request)
-        worlds = []
+        ids = [randint(1, MAXINT) for _ in range(queries)]
         with self.mapper.begin() as session:
-            for _ in range(queries):
-                world = session.query(World).get(randint(1, MAXINT))
-                worlds.append(self.get_json(world))
+            worlds = session.get_many(self.mapper.world, ids)
+        worlds = [self.get_json(world) for world in worlds]
         return Json(worlds).http_response(request)
 
     @route()
     def updates(self, request):
-        '''Multiple updates'''
+        '''Multiple updates with one bulk update statement'''
+        queries = self.get_queries(request)
+        ids = [randint(1, MAXINT) for _ in range(queries)]
+        with self.mapper.begin() as session:
+            worlds = session.get_many(self.mapper.world, ids)
+            # one number for each distinct id, rows are updated in id
+            # order so that concurrent requests lock them in the same order
+            numbers = dict(((id, randint(1, MAXINT))
+                            for id in set(world.id for world in worlds)))
+            self.mapper.bulk_update(
+                self.mapper.world,
+                [{'id': id, 'randomNumber': numbers[id]}
+                 for id in sorted(numbers)],
+                session=session
+            )
+        worlds = [{'id': world.id, 'randomNumber': numbers[world.id]}
+                  for world in worlds]
+        return Json(worlds).http_response(request)
+
+    @route()
+    def updates_orm(self, request):
+        '''Multiple updates, one transaction per row'''
         queries = self.get_queries(request)
         worlds = []
         for _ in range(queries):
             with self.mapper.begin() as session:
-                world = session.query(World).get(randint(1, MAXINT))
+                world = session.get(self.mapper.world, randint(1, MAXINT))
                 world.randomNumber = randint(1, MAXINT)
                 session.add(world)
             worlds.append(self.get_json(world))
@@ -95,16 +115,31 @@ class Router(wsgi.Router):
         return {'id': world.id, 'randomNumber': world.randomNumber}
 
 
+def create_mapper(engine):
+    mapper = odm.Mapper(engine)
+    #
+    # Register the two alchemy models
+    mapper.register(World)
+    mapper.register(Fortune)
+    #
+    # Build models and mappers once, before forking workers
+    mapper.prefork()
+    return mapper
+
+
 class App(wsgi.LazyWsgi):
 
+    def __init__(self, mapper=None):
+        self.mapper = mapper
+
     def setup(self, environ):
         cfg = environ['pulsar.cfg']
-        mapper = odm.Mapper(cfg.engine)
-        #
-        # Register the two alchemy models
-        mapper.register(World)
-        mapper.register(Fortune)
-        #
+        mapper = self.mapper
+        if mapper is None:
+            mapper = create_mapper(cfg.engine)
+        else:
+            # New connection pools for this worker process
+            mapper.after_fork()
         route = Router('/', mapper=mapper)
         #
         # Concurrency method
@@ -118,9 +153,19 @@ class App(wsgi.LazyWsgi):
                                 async=True)
 
 
+class Server(wsgi.WSGIServer):
+
+    async def monitor_start(self, monitor):
+        # Build the mapper in the arbiter, workers inherit it when forked
+        app = self.cfg.callable
+        if app.mapper is None:
+            app.mapper = create_mapper(self.cfg.engine)
+        await super().monitor_start(monitor)
+
+
 def server(description=None, **kwargs):
     description = description or 'Pulsar ODM Benchmark'
-    return wsgi.WSGIServer(App(), description=description, **kwargs)
+    return Server(App(), description=description, **kwargs)
 
 
 if __name__ == '__main__':
@@ -15,7 +15,7 @@ POOL_SIZES = [8, 16, 32, 64, 128]
 TIMEOUT = 120
 REQUESTS = 10000
 FIRST_WORMUP = 1000
-FIELDNAMES = ['concurrency', 'requests', 'errors', 'time']
+FIELDNAMES = ['url', 'concurrency', 'requests', 'errors', 'time']
 
 
 class PostgreSql(pulsar.Setting):
@@ -28,9 +28,11 @@ class PostgreSql(pulsar.Setting):
 class TestUrl(pulsar.Setting):
     app = 'bench'
     name = "test_url"
-    default = "http://127.0.0.1:8060/json"
+    default = ["http://127.0.0.1:8060/json"]
     flags = ["--test-url"]
-    desc = "url to test"
+    nargs = '+'
+    desc = ("urls to test, pass more than one to compare them "
+            "(for example updates_orm and updates)")
 
 
 class FillDB(pulsar.Setting):
@@ -42,22 +44,23 @@ class FillDB(pulsar.Setting):
     desc = "Fill database with random data"
 
 
-def wormup(worker, pool_size, total=FIRST_WORMUP):
+def wormup(worker, pool_size, total=FIRST_WORMUP, url=None):
     worker.http = HttpClient(pool_size=pool_size, timeout=TIMEOUT)
     worker.requests = total
     worker.logger.info('WORM UP')
-    yield from request(worker, False)
-    yield from worker.send('monitor', 'run', ready)
+    yield from request(worker, url, False)
+    if url is None:
+        yield from worker.send('monitor', 'run', ready)
 
 
-def bench(worker):
+def bench(worker, url):
     worker.logger.info('BENCHMARKING')
-    results = yield from request(worker)
+    results = yield from request(worker, url)
     return results
 
 
-def request(worker, log=True):
-    url = worker.cfg.test_url
+def request(worker, url=None, log=True):
+    url = url or worker.cfg.test_url[0]
     loop = worker._loop
     number = worker.requests
     if log:
@@ -99,7 +102,7 @@ def ready(monitor):
 def run_benchmark(monitor):
     '''Run the benchmarks
     '''
-    url = urlparse(monitor.cfg.test_url)
+    url = urlparse(monitor.cfg.test_url[0])
     name = slugify(url.path) or 'home'
     name = '%s_%d.csv' % (name, monitor.cfg.workers)
     monitor.logger.info('WRITING RESULTS ON "%s"', name)
@@ -108,39 +111,42 @@ def run_benchmark(monitor):
     with open(name, 'w') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
         writer.writeheader()
-        for pool_size in POOL_SIZES:
-            size = pool_size//monitor.cfg.workers
-            if size*monitor.cfg.workers != pool_size:
-                monitor.logger.error('Adjust workes so that pool sizes '
-                                     'can be evenly shared across them')
-                monitor._loop.stop()
-
-            # WORMUP
-            requests = [monitor.send(worker, 'run', wormup, size, total) for
-                        worker in monitor.managed_actors]
-            yield from wait(requests)
-
-            # BENCHMARK
-            requests = [monitor.send(worker, 'run', bench) for
-                        worker in monitor.managed_actors]
-            results, pending = yield from wait(requests)
-            assert not pending, 'Pending requets!'
-            results = [r.result() for r in results]
-
-            summary = {'concurrency': pool_size}
-            for name in results[0]:
-                summary[name] = reduce(add(name), results, 0)
-            writer.writerow(summary)
-
-            persec = summary['requests']/summary['time']
-            monitor.logger.info('%d concurrency - %d requests - '
-                                '%d errors - %.3f seconds - '
-                                '%.2f requests/sec',
-                                pool_size,
-                                summary['requests'],
-                                summary['errors'],
-                                summary['time'],
-                                persec)
+        for test_url in monitor.cfg.test_url:
+            for pool_size in POOL_SIZES:
+                size = pool_size//monitor.cfg.workers
+                if size*monitor.cfg.workers != pool_size:
+                    monitor.logger.error('Adjust workes so that pool sizes '
+                                         'can be evenly shared across them')
+                    monitor._loop.stop()
+
+                # WORMUP
+                requests = [monitor.send(worker, 'run', wormup, size, total,
+                                         test_url)
+                            for worker in monitor.managed_actors]
+                yield from wait(requests)
+
+                # BENCHMARK
+                requests = [monitor.send(worker, 'run', bench, test_url) for
+                            worker in monitor.managed_actors]
+                results, pending = yield from wait(requests)
+                assert not pending, 'Pending requets!'
+                results = [r.result() for r in results]
+
+                summary = {'url': test_url, 'concurrency': pool_size}
+                for name in results[0]:
+                    summary[name] = reduce(add(name), results, 0)
+                writer.writerow(summary)
+
+                persec = summary['requests']/summary['time']
+                monitor.logger.info('%s - %d concurrency - %d requests - '
+                                    '%d errors - %.3f seconds - '
+                                    '%.2f requests/sec',
+                                    test_url,
+                                    pool_size,
+                                    summary['requests'],
+                                    summary['errors'],
+                                    summary['time'],
+                                    persec)
 
 
 class Bench(pulsar.Application):
@@ -175,9 +181,9 @@ class Bench(pulsar.Application):
             N = query.count()
             todo = max(0, MAXINT - N)
             if todo:
-                for _ in range(todo):
-                    world = mapper.world(randomNumber=randint(1, MAXINT))
-                    session.add(world)
+                rows = (dict(randomNumber=randint(1, MAXINT))
+                        for _ in range(todo))
+                mapper.bulk_load(mapper.world, rows, session=session)
 
         if todo:
             odm.logger.info('Created %d World models', todo)
@@ -0,0 +1,140 @@
+"""Micro-benchmark of ChoiceType result processing and enum binding.
+
+It processes the values of a choice column and of an enum column for
+``--rows`` rows with the processors of ``ChoiceType``, comparing the current
+implementation, interning choices and looking up enum members in
+dictionaries, with the legacy one, creating a new choice for each row and
+scanning enum members for each bound name.
+Memory is the peak allocated while keeping the processed values of all rows.
+It does not need a database server.
+
+    python choices.py --rows 1000000
+"""
+import argparse
+import time
+import tracemalloc
+from enum import Enum
+from random import choice
+
+from sqlalchemy import Integer, types
+from sqlalchemy.dialects import sqlite
+
+from odm.types import ChoiceType
+from odm.types.choice import Choice
+
+
+CHOICES = {'s': 'small', 'm': 'medium', 'l': 'large', 'x': 'extra large'}
+
+
+class Size(Enum):
+    small = 1
+    medium = 2
+    large = 3
+    extra_large = 4
+
+
+class LegacyChoiceType(types.TypeDecorator):
+    """The legacy ChoiceType, delegating to its implementation for each
+    value
+    """
+    impl = types.Unicode(255)
+
+    def __init__(self, choices, impl=None):
+        if isinstance(choices, type) and issubclass(choices, Enum):
+            self.type_impl = LegacyEnumTypeImpl(choices)
+        else:
+            self.type_impl = LegacyChoiceTypeImpl(choices)
+        super().__init__()
+        if impl:
+            self.impl = impl()
+
+    def process_bind_param(self, value, dialect):
+        return self.type_impl.process_bind_param(value, dialect)
+
+    def process_result_value(self, value, dialect):
+        return self.type_impl.process_result_value(value, dialect)
+
+
+class LegacyChoiceTypeImpl:
+
+    def __init__(self, choices):
+        self.choices_dict = dict(choices)
+
+    def process_bind_param(self, value, dialect):
+        if value and isinstance(value, Choice):
+            return value.code
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value:
+            return LegacyChoice(value, self.choices_dict[value])
+        return value
+
+
+class LegacyEnumTypeImpl:
+
+    def __init__(self, enum_class):
+        self.enum_class = enum_class
+
+    def process_bind_param(self, value, dialect):
+        ret = None
+        if isinstance(value, Enum):
+            ret = value.value
+        elif isinstance(value, str):
+            for e in self.enum_class:
+                if e.name.lower() == value.lower():
+                    ret = e.value
+        elif value:
+            ret = self.enum_class(value).value
+        return ret
+
+    def process_result_value(self, value, dialect):
+        return self.enum_class(value) if value else None
+
+
+class LegacyChoice:
+    # Legacy choices, without slots
+
+    def __init__(self, code, value):
+        self.code = code
+        self.value = value
+
+
+def measure(function, values):
+    start = time.perf_counter()
+    result = [function(value) for value in values]
+    taken = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = [function(value) for value in values]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return taken, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+    dialect = sqlite.dialect()
+    codes = [choice(list(CHOICES)) for _ in range(args.rows)]
+    names = [choice(['Small', 'MEDIUM', 'large', 'extra_large'])
+             for _ in range(args.rows)]
+    print('%-14s %10s %10s %12s' % ('', 'legacy', 'current', 'memory'))
+    for name, legacy, current, values in (
+            ('choice result',
+             LegacyChoiceType(CHOICES).result_processor(dialect, None),
+             ChoiceType(CHOICES).result_processor(dialect, None), codes),
+            ('enum bind',
+             LegacyChoiceType(Size, impl=Integer).bind_processor(dialect),
+             ChoiceType(Size, impl=Integer).bind_processor(dialect), names)):
+        legacy_time, legacy_memory = measure(legacy, values)
+        current_time, current_memory = measure(current, values)
+        print('%-14s %9.0fms %9.0fms %5.0fMB/%.0fMB' % (
+            name, 1000*legacy_time, 1000*current_time,
+            legacy_memory/2**20, current_memory/2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Benchmark of the JSON codecs of JSONType.
+
+It encodes and decodes ``--rows`` event payloads with each installed codec,
+the decoder being what the green dialect registers with psycopg2 for json
+and jsonb columns, and processes them as results of a ``JSONType`` column
+on sqlite. It does not need a database server.
+
+    python json_codecs.py --rows 100000
+"""
+import argparse
+import time
+from random import randint, random
+
+from sqlalchemy.dialects import sqlite
+
+from odm.types import JSONType
+from odm.types.json import CODECS, json_codec
+from pulsar.api import ImproperlyConfigured
+
+
+def payload(n):
+    return {
+        'id': n,
+        'type': 'order.updated',
+        'timestamp': 1500000000.0 + n,
+        'user': {'id': randint(1, 10000), 'name': 'user %d' % n,
+                 'tags': ['a', 'b', 'c']},
+        'items': [{'sku': 'sku-%d' % i, 'quantity': randint(1, 5),
+                   'price': round(100*random(), 2)} for i in range(5)],
+        'paid': n % 2 == 0,
+        'note': None
+    }
+
+
+def timed(function, values):
+    start = time.perf_counter()
+    for value in values:
+        function(value)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+    payloads = [payload(n) for n in range(args.rows)]
+    encoded = [json_codec('json').dumps(value) for value in payloads]
+    dialect = sqlite.dialect()
+    print('%-8s %10s %10s %10s' % ('codec', 'dumps', 'loads', 'result'))
+    for name in CODECS:
+        try:
+            codec = json_codec(name)
+        except ImproperlyConfigured:
+            print('%-8s %10s' % (name, 'missing'))
+            continue
+        result = JSONType(codec=codec).result_processor(dialect, None)
+        print('%-8s %9.0fms %9.0fms %9.0fms' % (
+            name, 1000*timed(codec.dumps, payloads),
+            1000*timed(codec.loads, encoded),
+            1000*timed(result, encoded)))
+
+
+if __name__ == '__main__':
+    main()
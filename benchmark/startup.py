@@ -0,0 +1,70 @@
+"""Startup benchmark of a mapper with many models.
+
+It measures the time from the import of a module of models to the first
+query on one of them, registering the module with an eager and a lazy
+mapper. It does not need a database server.
+
+    python startup.py --models 10 100 1000
+"""
+import argparse
+import sys
+import time
+import types
+from itertools import count
+
+from sqlalchemy import Column, Integer, String, DateTime
+
+from odm import mapper
+
+
+modules = count()
+
+
+def models_module(size):
+    """A new module with ``size`` models, added to ``sys.modules`` so that
+    models are recorded in it
+    """
+    module = types.ModuleType('startup_models_%d' % next(modules))
+    sys.modules[module.__name__] = module
+    Model = mapper.model_base()
+    for n in range(size):
+        attrs = dict(__module__=module.__name__,
+                     id=Column(Integer, primary_key=True),
+                     name=Column(String(80), index=True),
+                     created=Column(DateTime))
+        attrs.update(('field%d' % i, Column(Integer)) for i in range(10))
+        name = 'Model%d' % n
+        setattr(module, name, type(Model)(name, (Model,), attrs))
+    return module
+
+
+def startup(size, lazy):
+    start = time.perf_counter()
+    module = models_module(size)
+    try:
+        mp = mapper.Mapper('sqlite:///', lazy=lazy)
+        mp.register_module(module)
+        model = mp.model0
+        model.__table__.create(mp.get_engine())
+        with mp.begin() as session:
+            session.query(model).first()
+        return time.perf_counter() - start
+    finally:
+        sys.modules.pop(module.__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--models', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print('%8s %12s %12s' % ('models', 'eager', 'lazy'))
+    for size in args.models:
+        eager = min(startup(size, False) for _ in range(args.repeat))
+        lazy = min(startup(size, True) for _ in range(args.repeat))
+        print('%8d %11.1fms %11.1fms' % (size, 1000*eager, 1000*lazy))
+
+
+if __name__ == '__main__':
+    main()
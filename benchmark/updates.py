@@ -0,0 +1,91 @@
+"""Benchmark of the updates of the benchmark application.
+
+It compares updating ``--queries`` random rows of the world table with one
+transaction per row, as the ``updates_orm`` route, and with a single bulk
+update statement, as the ``updates`` route, ``--requests`` times. It runs
+on a sqlite file database by default, a postgresql url can be given with
+``--engine``.
+
+    python updates.py --queries 1 20 100 500
+"""
+import argparse
+import os
+import tempfile
+import time
+from random import randint
+
+import sqlalchemy as sql
+
+from odm.mapper import Mapper, model_base
+
+
+MAXINT = 10000
+Model = model_base()
+
+
+class World(Model):
+    id = sql.Column(sql.Integer, primary_key=True)
+    randomNumber = sql.Column(sql.Integer)
+
+
+def updates_orm(mapper, queries):
+    for _ in range(queries):
+        with mapper.begin() as session:
+            world = session.get(mapper.world, randint(1, MAXINT))
+            world.randomNumber = randint(1, MAXINT)
+            session.add(world)
+
+
+def updates(mapper, queries):
+    ids = [randint(1, MAXINT) for _ in range(queries)]
+    with mapper.begin() as session:
+        worlds = session.get_many(mapper.world, ids)
+        numbers = dict(((id, randint(1, MAXINT))
+                        for id in set(world.id for world in worlds)))
+        mapper.bulk_update(mapper.world,
+                           [{'id': id, 'randomNumber': numbers[id]}
+                            for id in sorted(numbers)],
+                           session=session)
+
+
+def timed(function, mapper, queries, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        function(mapper, queries)
+    return (time.perf_counter() - start)/requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, nargs='+',
+                        default=[1, 20, 100, 500])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--engine')
+    args = parser.parse_args()
+    path = None
+    engine = args.engine
+    if not engine:
+        path = tempfile.mktemp(suffix='.db')
+        engine = 'sqlite:///%s' % path
+    mapper = Mapper(engine)
+    mapper.register(World)
+    mapper.table_create()
+    try:
+        mapper.bulk_load(mapper.world,
+                         [{'id': id, 'randomNumber': randint(1, MAXINT)}
+                          for id in range(1, MAXINT + 1)])
+        print('%8s %14s %14s' % ('queries', 'updates_orm', 'updates'))
+        for queries in args.queries:
+            print('%8d %12.1fms %12.1fms' % (
+                queries,
+                1000*timed(updates_orm, mapper, queries, args.requests),
+                1000*timed(updates, mapper, queries, args.requests)))
+    finally:
+        mapper.table_drop()
+        mapper.close()
+        if path:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
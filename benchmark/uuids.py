@@ -0,0 +1,65 @@
+"""Micro-benchmark of UUIDType binding, result processing and generation.
+
+It binds and processes as results ``--rows`` UUIDs with the processors of
+``UUIDType`` for the green dialect, comparing the current implementation,
+passing UUIDs to and from the psycopg2 UUID adapter and typecaster as they
+are, with the legacy one, converting them to strings and parsing them back.
+It also compares the generation of random UUIDs, version 4, with time
+ordered ones, version 7. It does not need a database server.
+
+    python uuids.py --rows 1000000
+"""
+import argparse
+import time
+import uuid
+
+from odm.types import UUIDType
+from odm.types.uuid import uuid7
+from odm.dialects.postgresql import PGDGreen
+
+
+def legacy_bind(value):
+    # UUIDType to string and the psycopg2 dialect back to UUID
+    return uuid.UUID(str(value))
+
+
+def legacy_result(value):
+    # the psycopg2 dialect to string and UUIDType back to UUID
+    return uuid.UUID(str(value))
+
+
+def timed(function, values):
+    start = time.perf_counter()
+    for value in values:
+        function(value)
+    return time.perf_counter() - start
+
+
+def generate(function, rows):
+    start = time.perf_counter()
+    for _ in range(rows):
+        function()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+    dialect = PGDGreen()
+    impl = UUIDType().dialect_impl(dialect)
+    bind = impl.bind_processor(dialect)
+    result = impl.result_processor(dialect, None)
+    values = [uuid.uuid4() for _ in range(args.rows)]
+    print('%-10s %10s %10s' % ('', 'legacy', 'current'))
+    for name, legacy, current in (('bind', legacy_bind, bind),
+                                  ('result', legacy_result, result)):
+        print('%-10s %9.0fms %9.0fms' % (
+            name, 1000*timed(legacy, values), 1000*timed(current, values)))
+    print('%-10s %9.0fms %9.0fms' % (
+        'v4 vs v7', 1000*generate(uuid.uuid4, args.rows),
+        1000*generate(uuid7, args.rows)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Micro-benchmark of the psycopg2 wait callback of the green dialect.
+
+It measures the overhead of waiting for file descriptor events in a child
+greenlet, without a database server, by simulating queries which need a
+given number of polls before completing. The legacy implementation, which
+creates and registers a new future at every poll, is compared with the
+current one.
+
+    python waitfd.py --queries 20000 --polls 4 --concurrency 50
+"""
+import argparse
+import asyncio
+import socket
+import time
+from asyncio import Future
+
+from greenlet import getcurrent
+
+from pulsar.apps.greenio import GreenPool
+
+from odm.dialects.postgresql import green
+
+
+class FakeConnection:
+    """Connection needing ``polls`` read events to complete a query
+    """
+    def __init__(self):
+        self.polls = 0
+        self.sock, self.server = socket.socketpair()
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def poll(self):
+        try:
+            self.sock.recv(1)
+        except BlockingIOError:
+            pass
+        if not self.polls:
+            return green.extensions.POLL_OK
+        self.polls -= 1
+        self.server.send(b'x')
+        return green.extensions.POLL_READ
+
+
+def legacy_wait_callback(conn):
+    while True:
+        state = conn.poll()
+        if state == green.extensions.POLL_OK:
+            break
+        elif state == green.extensions.POLL_READ:
+            legacy_wait_fd(conn)
+        else:
+            legacy_wait_fd(conn, read=False)
+
+
+def legacy_wait_fd(conn, read=True):
+    current = getcurrent()
+    parent = current.parent
+    assert parent, '"_wait_fd" must be called by greenlet with a parent'
+    try:
+        fileno = conn.fileno()
+    except AttributeError:
+        fileno = conn
+    future = Future()
+    if read:
+        future._loop.add_reader(fileno, legacy_done_wait_fd, fileno, future,
+                                read)
+    else:
+        future._loop.add_writer(fileno, legacy_done_wait_fd, fileno, future,
+                                read)
+    parent.switch(future)
+    future.result()
+
+
+def legacy_done_wait_fd(fd, future, read):
+    try:
+        if read:
+            future._loop.remove_reader(fd)
+        else:
+            future._loop.remove_writer(fd)
+    except Exception as exc:
+        future.set_exception(exc)
+    else:
+        future.set_result(None)
+
+
+def run_queries(callback, conn, queries, polls):
+    for _ in range(queries):
+        conn.polls = polls
+        callback(conn)
+
+
+async def bench(pool, callback, args):
+    conns = [FakeConnection() for _ in range(args.concurrency)]
+    queries = args.queries // args.concurrency
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        pool.submit(run_queries, callback, conn, queries, args.polls)
+        for conn in conns
+    ])
+    taken = time.perf_counter() - start
+    for conn in conns:
+        conn.sock.close()
+        conn.server.close()
+    return 1e6 * taken / (queries * args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--polls', type=int, default=4,
+                        help='read events per query')
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    pool = GreenPool(args.concurrency, loop=loop)
+    for name, callback in (('legacy', legacy_wait_callback),
+                           ('current', green.psycopg2_wait_callback)):
+        took = loop.run_until_complete(bench(pool, callback, args))
+        print('%-8s %8.2f us per query' % (name, took))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Asyncio facade of the object data mapper"""
+import sys
+from asyncio import Lock
+
+from pulsar.apps.greenio import greenlet, getcurrent, run_in_greenlet
+
+
+class GreenContext:
+    """A greenlet executing, one after the other, functions invoked from
+    asyncio code.
+
+    When called from the main greenlet it returns a coroutine resolved with
+    the result of the function, which runs on the greenlet of this context.
+    When called from a child greenlet the function is executed straight away
+    and its result returned.
+    """
+    def __init__(self):
+        self._green = None
+        self._lock = None
+
+    def __call__(self, func, *args, **kwargs):
+        if getcurrent().parent:
+            return func(*args, **kwargs)
+        return self._switch(func, args, kwargs)
+
+    def close(self):
+        """Terminate the greenlet of this context
+        """
+        if self._green and not self._green.dead:
+            self._green.switch(None, None, None)
+        self._green = None
+
+    async def _switch(self, func, args, kwargs):
+        if self._lock is None:
+            self._lock = Lock()
+        async with self._lock:
+            if self._green is None:
+                self._green = greenlet(self._run)
+            result = self._green.switch(func, args, kwargs)
+            # keep on switching back to the greenlet until it is done
+            while not isinstance(result, _Result):
+                try:
+                    value = await result
+                except Exception:
+                    result = self._green.throw(*sys.exc_info())
+                else:
+                    result = self._green.switch(value)
+            return result.get()
+
+    def _run(self, func, args, kwargs):
+        parent = self._green.parent
+        while func:
+            try:
+                result = _Result(func(*args, **kwargs))
+            except Exception as exc:
+                result = _Result(exc=exc)
+            func, args, kwargs = parent.switch(result)
+
+
+class AsyncSession:
+    """A session usable from asyncio code.
+
+    All operations of the session run on the same :class:`.GreenContext`,
+    one greenlet for the whole transaction. It is obtained via
+    :meth:`AsyncMapper.begin`::
+
+        async with amapper.begin() as session:
+            task = await session.get(amapper.task, task_id)
+            task.done = True
+
+    Instances are not expired on commit by default, lazy loading of
+    attributes from asyncio code is not possible.
+    """
+    def __init__(self, mapper, **options):
+        options.setdefault('expire_on_commit', False)
+        self.mapper = mapper
+        self.session = mapper.session(**options)
+        self._context = GreenContext()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                await self.commit()
+            else:
+                await self.rollback()
+        finally:
+            await self.close()
+
+    def run(self, func, *args, **kwargs):
+        """Run ``func(session, *args, **kwargs)`` in the green context of
+        this session
+        """
+        return self._context(func, self.session, *args, **kwargs)
+
+    def add(self, instance):
+        self.session.add(instance)
+
+    def add_all(self, instances):
+        self.session.add_all(instances)
+
+    def get(self, model, ident):
+        return self._context(self.session.get, model, ident)
+
+    def execute(self, statement, params=None, **kwargs):
+        return self._context(self.session.execute, statement, params,
+                             **kwargs)
+
+    def scalar(self, statement, params=None, **kwargs):
+        return self._context(self.session.scalar, statement, params,
+                             **kwargs)
+
+    def flush(self):
+        return self._context(self.session.flush)
+
+    def commit(self):
+        return self._context(self.session.commit)
+
+    def rollback(self):
+        return self._context(self.session.rollback)
+
+    def close(self):
+        """Close the session and terminate its green context
+        """
+        if getcurrent().parent:
+            self.session.close()
+        else:
+            return self._close()
+
+    async def _close(self):
+        try:
+            await self._context(self.session.close)
+        finally:
+            self._context.close()
+
+
+class AsyncMapper:
+    """Asyncio facade of a :class:`.Mapper`.
+
+    Models are accessed as with the wrapped mapper while operations
+    requiring the database are awaitable, without the need of submitting
+    functions to a :class:`.GreenPool`.
+    """
+    def __init__(self, mapper):
+        self.mapper = mapper
+
+    def __getattr__(self, name):
+        return getattr(self.mapper, name)
+
+    def __getitem__(self, model):
+        return self.mapper[model]
+
+    def begin(self, **options):
+        """An :class:`.AsyncSession` to use as an asynchronous context
+        manager providing a transactional scope
+        """
+        return AsyncSession(self.mapper, **options)
+
+    def run(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` in a new greenlet, or in the
+        current one when invoked from a child greenlet
+        """
+        if getcurrent().parent:
+            return func(*args, **kwargs)
+        return run_in_greenlet(func)(*args, **kwargs)
+
+
+class _Result:
+    __slots__ = ('value', 'exc')
+
+    def __init__(self, value=None, exc=None):
+        self.value = value
+        self.exc = exc
+
+    def get(self):
+        if self.exc is not None:
+            raise self.exc
+        return self.value
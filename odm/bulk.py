@@ -0,0 +1,252 @@
+"""Bulk operations on tables"""
+from datetime import date, datetime, time
+from itertools import islice
+
+from sqlalchemy import and_, bindparam, cast
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FromClause, ColumnClause
+
+
+class Values(FromClause):
+    """A ``VALUES`` list usable as a FROM clause::
+
+        (VALUES (...), (...)) AS name (column1, column2, ...)
+
+    :param columns: table columns defining names and types of the values
+    :param rows: list of dictionaries keyed by column keys
+    :param name: the alias of the values list
+    """
+    named_with_column = True
+
+    def __init__(self, columns, rows, name='data'):
+        self.value_columns = columns
+        self.rows = rows
+        self.name = name
+
+    def _populate_column_collection(self):
+        for column in self.value_columns:
+            self._columns[column.key] = ColumnClause(column.name,
+                                                     type_=column.type,
+                                                     _selectable=self)
+
+    @property
+    def _from_objects(self):
+        return [self]
+
+
+@compiles(Values)
+def compile_values(element, compiler, asfrom=False, **kw):
+    columns = element.value_columns
+    rows = []
+    for index, row in enumerate(element.rows):
+        values = []
+        for column in columns:
+            value = bindparam(None, row[column.key], type_=column.type)
+            # Casting the first row sets the types of the values list
+            if not index:
+                value = cast(value, column.type)
+            values.append(compiler.process(value, **kw))
+        rows.append('(%s)' % ', '.join(values))
+    text = 'VALUES %s' % ', '.join(rows)
+    if asfrom:
+        quote = compiler.preparer.quote
+        text = '(%s) AS %s (%s)' % (
+            text, quote(element.name),
+            ', '.join(quote(column.name) for column in columns))
+    return text
+
+
+class BulkUpdate:
+    """Update many rows of a table in one go"""
+
+    def postgresql(self, conn, table, rows):
+        """A single ``UPDATE ... FROM (VALUES ...)`` statement
+        """
+        columns = [table.c[key] for key in rows[0]]
+        data = Values(columns, rows)
+        where = [column == data.c[column.key] for column in columns
+                 if column.primary_key]
+        values = dict(((column, data.c[column.key]) for column in columns
+                       if not column.primary_key))
+        statement = table.update().values(values).where(and_(*where))
+        return conn.execute(statement).rowcount
+
+    def default(self, conn, table, rows):
+        """An ``UPDATE`` statement executed with ``executemany``
+        """
+        columns = [table.c[key] for key in rows[0]]
+        where = [column == bindparam('b_%s' % column.key)
+                 for column in columns if column.primary_key]
+        values = dict(((column, bindparam('b_%s' % column.key))
+                       for column in columns if not column.primary_key))
+        statement = table.update().values(values).where(and_(*where))
+        params = [dict((('b_%s' % key, value) for key, value in row.items()))
+                  for row in rows]
+        return conn.execute(statement, params).rowcount
+
+
+class BulkLoad:
+    """Insert many rows in a table, streaming them in chunks so that memory
+    does not depend on the number of rows
+    """
+
+    def postgresql(self, conn, table, rows, chunk_size):
+        """Stream rows with ``COPY ... FROM STDIN`` when using psycopg2
+
+        psycopg2 does not support COPY with a wait callback, which the
+        green dialect installs, rows are then inserted with ``executemany``.
+        """
+        if conn.dialect.driver != 'psycopg2' or has_wait_callback():
+            return self.default(conn, table, rows, chunk_size)
+        rows = iter(rows)
+        try:
+            first = next(rows)
+        except StopIteration:
+            return 0
+        columns = insert_columns(table, first)
+        preparer = conn.dialect.identifier_preparer
+        sql = 'COPY %s (%s) FROM STDIN' % (
+            preparer.format_table(table),
+            ', '.join(preparer.quote(column.name) for column in columns))
+        data = CopyData(conn.dialect, columns, rows, chunk_size, first)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(sql, data)
+        finally:
+            cursor.close()
+        return data.count
+
+    def default(self, conn, table, rows, chunk_size):
+        """Multi-row inserts executed with ``executemany``
+        """
+        rows = iter(rows)
+        statement = table.insert()
+        count = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return count
+            conn.execute(statement, chunk)
+            count += len(chunk)
+
+
+class CopyData:
+    """File-like object reading rows in the text format of postgresql COPY.
+
+    Values are converted by the bind processors of the column types,
+    ``chunk_size`` rows at each :meth:`read`. As with ``insert``, columns
+    missing from a row are given their python side default, or ``NULL``
+    when they have none.
+    """
+    def __init__(self, dialect, columns, rows, chunk_size, first=None):
+        self.columns = columns
+        self.rows = rows
+        self.chunk_size = chunk_size
+        self.first = first
+        self.count = 0
+        self.processors = [
+            column.type.dialect_impl(dialect).bind_processor(dialect)
+            for column in columns
+        ]
+
+    def read(self, size=-1):
+        chunk = list(islice(self.rows, self.chunk_size))
+        if self.first is not None:
+            chunk.insert(0, self.first)
+            self.first = None
+        self.count += len(chunk)
+        return ''.join(self.line(row) for row in chunk)
+
+    def line(self, row):
+        values = []
+        for column, processor in zip(self.columns, self.processors):
+            if column.key in row:
+                value = row[column.key]
+            elif column.default is None:
+                values.append('\\N')
+                continue
+            else:
+                value = column_default(column)
+            if processor:
+                value = processor(value)
+            values.append(copy_value(value))
+        return '%s\n' % '\t'.join(values)
+
+
+def insert_columns(table, row):
+    """Columns to insert given the keys of ``row``, including columns with
+    a python side default
+    """
+    return [column for column in table.columns
+            if column.key in row or (column.default is not None and
+                                     not column.default.is_sequence)]
+
+
+def column_default(column):
+    """The python side default of ``column``, SQL expression defaults
+    cannot be copied
+    """
+    default = column.default
+    if default is None:
+        return None
+    elif default.is_callable:
+        return default.arg(None)
+    elif default.is_clause_element:
+        raise NotImplementedError(
+            'Cannot copy the SQL expression default of column "%s", give '
+            'its values in rows' % column.key)
+    else:
+        return default.arg
+
+
+def copy_value(value):
+    """Representation of ``value`` in the text format of COPY"""
+    if value is None:
+        return '\\N'
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\\\x%s' % bytes(value).hex()
+    elif isinstance(value, (datetime, date, time)):
+        value = value.isoformat()
+    elif isinstance(value, (list, tuple)):
+        value = array_value(value)
+    return escape_copy(str(value))
+
+
+def array_value(value):
+    items = []
+    for item in value:
+        if item is None:
+            items.append('NULL')
+        elif isinstance(item, (list, tuple)):
+            items.append(array_value(item))
+        else:
+            item = str(item).replace('\\', '\\\\').replace('"', '\\"')
+            items.append('"%s"' % item)
+    return '{%s}' % ','.join(items)
+
+
+def escape_copy(text):
+    return (text.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def has_wait_callback():
+    """Check if a psycopg2 wait callback is installed
+    """
+    from psycopg2.extensions import get_wait_callback
+    return get_wait_callback() is not None
+
+
+def bulk_operation(conn, oper, *args):
+    """Perform a bulk operation using the implementation for the
+    dialect of ``conn``
+    """
+    scripts = bulk_scripts[oper]
+    operation = getattr(scripts, conn.dialect.name, scripts.default)
+    return operation(conn, *args)
+
+
+bulk_scripts = {'update': BulkUpdate(),
+                'load': BulkLoad()}
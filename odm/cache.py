@@ -0,0 +1,204 @@
+"""Second level cache of model rows shared by sessions"""
+import time
+from copy import deepcopy
+from collections import OrderedDict
+
+from sqlalchemy import util
+from sqlalchemy.orm import class_mapper, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value, instance_state
+
+
+class CacheBackend:
+    """Interface of a second level cache backend.
+
+    Keys are strings, values dictionaries of column values.
+    A backend calls :attr:`on_evict`, when set, with the key of an entry
+    it removes because it expired or to make room for new ones.
+    """
+    on_evict = None
+
+    def get(self, key):
+        """The value for ``key``, ``None`` if not available
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        """Delete entries with keys starting with ``prefix``.
+
+        Backends not able to select keys clear the whole cache.
+        """
+        self.clear()
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU cache with a time to live for each entry
+
+    :param size: maximum number of entries
+    """
+    def __init__(self, size=10000):
+        self.size = size
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return
+        expiry, value = item
+        if expiry is not None and expiry <= time.time():
+            del self._data[key]
+            self._evicted(key)
+            return
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        expiry = time.time() + ttl if ttl else None
+        self._data[key] = (expiry, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            key, _ = self._data.popitem(last=False)
+            self._evicted(key)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        for key in [key for key in self._data if key.startswith(prefix)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def _evicted(self, key):
+        if self.on_evict:
+            self.on_evict(key)
+
+
+class ModelCache:
+    """Read-through cache of model instances by primary key.
+
+    Only models with a ``__cache__`` attribute are cached. It can be
+    ``True`` or the time to live, in seconds, of their entries, ``ttl``
+    being the default. Entries are invalidated when a session flushes
+    changes to the corresponding rows, all entries of a model when a
+    session executes ``Query.update()`` or ``Query.delete()`` on it.
+
+    :param backend: a :class:`.CacheBackend`, :class:`.MemoryCache` by
+        default
+    :param ttl: default time to live of entries in seconds
+    """
+    def __init__(self, backend=None, ttl=60):
+        self.backend = MemoryCache() if backend is None else backend
+        self.backend.on_evict = self._evicted
+        self.ttl = ttl
+        self._stats = {}
+
+    def ttl_for(self, model):
+        """Time to live of cache entries for ``model``, ``None`` when the
+        model is not cached
+        """
+        cache = getattr(model, '__cache__', None)
+        if cache is True:
+            return self.ttl
+        elif cache:
+            return cache
+
+    def get(self, session, model, ident, load):
+        """Instance of ``model`` with primary key ``ident``.
+
+        Instances in the identity map of ``session`` are returned straight
+        away, otherwise the cache is checked before calling
+        ``load(model, ident)``.
+        """
+        ttl = self.ttl_for(model)
+        if ttl is None:
+            return load(model, ident)
+        mapper = class_mapper(model)
+        ident = tuple(util.to_list(ident))
+        instance = session.identity_map.get(
+            mapper.identity_key_from_primary_key(ident))
+        if instance is not None:
+            return instance
+        key = cache_key(mapper.local_table, ident)
+        stats = self.stats_for(mapper.local_table)
+        values = self.backend.get(key)
+        if values is not None:
+            stats['hits'] += 1
+            instance = mapper.class_manager.new_instance()
+            for name, value in values.items():
+                set_committed_value(instance, name, copy_value(value))
+            make_transient_to_detached(instance)
+            session.add(instance)
+            return instance
+        stats['misses'] += 1
+        instance = load(model, ident)
+        if instance is not None and type(instance) is mapper.class_:
+            values = row_values(mapper, instance)
+            if values is not None:
+                self.backend.set(key, values, ttl)
+        return instance
+
+    def invalidate(self, table, ident=None):
+        """Invalidate the entry of the row of ``table`` with primary
+        key ``ident``, all entries of ``table`` when ``ident`` is ``None``
+        """
+        if ident is None:
+            self.backend.delete_prefix('%s:' % table.key)
+        else:
+            self.backend.delete(cache_key(table, util.to_list(ident)))
+
+    def stats_for(self, table):
+        key = table.key
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = dict(hits=0, misses=0, evictions=0)
+            self._stats[key] = stats
+        return stats
+
+    def stats(self):
+        """Dictionary of hit, miss and eviction statistics by table
+        """
+        return dict(((key, value.copy())
+                     for key, value in self._stats.items()))
+
+    def clear(self):
+        self.backend.clear()
+
+    def _evicted(self, key):
+        stats = self._stats.get(key.split(':', 1)[0])
+        if stats is not None:
+            stats['evictions'] += 1
+
+
+def cache_key(table, ident):
+    return '%s:%s' % (table.key, ':'.join(str(value) for value in ident))
+
+
+def row_values(mapper, instance):
+    # Column values of a loaded instance, None if not all loaded
+    loaded = instance_state(instance).dict
+    values = {}
+    for prop in mapper.column_attrs:
+        if prop.key not in loaded:
+            return
+        values[prop.key] = copy_value(loaded[prop.key])
+    return values
+
+
+def copy_value(value):
+    # Mutable values must not be shared by instances
+    if isinstance(value, (dict, list)):
+        return deepcopy(value)
+    return value
@@ -0,0 +1,84 @@
+"""Run an operation on several engines concurrently"""
+from asyncio import Semaphore, gather
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.pool import SingletonThreadPool
+
+from pulsar.apps.greenio import wait, run_in_greenlet, getcurrent
+
+
+class EngineErrors(Exception):
+    """Failure of an operation on several engines.
+
+    .. attribute:: errors
+
+        Dictionary of engine-exception pairs
+    """
+    def __init__(self, operation, errors):
+        self.operation = operation
+        self.errors = errors
+        super().__init__('%s failed on %d engines: %s' % (
+            operation, len(errors),
+            '; '.join('%r: %s' % (engine.url, exc)
+                      for engine, exc in errors.items())))
+
+
+def engines_map(operation, engines, concurrency=8, green=False):
+    """Call ``operation(engine)`` for each engine, at most ``concurrency``
+    at the time.
+
+    Operations run on new greenlets when ``green`` and invoked from a child
+    greenlet, on threads otherwise. Engines with thread local
+    connections, such as sqlite in memory databases, are not used from
+    other threads so that operations run one after the other.
+    When an operation fails, all other operations are still completed and
+    its exception raised, an :class:`.EngineErrors` is raised when more
+    than one fails.
+
+    :return: the list of results in the order of ``engines``
+    """
+    engines = list(engines)
+    if green and getcurrent().parent:
+        outcomes = wait(_green_map(operation, engines, concurrency))
+    elif (concurrency > 1 and len(engines) > 1 and
+            not any(isinstance(engine.pool, SingletonThreadPool)
+                    for engine in engines)):
+        with ThreadPoolExecutor(min(concurrency, len(engines))) as executor:
+            futures = [executor.submit(_call, operation, engine)
+                       for engine in engines]
+            outcomes = [future.result() for future in futures]
+    else:
+        outcomes = [_call(operation, engine) for engine in engines]
+
+    errors = {}
+    results = []
+    for engine, (result, exc) in zip(engines, outcomes):
+        if exc is not None:
+            errors[engine] = exc
+        results.append(result)
+    if len(errors) == 1:
+        raise next(iter(errors.values()))
+    elif errors:
+        raise EngineErrors(getattr(operation, '__name__', 'operation'),
+                           errors)
+    return results
+
+
+def _call(operation, engine):
+    try:
+        return operation(engine), None
+    except Exception as exc:
+        return None, exc
+
+
+_green_call = run_in_greenlet(_call)
+
+
+async def _green_map(operation, engines, concurrency):
+    semaphore = Semaphore(concurrency)
+
+    async def _(engine):
+        async with semaphore:
+            return await _green_call(operation, engine)
+
+    return await gather(*[_(engine) for engine in engines])
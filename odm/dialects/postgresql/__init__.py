@@ -1,16 +1,53 @@
+from weakref import WeakKeyDictionary
+
 from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
 from sqlalchemy.dialects import registry
 
+from odm.types.json import json_codec as get_json_codec
+
 from .pool import GreenletPool
+from .prepared import StatementCache, DDL
 
 
 class PGDGreen(PGDialect_psycopg2):
     '''PostgreSql dialect using psycopg2 and greenlet to obtain an
     implicit asynchronous database connection.
+
+    When ``prepared_statements`` is positive, compiled statements are
+    executed as prepared statements, via ``PREPARE`` and ``EXECUTE``, and
+    up to ``prepared_statements`` of them are cached on each connection.
+    The caches of all connections are cleared when a DDL statement is
+    executed on any of them, each cache being cleared before its next
+    use, and a cache is not shared by a new connection replacing a
+    recycled or invalidated one. DDL statements executed by other
+    processes are not detected.
+    The ``prepare`` execution option set to ``False`` disables the cache
+    on a connection.
+
+    JSON values are encoded and decoded with ``json_codec``, the standard
+    library by default (see :func:`.json_codec`), unless the
+    ``json_serializer`` and ``json_deserializer`` options are given. The
+    decoder is registered with the json and jsonb typecasters of
+    psycopg2 on each new connection.
     '''
     poolclass = GreenletPool
     is_green = True
 
+    def __init__(self, prepared_statements=0, json_codec=None, **kwargs):
+        super().__init__(**kwargs)
+        codec = get_json_codec(json_codec)
+        self.json_codec = codec
+        if self._json_serializer is None:
+            self._json_serializer = codec.dumps
+        if self._json_deserializer is None:
+            self._json_deserializer = codec.loads
+        self.prepared_statements = prepared_statements
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+        # incremented by DDL statements, invalidating all caches
+        self.ddl_generation = 0
+        self._statement_caches = WeakKeyDictionary()
+
     @classmethod
     def dbapi(cls):
         from odm.dialects.postgresql import green
@@ -22,5 +59,54 @@ class PGDGreen(PGDialect_psycopg2):
         opts.pop('pool_timeout', None)
         return [[], opts]
 
+    def do_execute(self, cursor, statement, parameters, context=None):
+        if self.prepared_statements:
+            statement = self._prepared(cursor, statement, context)
+        cursor.execute(statement, parameters)
+
+    def prepared_stats(self):
+        '''Dictionary of prepared statements cache statistics
+        '''
+        return dict(hits=self.prepared_hits,
+                    misses=self.prepared_misses,
+                    size=sum(len(c) for c in self._statement_caches.values()))
+
+    def statement_cache(self, dbapi_connection):
+        '''The :class:`.StatementCache` of a psycopg2 connection
+        '''
+        cache = self._statement_caches.get(dbapi_connection)
+        if cache is None:
+            cache = StatementCache(self.prepared_statements,
+                                   self.ddl_generation)
+            self._statement_caches[dbapi_connection] = cache
+        return cache
+
+    def _prepared(self, cursor, statement, context):
+        # Return the statement to execute with cursor
+        if context is None or context.compiled is None or context.isddl:
+            if DDL.match(statement):
+                self.ddl_generation += 1
+                cache = self.statement_cache(cursor.connection)
+                cache.clear(cursor)
+                cache.generation = self.ddl_generation
+            return statement
+        if (context._is_server_side or
+                not context.execution_options.get('prepare', True)):
+            return statement
+        cache = self.statement_cache(cursor.connection)
+        if cache.generation != self.ddl_generation:
+            cache.clear(cursor)
+            cache.generation = self.ddl_generation
+        prepared = cache.get(statement)
+        if prepared is None:
+            self.prepared_misses += 1
+            prepared = cache.prepare(cursor, statement, context.compiled,
+                                     self, self.dbapi.Error)
+            if prepared is None:
+                return statement
+        else:
+            self.prepared_hits += 1
+        return prepared.execute
+
 
 registry.register("postgresql.green", "odm.dialects.postgresql", "PGDGreen")
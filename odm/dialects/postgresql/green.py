@@ -1,10 +1,13 @@
-from asyncio import Future
+from asyncio import get_event_loop
+from weakref import WeakKeyDictionary
 
 from greenlet import getcurrent
 import psycopg2
 from psycopg2 import *  # noqa
 from psycopg2 import extensions, OperationalError
 
+from pulsar.apps.greenio.utils import GreenletWorker
+
 
 __version__ = psycopg2.__version__
 
@@ -18,20 +21,122 @@ def psycopg2_wait_callback(conn):
     This function must be invoked from a coroutine with parent, therefore
     invoking it from the main greenlet will raise an exception.
     """
+    waiter = None
     while True:
         state = conn.poll()
         if state == extensions.POLL_OK:
             # Done with waiting
             break
-        elif state == extensions.POLL_READ:
-            _wait_fd(conn)
+        if waiter is None:
+            waiter = _get_waiter(conn)
+        if state == extensions.POLL_READ:
+            waiter.wait(conn)
         elif state == extensions.POLL_WRITE:
-            _wait_fd(conn, read=False)
+            waiter.wait(conn, read=False)
         else:  # pragma    nocover
             raise OperationalError("Bad result from poll: %r" % state)
 
 
+class GreenWaiter:
+    '''Wait for events on the file descriptor of a connection.
+
+    One waiter is created for each connection and reused for every poll.
+    The future the parent greenlet waits for is created once, when
+    the waiting greenlet first switches back to it. Afterwards, as long as
+    the greenlet is a :class:`.GreenPool` worker, the event loop callback
+    switches straight to it and the future is only resolved once the
+    greenlet switches to something other than this waiter.
+
+    ``switches`` counts the waits, each one switching out of the waiting
+    greenlet and back.
+    '''
+    __slots__ = ('loop', 'fileno', 'read', 'green', 'future', 'direct',
+                 'switches', '__weakref__')
+
+    def __init__(self, loop=None):
+        self.loop = loop or get_event_loop()
+        self.future = None
+        self.switches = 0
+
+    def wait(self, conn, read=True):
+        '''Wait for a read or write event on the file descriptor of
+        ``conn`` and switch back to the current greenlet once it occurs.
+        '''
+        current = getcurrent()
+        parent = current.parent
+        assert parent, '"_wait_fd" must be called by greenlet with a parent'
+        try:
+            self.fileno = conn.fileno()
+        except AttributeError:
+            self.fileno = conn
+        self.read = read
+        self.green = current
+        self.switches += 1
+        if read:
+            self.loop.add_reader(self.fileno, self._ready)
+        else:
+            self.loop.add_writer(self.fileno, self._ready)
+        try:
+            if self.future is None:
+                self.future = self.loop.create_future()
+                self.direct = isinstance(current, GreenletWorker)
+                parent.switch(self.future)
+            else:
+                # switch back to the _ready callback
+                parent.switch(self)
+        except BaseException:
+            self._remove()
+            self.future = None
+            raise
+
+    def _remove(self):
+        if self.read:
+            self.loop.remove_reader(self.fileno)
+        else:
+            self.loop.remove_writer(self.fileno)
+
+    def _ready(self):
+        self._remove()
+        future, green = self.future, self.green
+        if not self.direct:
+            self.future = self.green = None
+            future.set_result(None)
+            return
+        try:
+            value = green.switch()
+        except Exception as exc:
+            self.future = self.green = None
+            future.set_exception(exc)
+        else:
+            if value is not self:
+                # the greenlet is waiting for something else, hand it
+                # to the parent greenlet
+                self.future = self.green = None
+                future.set_result(value)
+
+
 # INTERNALS
+_waiters = WeakKeyDictionary()
+
+
+def _get_waiter(conn):
+    try:
+        waiter = _waiters.get(conn)
+    except TypeError:
+        # A file number
+        return GreenWaiter()
+    if waiter is None:
+        waiter = GreenWaiter()
+        _waiters[conn] = waiter
+    return waiter
+
+
+def switches(conn):
+    '''Number of greenlet switches waiting for ``conn``
+    '''
+    waiter = _waiters.get(conn)
+    return waiter.switches if waiter else 0
+
 
 def _wait_fd(conn, read=True):
     '''Wait for an event on file descriptor ``fd``.
@@ -43,35 +148,7 @@ def _wait_fd(conn, read=True):
     This function must be invoked from a coroutine with parent, therefore
     invoking it from the main greenlet will raise an exception.
     '''
-    current = getcurrent()
-    parent = current.parent
-    assert parent, '"_wait_fd" must be called by greenlet with a parent'
-    try:
-        fileno = conn.fileno()
-    except AttributeError:
-        fileno = conn
-    future = Future()
-    # When the event on fd occurs switch back to the current greenlet
-    if read:
-        future._loop.add_reader(fileno, _done_wait_fd, fileno, future, read)
-    else:
-        future._loop.add_writer(fileno, _done_wait_fd, fileno, future, read)
-    # switch back to parent greenlet
-    parent.switch(future)
-    # Back on the child greenlet. Raise error if there is one
-    future.result()
-
-
-def _done_wait_fd(fd, future, read):
-    try:
-        if read:
-            future._loop.remove_reader(fd)
-        else:
-            future._loop.remove_writer(fd)
-    except Exception as exc:
-        future.set_exception(exc)
-    else:
-        future.set_result(None)
+    _get_waiter(conn).wait(conn, read)
 
 
 try:
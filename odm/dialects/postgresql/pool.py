@@ -1,24 +1,66 @@
-from sqlalchemy import pool
+import time
+from collections import deque
+from asyncio import get_event_loop, gather
 
-from pulsar.apps.greenio import GreenLock
+from sqlalchemy import pool, exc
+
+from pulsar.apps.greenio import wait, run_in_greenlet
 
 
 class GreenletPool(pool.Pool):
-    '''A Pool that maintains one connection per greenlet.
+    '''A bounded Pool of connections shared by greenlets.
+
+    At most ``pool_size`` connections are kept open, plus up to
+    ``max_overflow`` temporary connections which are closed as soon as they
+    are returned to the pool and no greenlet is waiting for them.
+    When all connections are checked out, greenlets requesting a connection
+    are queued and served in FIFO order as connections are returned to the
+    pool. A greenlet which waits for more than ``timeout`` seconds fails with
+    a :class:`~sqlalchemy.exc.TimeoutError`. When a new connection fails, the
+    first queued greenlet is woken up to connect in its place.
+
+    With ``pre_ping`` a connection idle for at least ``ping_interval``
+    seconds is tested before being checked out and replaced if dead.
+    Connections idle for more than ``idle_timeout`` seconds are closed
+    until the pool is down to ``min_size`` connections, while ``recycle``
+    limits the age of a connection.
 
-    Maintains one connection per each greenlet, never moving a
-    connection to a greenlet other than the one which it was
-    created in.
+    New connections are established concurrently, each one on the greenlet
+    requesting it, up to ``connect_concurrency`` at a time. The very first
+    connection is always established on its own since it initialises the
+    dialect. When ``prewarm`` is given, the first checkout opens that number
+    of connections in the background.
     '''
-    def __init__(self, creator, pool_size=10, timeout=30, **kw):
+    def __init__(self, creator, pool_size=10, timeout=30, max_overflow=0,
+                 connect_concurrency=5, prewarm=0, pre_ping=False,
+                 ping_interval=0, min_size=0, idle_timeout=None, **kw):
         super().__init__(creator, **kw)
-        self._lock = GreenLock()
         self._max_size = pool_size
+        self._max_overflow = max(max_overflow, 0)
         self._timeout = timeout
+        self._pre_ping = pre_ping
+        self._ping_interval = ping_interval
+        self._min_size = min(min_size, pool_size)
+        self._idle_timeout = idle_timeout
+        self._reaper = None
+        self._connect_concurrency = max(connect_concurrency, 1)
+        self._prewarm = min(prewarm, pool_size)
+        self._prewarm_pending = self._prewarm > 0
+        self._connecting = 0
+        self._opening = 0
+        self._connect_waiters = deque()
         self._connections = set()
-        self._available_connections = set()
+        self._available_connections = deque()
+        self._waiters = deque()
+        self._wait_count = 0
+        self._wait_time = 0
+        self._wait_max = 0
+        self.on_wait = None
 
     def dispose(self):
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
         for conn in self._connections:
             try:
                 conn.close()
@@ -28,9 +70,21 @@ class GreenletPool(pool.Pool):
                 pass
         self.logger.info("Pool disposed. %s", self.status())
 
+    def abandon(self):
+        """Stop maintaining connections, without closing them.
+
+        Used in a forked process which must not use, nor close, the
+        connections opened by its parent.
+        """
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        self._idle_timeout = None
+
     def status(self):
-        return "size: %d, available: %d" % (self.size(),
-                                            len(self._available_connections))
+        return "size: %d, available: %d, overflow: %d, waiting: %d" % (
+            self.size(), len(self._available_connections), self.overflow(),
+            self.waiting())
 
     def size(self):
         return len(self._connections)
@@ -38,13 +92,52 @@ class GreenletPool(pool.Pool):
     def max_size(self):
         return self._max_size
 
+    def max_overflow(self):
+        return self._max_overflow
+
+    def overflow(self):
+        """Number of connections above ``pool_size``
+        """
+        return max(self.size() - self._max_size, 0)
+
     def timeout(self):
         return self._timeout
 
+    def connect_concurrency(self):
+        return self._connect_concurrency
+
+    def waiting(self):
+        """Number of greenlets queued for a connection
+        """
+        return len(self._waiters)
+
+    def stats(self):
+        """Dictionary of pool statistics
+
+        ``wait_time`` and ``wait_max`` are in seconds and only account for
+        checkouts which had to queue for a connection.
+        """
+        return dict(size=self.size(),
+                    max_size=self._max_size,
+                    available=len(self._available_connections),
+                    overflow=self.overflow(),
+                    waiting=self.waiting(),
+                    wait_count=self._wait_count,
+                    wait_time=self._wait_time,
+                    wait_max=self._wait_max)
+
     def recreate(self):
         self.logger.info("Pool recreating")
-        return self.__class__(self._creator,
-                              pool_size=self.max_size,
+        pool = self.__class__(self._creator,
+                              pool_size=self._max_size,
+                              timeout=self._timeout,
+                              max_overflow=self._max_overflow,
+                              connect_concurrency=self._connect_concurrency,
+                              prewarm=self._prewarm,
+                              pre_ping=self._pre_ping,
+                              ping_interval=self._ping_interval,
+                              min_size=self._min_size,
+                              idle_timeout=self._idle_timeout,
                               recycle=self._recycle,
                               echo=self.echo,
                               logging_name=self._orig_logging_name,
@@ -52,18 +145,172 @@ class GreenletPool(pool.Pool):
                               reset_on_return=self._reset_on_return,
                               _dispatch=self.dispatch,
                               dialect=self._dialect)
+        pool.on_wait = self.on_wait
+        return pool
+
+    def prewarm(self, size=None):
+        """Open new connections, concurrently, until the pool has ``size``
+        of them (the ``prewarm`` value or ``pool_size`` when not given).
+
+        Each connection is established on its own greenlet.
+        Return a :class:`~asyncio.Future` called back once all connections
+        are available.
+        """
+        self._prewarm_pending = False
+        if size is None:
+            size = self._prewarm or self._max_size
+        size = min(size, self._max_size) - self._reserved()
+        loop = get_event_loop()
+        return gather(*[self._green_add_connection() for _ in range(size)],
+                      loop=loop)
+
+    def _add_connection(self):
+        if self._reserved() < self._max_size:
+            self._do_return_conn(self._connect())
+
+    _green_add_connection = run_in_greenlet(_add_connection)
 
     def _do_return_conn(self, conn):
-        self._available_connections.add(conn)
+        # Hand the connection to the first greenlet still waiting for one
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(conn)
+                return
+        if self.size() > self._max_size:
+            self._discard(conn)
+        else:
+            self._available_connections.append((time.time(), conn))
+            if self._idle_timeout and not self._reaper:
+                self._reaper = get_event_loop().call_later(
+                    self._idle_timeout, self._reap)
 
     def _do_get(self):
-        try:
-            return self._available_connections.pop()
-        except KeyError:
-            pass
-
-        # Only create one connection at a time, otherwise psycopg2 block!
-        with self._lock:
-            conn = self._create_connection()
-            self._connections.add(conn)
+        # Most recently returned connections first, the others can be reaped
+        if self._available_connections:
+            idle_since, conn = self._available_connections.pop()
+            if self._pre_ping and (time.time() - idle_since >=
+                                   self._ping_interval):
+                self._ping(conn)
             return conn
+
+        if self._reserved() < self._max_size + self._max_overflow:
+            return self._connect()
+        return self._wait()
+
+    def _reserved(self):
+        return self.size() + self._connecting
+
+    def _ping(self, conn):
+        if conn.connection is None:
+            return
+        try:
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception as exc:
+            # The connection will be re-established by the record
+            conn.invalidate(exc)
+
+    def _discard(self, conn):
+        self._connections.discard(conn)
+        conn.close()
+
+    def _reap(self):
+        self._reaper = None
+        available = self._available_connections
+        expired = time.time() - self._idle_timeout
+        while (available and available[0][0] <= expired and
+               self.size() > self._min_size):
+            self._discard(available.popleft()[1])
+        if available and self.size() > self._min_size:
+            self._reaper = get_event_loop().call_later(
+                max(available[0][0] - expired, 0), self._reap)
+
+    def _connect(self):
+        self._connecting += 1
+        if self._prewarm_pending:
+            self.prewarm().add_done_callback(self._prewarm_done)
+        conn = None
+        try:
+            # Until a connection is established the dialect is not
+            # initialised and connecting concurrently would block psycopg2
+            while self._opening >= self._connect_limit():
+                waiter = get_event_loop().create_future()
+                self._connect_waiters.append(waiter)
+                wait(waiter, True)
+            self._opening += 1
+            try:
+                conn = self._create_connection()
+                self._connections.add(conn)
+            finally:
+                self._opening -= 1
+                self._wake_connect_waiters()
+        finally:
+            self._connecting -= 1
+            if conn is None:
+                # The connection failed, a queued greenlet can use the slot
+                self._wake_waiter()
+        return conn
+
+    def _connect_limit(self):
+        return self._connect_concurrency if self._connections else 1
+
+    def _wake_connect_waiters(self):
+        free = self._connect_limit() - self._opening
+        while free > 0 and self._connect_waiters:
+            waiter = self._connect_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _wake_waiter(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _wait(self):
+        # Wait for a returned connection, or for None when a slot is freed
+        loop = get_event_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        handle = loop.call_later(self._timeout, self._wait_timeout, waiter)
+        start = loop.time()
+        try:
+            conn = wait(waiter, True)
+        except BaseException:
+            # The greenlet was thrown into after being handed a connection,
+            # or a free slot, which must go to another greenlet
+            if (waiter.done() and not waiter.cancelled() and
+                    not waiter.exception()):
+                if waiter.result() is None:
+                    self._wake_waiter()
+                else:
+                    self._do_return_conn(waiter.result())
+            raise
+        finally:
+            handle.cancel()
+            if not waiter.done():
+                self._waiters.remove(waiter)
+            waited = loop.time() - start
+            self._wait_count += 1
+            self._wait_time += waited
+            self._wait_max = max(self._wait_max, waited)
+            if self.on_wait:
+                self.on_wait(waited)
+        return self._do_get() if conn is None else conn
+
+    def _prewarm_done(self, future):
+        if not future.cancelled() and future.exception():
+            self.logger.error('Could not prewarm pool: %s', future.exception())
+
+    def _wait_timeout(self, waiter):
+        if not waiter.done():
+            self._waiters.remove(waiter)
+            waiter.set_exception(exc.TimeoutError(
+                "GreenletPool limit of size %d reached, connection timed "
+                "out, timeout %s" % (self._max_size, self._timeout)))
@@ -0,0 +1,132 @@
+import re
+from collections import OrderedDict
+
+from sqlalchemy.types import TypeDecorator, NullType
+
+
+PARAMETER = re.compile(r'%\(([^)]+)\)s')
+DDL = re.compile(r'\s*(create|alter|drop|truncate|comment|discard|'
+                 r'deallocate)\b', re.IGNORECASE)
+
+
+class PreparedStatement:
+    __slots__ = ('name', 'execute')
+
+    def __init__(self, name, execute):
+        self.name = name
+        self.execute = execute
+
+
+class StatementCache:
+    '''LRU cache of the statements prepared on a psycopg2 connection.
+
+    Statements are keyed by their compiled SQL. When the cache is full
+    the least recently used statement is deallocated.
+    Statements which could not be prepared are remembered so that
+    preparing them is not attempted at each execution.
+    ``generation`` is the DDL generation of the dialect the statements
+    were prepared in.
+    '''
+    def __init__(self, size, generation=0):
+        self.size = size
+        self.generation = generation
+        self.statements = OrderedDict()
+        self.unprepared = set()
+        self._counter = 0
+
+    def __len__(self):
+        return len(self.statements)
+
+    def get(self, sql):
+        statement = self.statements.get(sql)
+        if statement is not None:
+            self.statements.move_to_end(sql)
+        return statement
+
+    def prepare(self, cursor, sql, compiled, dialect, error):
+        '''Prepare ``sql`` on the connection of ``cursor``.
+
+        :return: a :class:`PreparedStatement` or ``None`` if the statement
+            could not be prepared.
+        '''
+        if sql in self.unprepared:
+            return
+        self._counter += 1
+        name = 'odm_%d' % self._counter
+        body, names = prepare_sql(sql)
+        types = [parameter_type(dialect, compiled, key) for key in names]
+        prepare = 'PREPARE %s%s AS %s' % (
+            name, '(%s)' % ', '.join(types) if types else '', body)
+        execute = 'EXECUTE %s%s' % (
+            name, '(%s)' % ', '.join('%%(%s)s' % key for key in names)
+            if names else '')
+        # A failing PREPARE must not abort the ongoing transaction
+        savepoint = not cursor.connection.autocommit
+        if savepoint:
+            prepare = ('SAVEPOINT odm_prepare; %s; '
+                       'RELEASE SAVEPOINT odm_prepare' % prepare)
+        try:
+            cursor.execute(prepare)
+        except error:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT odm_prepare')
+            if len(self.unprepared) >= self.size:
+                self.unprepared.clear()
+            self.unprepared.add(sql)
+            return
+        statement = PreparedStatement(name, execute)
+        self.statements[sql] = statement
+        while len(self.statements) > self.size:
+            _, old = self.statements.popitem(last=False)
+            cursor.execute('DEALLOCATE %s' % old.name)
+        return statement
+
+    def clear(self, cursor=None):
+        '''Remove all statements, deallocating them when ``cursor`` is given
+        '''
+        if self.statements and cursor is not None:
+            cursor.execute('DEALLOCATE ALL')
+        self.statements.clear()
+        self.unprepared.clear()
+
+
+def prepare_sql(sql):
+    '''Convert the pyformat parameters of ``sql`` into positional
+    parameters of a prepared statement.
+
+    :return: a two elements tuple with the body of the prepared statement
+        and the list of parameter names in positional order
+    '''
+    names = []
+    positions = {}
+
+    def _(match):
+        key = match.group(1)
+        if key not in positions:
+            names.append(key)
+            positions[key] = len(names)
+        return '$%d' % positions[key]
+
+    body = '%'.join(PARAMETER.sub(_, part) for part in sql.split('%%'))
+    return body, names
+
+
+def parameter_type(dialect, compiled, key):
+    '''The SQL type of a bind parameter, ``unknown`` when not available
+    '''
+    bind = compiled.binds.get(key)
+    if bind is None:
+        for bind, name in compiled.bind_names.items():
+            if name == key:
+                break
+        else:
+            return 'unknown'
+    type_ = bind.type
+    if isinstance(type_, TypeDecorator):
+        type_ = type_.load_dialect_impl(dialect)
+    if isinstance(type_, NullType):
+        return 'unknown'
+    try:
+        return dialect.type_compiler.process(type_)
+    except Exception:
+        return 'unknown'
@@ -0,0 +1,49 @@
+"""Safe use of engines in processes forked after their creation"""
+import os
+
+from sqlalchemy import event, exc
+
+
+# Pools inherited from the parent process. Their connections must not be
+# closed, which would end the sessions of the parent on the database
+# server, nor garbage collected, which closes them too.
+_inherited = []
+
+
+def guard_pid(engine):
+    """Never check out, in a forked process, connections of ``engine``
+    opened by the parent process.
+
+    Such connections are detached from the pool, without closing them, and
+    replaced with new ones.
+    """
+    if event.contains(engine, 'connect', _connect):
+        return
+    event.listen(engine, 'connect', _connect)
+    event.listen(engine, 'checkout', _checkout)
+
+
+def reset_pool(engine):
+    """Replace the connection pool of ``engine`` with a new one, in a
+    forked process, without closing the connections of the inherited pool.
+    """
+    pool = engine.pool
+    engine.pool = pool.recreate()
+    abandon = getattr(pool, 'abandon', None)
+    if abandon:
+        abandon()
+    _inherited.append(pool)
+
+
+def _connect(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        _inherited.append(dbapi_connection)
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            'Connection record belongs to pid %s, attempting to check out '
+            'in pid %s' % (connection_record.info['pid'], pid))
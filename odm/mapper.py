@@ -1,7 +1,9 @@
 import logging
 import sys
 from copy import copy
+from itertools import chain, islice
 from inspect import getmodule
+from asyncio import get_event_loop, gather
 from contextlib import contextmanager
 from collections import OrderedDict
 
@@ -12,17 +14,48 @@ from sqlalchemy import MetaData, Table, event
 from sqlalchemy.ext.declarative.api import (declarative_base, declared_attr,
                                             _as_declarative, _add_attribute)
 from sqlalchemy.orm.session import Session
-from sqlalchemy.orm import object_session
+from sqlalchemy.exc import UnboundExecutionError
+from sqlalchemy.orm import (object_session, object_mapper, class_mapper,
+                            configure_mappers)
+from sqlalchemy.orm.attributes import instance_state
 from sqlalchemy.schema import DDL
 
 from pulsar.api import ImproperlyConfigured
-
-from .utils import database_operation
+from pulsar.apps.greenio import wait
+
+from .utils import database_operation, as_bool
+from .bulk import bulk_operation
+from .stream import ResultStream
+from .replicas import Replicas, is_read_only
+from .shards import Shards, ShardedQuery
+from .queries import (QueryCache, pk_params, exists_statement,
+                      update_statement)
+from .metrics import Metrics
+from .slow import SlowQueryLog
+from .concurrency import engines_map
+from .migrate import schema_diff
+from .fork import guard_pid, reset_pool
+from .types.uuid import reset_generators
 from . import dialects  # noqa
 
 
 logger = logging.getLogger('pulsar.odm')
 
+# Url query parameters converted into create_engine keyword arguments
+URL_ENGINE_PARAMETERS = (
+    ('pool_size', 'pool_size', int),
+    ('pool_timeout', 'pool_timeout', float),
+    ('max_overflow', 'max_overflow', int),
+    ('pool_recycle', 'pool_recycle', int),
+    ('pool_pre_ping', 'pre_ping', as_bool),
+    ('pool_ping_interval', 'ping_interval', float),
+    ('pool_min_size', 'min_size', int),
+    ('pool_idle_timeout', 'idle_timeout', float),
+    ('pool_connect_concurrency', 'connect_concurrency', int),
+    ('pool_prewarm', 'prewarm', int),
+    ('prepared_statements', 'prepared_statements', int)
+)
+
 
 def create_engine(*args, **kwargs):
     kwargs.setdefault('strategy', 'odm')
@@ -36,12 +69,11 @@ class OdmEngineStrategy(PlainEngineStrategy):
         # create url.URL object
         u = url.make_url(name_or_url)
 
-        if 'pool_size' in u.query:
-            kwargs['pool_size'] = int(u.query.pop('pool_size'))
-        if 'pool_timeout' in u.query:
-            kwargs['pool_timeout'] = float(u.query.pop('pool_timeout'))
+        for name, kwarg, type_ in URL_ENGINE_PARAMETERS:
+            if name in u.query:
+                kwargs[kwarg] = type_(u.query.pop(name))
 
-        return super().create(name_or_url, **kwargs)
+        return super().create(u, **kwargs)
 
 
 OdmEngineStrategy()
@@ -128,6 +160,16 @@ def module_tables(module):
             yield table
 
 
+def replica_url(engine, database=None):
+    """The url of a replica ``engine``, with ``database`` when given
+    """
+    if not database:
+        return str(engine.url)
+    url = copy(engine.url)
+    url.database = database
+    return str(url)
+
+
 def copy_models(module_from, module_to):
     """Copy models from one module to another
     :param module_from:
@@ -176,8 +218,59 @@ class Mapper:
         Dictionary of labels-engine pairs. The "default" label is always
         present and it is used for tables without `bind_label` in their
         `info` dictionary.
+
+    A bind can be a connection string or a dictionary with the ``primary``
+    connection string and a list of ``replicas`` connection strings.
+    Read-only statements of a session are routed to one of the replicas,
+    chosen according to ``routing`` (``round_robin`` or
+    ``least_outstanding``), unless the session has written to the primary
+    or it is pinned to it. After a session writes to the primary, reads go
+    to the primary for ``replica_lag`` seconds.
+
+    .. attribute:: cache
+
+        Optional :class:`.ModelCache`, a second level cache used by
+        :meth:`OdmSession.get` for models with the ``__cache__`` attribute.
+
+    .. attribute:: metrics
+
+        The :class:`.Metrics` collected from all engines, ``None`` unless
+        enabled via the ``metrics`` parameter or :meth:`enable_metrics`.
+
+    .. attribute:: slow_queries
+
+        The :class:`.SlowQueryLog` of all engines, ``None`` unless enabled
+        via the ``slow_queries`` parameter, a threshold in seconds or a
+        :class:`.SlowQueryLog`, or :meth:`enable_slow_queries`.
+
+    .. attribute:: ddl_concurrency
+
+        Maximum number of engines on which :meth:`table_create`,
+        :meth:`table_drop` and the database operations run concurrently.
+
+    .. attribute:: queries
+
+        The :class:`.QueryCache` of queries and statements used by
+        :meth:`OdmSession.get`, :meth:`OdmSession.exists` and
+        :meth:`OdmSession.update_by_pk`.
+
+    With ``lazy`` set, models of modules passed to :meth:`register_module`
+    are built the first time they are accessed via the mapper, or looked up
+    by a relationship, rather than when registered. All pending models
+    are built when the :attr:`metadata` or the tables of an engine are
+    needed, by :meth:`table_create` for example.
+
+    A bind can also be a dictionary with a list of ``shards`` connection
+    strings. Tables of the bind declaring a shard key column, via the
+    ``__shard_key__`` model attribute or the ``shard_key`` table info, are
+    created on all shards and each row is stored in the shard selected by
+    the value of its shard key (see :class:`.Shards`). Other tables of the
+    bind are stored on the first shard.
     """
-    def __init__(self, binds):
+    ddl_concurrency = 8
+
+    def __init__(self, binds, cache=None, metrics=None, slow_queries=None,
+                 lazy=False):
         # Setup mdoels and engines
         if not binds:
             binds = {}
@@ -187,26 +280,62 @@ class Mapper:
             raise ImproperlyConfigured('default datastore not specified')
 
         self._engines = {}
+        self._replicas = {}
+        self._shard_engines = {}
+        self._shards = {}
         self._declarative_register = {}
         self._bases = {}
-        self._base_declarative = declarative_base(name='OdmBase',
-                                                  metaclass=DeclarativeMeta)
+        self._pending = OrderedDict()
+        self._base_declarative = declarative_base(
+            name='OdmBase', metaclass=DeclarativeMeta,
+            class_registry=LazyRegistry(self._build_class))
+        self.lazy = lazy
         self.binds = {}
+        self._options = dict(cache=cache, metrics=metrics,
+                             slow_queries=slow_queries, lazy=lazy)
+        self.queries = QueryCache()
+        self.cache = cache
+        self.metrics = None
+        self.slow_queries = None
         self.is_green = False
 
         for name, bind in tuple(binds.items()):
             key = None if name == 'default' else name
-            engine = create_engine(bind)
+            replicas = ()
+            if isinstance(bind, dict) and bind.get('shards'):
+                shards = [create_engine(shard) for shard in bind['shards']]
+                self._shard_engines[key] = shards
+                engine = shards[0]
+            elif isinstance(bind, dict):
+                replicas = bind.get('replicas') or ()
+                engine = create_engine(bind['primary'])
+            else:
+                engine = create_engine(bind)
             dialect = engine.dialect
             # Dialect requires Green Pool
             if getattr(dialect, 'is_green', False):
                 self.is_green = True
             self._engines[key] = engine
+            if replicas:
+                self._replicas[engine] = Replicas(
+                    [create_engine(replica) for replica in replicas],
+                    routing=bind.get('routing'),
+                    lag=bind.get('replica_lag', 0))
+        for _, engine in self.labelled_engines():
+            guard_pid(engine)
+        if metrics:
+            self.enable_metrics(None if metrics is True else metrics)
+        if slow_queries is not None:
+            self.enable_slow_queries(slow_queries)
 
     def __getitem__(self, model):
+        if model in self._pending:
+            self._build(model)
         return self._declarative_register[model]
 
     def __getattr__(self, name):
+        if name in self._pending:
+            self._build(name)
         if name in self._declarative_register:
             return self._declarative_register[name]
         raise AttributeError('No model named "%s"' % name)
@@ -215,10 +344,54 @@ class Mapper:
     def metadata(self):
         """Returns the :class:`~sqlalchemy.Metadata` for this mapper
         """
+        self.build()
         return self._base_declarative.metadata
 
-    def copy(self, binds):
-        return self.__class__(binds)
+    def build(self):
+        """Build all pending models of a ``lazy`` mapper
+        """
+        while self._pending:
+            self._build(next(iter(self._pending)))
+
+    def copy(self, binds=None):
+        """A new mapper with the binds and the options of this mapper.
+
+        The :attr:`cache`, or the :attr:`metrics` and :attr:`slow_queries`
+        when given as instances, are shared with the new mapper.
+
+        :param binds: optional binds, the binds of this mapper, with their
+            shards and replicas, when not given
+        """
+        return self.__class__(binds or self.binds_config(), **self._options)
+
+    def binds_config(self, urls=None, databases=None):
+        """The binds of this mapper as accepted by the constructor.
+
+        :param urls: optional dictionary of engines and the urls replacing
+            theirs
+        :param databases: optional dictionary of primary engines and the
+            database replacing the one of their replicas
+        """
+        urls = urls or {}
+        databases = databases or {}
+        binds = {}
+        for key, engine in self._engines.items():
+            shards = self._shard_engines.get(key)
+            if shards:
+                bind = {'shards': [urls.get(shard, str(shard.url))
+                                   for shard in shards]}
+            else:
+                bind = urls.get(engine, str(engine.url))
+                replicas = self._replicas.get(engine)
+                if replicas:
+                    database = databases.get(engine)
+                    bind = {'primary': bind,
+                            'replicas': [replica_url(replica, database)
+                                         for replica in replicas.engines],
+                            'routing': replicas.routing,
+                            'replica_lag': replicas.lag}
+            binds[key or 'default'] = bind
+        return binds
 
     def register(self, model, **attr):
         """Register a model or a table with this mapper
@@ -226,7 +399,7 @@ class Mapper:
         :param model: a table or a :class:`.BaseModel` class
         :return: a Model class or a table
         """
-        metadata = self.metadata
+        metadata = self._base_declarative.metadata
         if not isinstance(model, Table):
             model_name = self._create_model(model, **attr)
             if not model_name:
@@ -256,6 +429,15 @@ class Mapper:
         assert engine
         self.binds[table] = engine
 
+        shard_key = table.info.get('shard_key')
+        if shard_key is None and model is not table:
+            shard_key = getattr(model, '__shard_key__', None)
+        if shard_key and key in self._shard_engines:
+            function = (table.info.get('shard_function') or
+                        getattr(model, '__shard_function__', None))
+            self._shards[table] = Shards(self._shard_engines[key], shard_key,
+                                         function)
+
         return model
 
     def register_module(self, module, exclude=None):
@@ -266,7 +448,10 @@ class Mapper:
             for name, model in models.items():
                 if name in exclude:
                     continue
-                self.register(model)
+                if self.lazy:
+                    self._pending[name] = model
+                else:
+                    self.register(model)
         for table in module_tables(module):
             if table.key not in exclude:
                 self.register(table)
@@ -278,43 +463,59 @@ class Mapper:
         args, kwargs = targs[:-1], targs[-1]
         return Table(name, self.metadata, *columns, *args, **kwargs)
 
-    def database_create(self, database, **params):
-        """Create databases for each engine and return a new :class:`.Mapper`.
+    def database_create(self, database, concurrency=None, **params):
+        """Create databases for each engine, shards included, and return a
+        new :class:`.Mapper`.
+
+        Replicas of the new mapper connect to the new database of their
+        primary, which is expected to be replicated.
         """
-        binds = {}
+        engines, dbnames = list(self.engines()), {}
         dbname = database
-        for key, engine in self.keys_engines():
+        for engine in engines:
             if hasattr(database, '__call__'):
                 dbname = database(engine)
             assert dbname, "Cannot create a database, no db name given"
-            key = key if key else 'default'
-            binds[key] = self._database_create(engine, dbname)
-        return self.copy(binds)
+            dbnames[engine] = dbname
 
-    def database_exist(self):
-        """Create databases for each engine and return a new :class:`.Mapper`.
-        """
-        binds = {}
-        for key, engine in self.keys_engines():
-            key = key if key else 'default'
-            binds[key] = self._database_exist(engine)
-        return binds
+        def database_create(engine):
+            return self._database_create(engine, dbnames[engine])
 
-    def database_all(self):
+        urls = self._engines_map(database_create, engines, concurrency)
+        return self.copy(self.binds_config(dict(zip(engines, urls)),
+                                           dbnames))
+
+    def database_exist(self, concurrency=None):
+        """Dictionary of engine labels, replicas excluded, and whether
+        their database exists
+        """
+        labelled = list(self.labelled_engines(replicas=False))
+        exist = self._engines_map(self._database_exist,
+                                  [engine for _, engine in labelled],
+                                  concurrency)
+        return dict(((label, value) for (label, _), value
+                     in zip(labelled, exist)))
+
+    def database_all(self, concurrency=None):
         """Return a dictionary mapping engines with databases
         """
-        all = {}
-        for engine in self.engines():
-            all[engine] = self._database_all(engine)
-        return all
+        engines = list(self.engines())
+        return dict(zip(engines, self._engines_map(self._database_all,
+                                                   engines, concurrency)))
 
-    def database_drop(self, database=None, **params):
+    def database_drop(self, database=None, concurrency=None, **params):
+        dbnames = {}
         dbname = database
         for engine in self.engines():
             if hasattr(database, '__call__'):
                 dbname = database(engine)
             assert dbname, "Cannot drop database, no db name given"
-            self._database_drop(engine, dbname)
+            dbnames[engine] = dbname
+
+        def database_drop(engine):
+            self._database_drop(engine, dbnames[engine])
+
+        self._engines_map(database_drop, dbnames, concurrency)
 
     def tables(self):
         tables = []
@@ -324,24 +525,138 @@ class Mapper:
                 tables.append((str(engine.url), tbs))
         return tables
 
-    def table_create(self, remove_existing=False):
+    def table_create(self, remove_existing=False, concurrency=None):
         """Creates all tables.
         """
-        for engine in self.engines():
-            tables = self._get_tables(engine, create_drop=True)
-            logger.info('Create all tables for %s', engine)
-            try:
-                self.metadata.create_all(engine, tables=tables)
-            except Exception as exc:
-                raise
+        self._engines_map(self._table_create, self.engines(), concurrency)
 
-    def table_drop(self):
+    def table_drop(self, concurrency=None):
         """Drops all tables.
         """
-        for engine in self.engines():
+        self._engines_map(self._table_drop, self.engines(), concurrency)
+
+    def schema_diff(self, concurrency=None, convert_choices=False):
+        """Compare registered tables with the databases of all engines,
+        replicas excluded.
+
+        :param convert_choices: convert varchar columns of choice types
+            with enum or smallint storage, see :func:`.schema_diff`
+        :return: a dictionary of engine labels and :class:`.Migration`
+        """
+        labelled = list(self.labelled_engines(replicas=False))
+        labels = dict(((engine, label) for label, engine in labelled))
+
+        def engine_diff(engine):
             tables = self._get_tables(engine, create_drop=True)
-            logger.info('Drop all tables for %s', engine)
-            self.metadata.drop_all(engine, tables=tables)
+            return schema_diff(engine, tables, labels[engine],
+                               convert_choices)
+
+        migrations = self._engines_map(
+            engine_diff, [engine for _, engine in labelled], concurrency)
+        return OrderedDict(((migration.bind, migration)
+                            for migration in migrations))
+
+    def migrate(self, dry_run=False, concurrency=None,
+                convert_choices=False):
+        """Apply the additive changes of :meth:`schema_diff` online.
+
+        The plan of each engine is logged before being applied on all
+        engines concurrently.
+
+        :param dry_run: only compute and log the plan
+        :param convert_choices: also convert varchar columns of choice
+            types to their enum or smallint storage, locking their tables
+        :return: the dictionary of engine labels and :class:`.Migration`
+        """
+        plan = self.schema_diff(concurrency, convert_choices)
+        for migration in plan.values():
+            if len(migration):
+                logger.info('Migration plan\n%s', migration)
+        if not dry_run:
+            migrations = dict(((m.engine, m) for m in plan.values()))
+
+            def migrate(engine):
+                migrations[engine].apply()
+
+            self._engines_map(migrate, [m.engine for m in plan.values()],
+                              concurrency)
+        return plan
+
+    def bulk_update(self, model, rows, session=None):
+        """Update many rows of a model or table with one statement.
+
+        On postgresql this is a single ``UPDATE ... FROM (VALUES ...)``,
+        on other dialects an ``UPDATE`` executed with ``executemany``.
+
+        :param model: a model, a model name or a table
+        :param rows: list of dictionaries with the primary key and the
+            values to update. All rows must have the same keys
+        :param session: optional session providing the transaction
+        :return: the number of updated rows
+
+        Rows of a sharded table are updated on the shard of their shard
+        key, which must be included in the rows.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        table = self._table(model)
+        with self.begin(session=session) as session:
+            if self.cache:
+                for row in rows:
+                    session.invalidate(table, [row[column.key] for column
+                                               in table.primary_key])
+            count = 0
+            for engine, engine_rows in self._shard_rows(table, rows):
+                conn = session.write_connection(engine)
+                count += bulk_operation(conn, 'update', table, engine_rows)
+            return count
+
+    def bulk_load(self, model, rows, chunk_size=10000, session=None):
+        """Insert many rows into a model or table.
+
+        With psycopg2 rows are streamed through ``COPY ... FROM STDIN``,
+        other dialects, and the green dialect which installs a psycopg2
+        wait callback, execute multi-row inserts with ``executemany``.
+        Rows are consumed ``chunk_size`` at a time so that memory does
+        not grow with the number of rows.
+
+        :param model: a model, a model name or a table
+        :param rows: iterable over dictionaries of column values
+        :param session: optional session providing the transaction
+        :return: the number of inserted rows
+
+        Rows of a sharded table are inserted in the shard of their shard
+        key, which must be included in the rows, ``chunk_size`` rows being
+        read and distributed to shards at a time.
+        """
+        table = self._table(model)
+        with self.begin(session=session) as session:
+            if self.shards(table) is None:
+                conn = session.write_connection(self.binds[table])
+                return bulk_operation(conn, 'load', table, rows, chunk_size)
+            rows = iter(rows)
+            count = 0
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    return count
+                for engine, engine_rows in self._shard_rows(table, chunk):
+                    conn = session.write_connection(engine)
+                    count += bulk_operation(conn, 'load', table,
+                                            engine_rows, chunk_size)
+
+    def stream(self, query, batch_size=1000, pool=None):
+        """Stream the result of a query fetching ``batch_size`` rows at a
+        time from a server side cursor.
+
+        :param query: a :class:`~sqlalchemy.orm.Query` or a core selectable
+        :param pool: optional :class:`.GreenPool` used when iterating
+            with ``async for``
+        :return: a :class:`.ResultStream`, iterable from a greenlet and
+            asynchronously iterable from asyncio code
+        """
+        return ResultStream(self, query, batch_size=batch_size, pool=pool)
 
     @contextmanager
     def begin(self, close=True, expire_on_commit=False, session=None,
@@ -392,16 +707,154 @@ class Mapper:
     def engines(self):
         """Iterator over all engines
         """
-        return self._engines.values()
+        if not self._shard_engines:
+            return self._engines.values()
+        engines = list(self._engines.values())
+        for shards in self._shard_engines.values():
+            engines.extend(shards[1:])
+        return engines
+
+    def shards(self, table):
+        """The :class:`.Shards` of a sharded ``table`` or ``None``
+        """
+        return self._shards.get(table)
+
+    def replicas(self, engine):
+        """The :class:`.Replicas` of a primary ``engine`` or ``None``
+        """
+        return self._replicas.get(engine)
 
     def keys_engines(self):
         return self._engines.items()
 
+    def labelled_engines(self, replicas=True):
+        """Iterator over label-engine pairs of all engines, replicas
+        included unless ``replicas`` is ``False``.
+
+        The label of an engine is the bind label, ``default`` for the default
+        bind, with the index of the shard or replica for shard and replica
+        engines, ``default:shard1`` and ``default:replica0`` for example.
+        """
+        for key, engine in self._engines.items():
+            label = key or 'default'
+            shards = self._shard_engines.get(key)
+            if shards:
+                for n, shard in enumerate(shards):
+                    yield '%s:shard%d' % (label, n), shard
+            else:
+                yield label, engine
+            engine_replicas = self._replicas.get(engine)
+            if replicas and engine_replicas:
+                for n, replica in enumerate(engine_replicas.engines):
+                    yield '%s:replica%d' % (label, n), replica
+
+    def prewarm(self, size=None):
+        """Open ``size`` connections in the pool of each engine supporting
+        it, establishing them concurrently.
+
+        When invoked from a child greenlet it waits for the connections
+        to be ready, otherwise it returns an awaitable.
+        """
+        prewarms = [engine.pool.prewarm(size) for engine in self.engines()
+                    if hasattr(engine.pool, 'prewarm')]
+        return wait(gather(*prewarms, loop=get_event_loop()))
+
+    def enable_metrics(self, metrics=None):
+        """Collect metrics of all engines, including replicas.
+
+        :param metrics: optional :class:`.Metrics`, a new one when not given
+        :return: the :attr:`metrics`
+        """
+        self.disable_metrics()
+        self.metrics = metrics or Metrics()
+        for label, engine in self.labelled_engines():
+            self.metrics.attach(engine, label)
+        return self.metrics
+
+    def disable_metrics(self):
+        """Stop collecting metrics, removing instrumentation from engines
+        """
+        if self.metrics is not None:
+            self.metrics.detach()
+            self.metrics = None
+
+    def enable_slow_queries(self, threshold=1, **kwargs):
+        """Log statements slower than ``threshold`` seconds of all
+        engines, including replicas.
+
+        :param threshold: threshold in seconds or a :class:`.SlowQueryLog`
+        :param kwargs: parameters of a new :class:`.SlowQueryLog`
+        :return: the :attr:`slow_queries`
+        """
+        self.disable_slow_queries()
+        if isinstance(threshold, SlowQueryLog):
+            self.slow_queries = threshold
+        else:
+            self.slow_queries = SlowQueryLog(threshold, **kwargs)
+        for label, engine in self.labelled_engines():
+            self.slow_queries.attach(engine, label)
+        return self.slow_queries
+
+    def disable_slow_queries(self):
+        """Stop logging slow statements
+        """
+        if self.slow_queries is not None:
+            self.slow_queries.close()
+            self.slow_queries = None
+
+    def prefork(self):
+        """Prepare the mapper before forking worker processes.
+
+        Pending models are built, SQLAlchemy mappers configured and the
+        connections of all engines closed so that workers, which must call
+        :meth:`after_fork`, do not inherit them.
+        """
+        self.build()
+        configure_mappers()
+        for _, engine in self.labelled_engines():
+            engine.dispose()
+
+    def after_fork(self):
+        """Give all engines new connection pools in a forked process.
+
+        Connections inherited from the parent process are never used nor
+        closed, closing them would end the database sessions of the parent.
+        Even without calling this method, inherited connections are not
+        checked out in a forked process but replaced with new ones.
+        Time ordered UUID generators are reset too.
+        """
+        reset_generators()
+        for _, engine in self.labelled_engines():
+            reset_pool(engine)
+        for replicas in self._replicas.values():
+            replicas.reset()
+
     def close(self):
         for engine in self.engines():
             engine.dispose()
+        for replicas in self._replicas.values():
+            replicas.dispose()
 
     # INTERNALS
+    def _shard_rows(self, table, rows):
+        # Pairs of engines and the rows of table they store
+        shards = self.shards(table)
+        if shards is None:
+            return [(self.binds[table], rows)]
+        by_engine = OrderedDict()
+        for row in rows:
+            if shards.key not in row:
+                raise ValueError('Rows of sharded table "%s" need the shard '
+                                 'key "%s"' % (table.key, shards.key))
+            engine = shards.engine(row[shards.key])
+            by_engine.setdefault(engine, []).append(row)
+        return by_engine.items()
+
+    def _table(self, model):
+        if isinstance(model, str):
+            model = self[model]
+        return model if isinstance(model, Table) else model.__table__
+
     def _create_model(self, model):
         model_name = model.__name__
         meta = type(self._base_declarative)
@@ -427,7 +880,7 @@ class Mapper:
         create = getattr(model, '__create_sql__', None)
         name = model_name.lower()
         if create:
-            event.listen(self.metadata,
+            event.listen(self._base_declarative.metadata,
                          'after_create',
                          DDL(create.format({'name': name})))
             drop = getattr(model, '__drop_sql__', None)
@@ -436,16 +889,33 @@ class Mapper:
                                'To mute this warning add a __drop_sql__ '
                                'statement in the model class', name)
             else:
-                event.listen(self.metadata,
+                event.listen(self._base_declarative.metadata,
                              'before_drop',
                              DDL(drop.format({'name': name})))
 
         return model, name
 
+    def _build(self, name):
+        model = self._pending.pop(name)
+        base = getattr(model, '__inherit_from__', None)
+        if base in self._pending:
+            self._build(base)
+        self.register(model)
+
+    def _build_class(self, classname):
+        # Build a pending model looked up by its class name
+        name = classname.lower()
+        if name in self._pending:
+            self._build(name)
+            return True
+        return False
+
     def _get_tables(self, engine, create_drop=False):
+        self.build()
         tables = []
         for table, eng in self.binds.items():
-            if eng == engine:
+            shards = self._shards.get(table)
+            if eng == engine or (shards and engine in shards.engines):
                 if table.key in self._declarative_register:
                     model = self[table.key]
                     if create_drop and hasattr(model, '__create_sql__'):
@@ -453,6 +923,22 @@ class Mapper:
                 tables.append(table)
         return tables
 
+    def _engines_map(self, operation, engines, concurrency=None):
+        # Run operation on engines concurrently, see engines_map
+        return engines_map(operation, engines,
+                           concurrency or self.ddl_concurrency,
+                           green=self.is_green)
+
+    def _table_create(self, engine):
+        tables = self._get_tables(engine, create_drop=True)
+        logger.info('Create all tables for %s', engine)
+        self.metadata.create_all(engine, tables=tables)
+
+    def _table_drop(self, engine):
+        tables = self._get_tables(engine, create_drop=True)
+        logger.info('Drop all tables for %s', engine)
+        self.metadata.drop_all(engine, tables=tables)
+
     def _database_all(self, engine):
         return database_operation(engine, 'all')
 
@@ -474,8 +960,222 @@ class Mapper:
         return database_operation(engine, 'exists')
 
 
+class LazyRegistry(dict):
+    """Registry of declarative classes building pending models of a lazy
+    :class:`.Mapper` when they are looked up
+    """
+    def __init__(self, build):
+        super().__init__()
+        self.build = build
+
+    def __contains__(self, classname):
+        return super().__contains__(classname) or self.build(classname)
+
+
 class OdmSession(Session):
+    """Session routing read-only statements to replicas.
 
-    def __init__(self, mapper, **options):
+    :param primary: when ``True`` the session is pinned to the primary
+        databases
+    """
+    def __init__(self, mapper, primary=False, **options):
         self.mapper = mapper
+        self.primary = primary
+        self._replica_binds = {}
+        self._written = set()
+        self._invalidated = []
+        self._bound = set(options.get('binds') or ())
+        if mapper._shards:
+            options.setdefault('query_cls', ShardedQuery)
+            self.connection_callable = self._shard_connection
         super().__init__(**options)
+
+    def get(self, model, ident):
+        """Instance of ``model`` with primary key ``ident`` or ``None``.
+
+        Equivalent to ``session.query(model).get(ident)`` but the query
+        is built and compiled only once per model.
+        """
+        if self.mapper.shards(class_mapper(model).local_table):
+            return self.query(model).get(ident)
+        if self.mapper.cache:
+            return self.mapper.cache.get(self, model, ident, self._get)
+        return self._get(model, ident)
+
+    def exists(self, model, ident):
+        """Check if a row of ``model`` with primary key ``ident`` exists
+        """
+        table = class_mapper(model).local_table
+        statement = self.mapper.queries.statement(('exists', table),
+                                                  exists_statement, table)
+        return self._execute_cached(model, statement, pk_params(ident),
+                                    clause=statement).scalar()
+
+    def update_by_pk(self, model, ident, **values):
+        """Update the ``values`` of the row of ``model`` with primary key
+        ``ident`` without loading it.
+
+        Instances already in the session are not refreshed.
+        :return: the number of updated rows
+        """
+        table = class_mapper(model).local_table
+        statement = self.mapper.queries.statement(('update', table),
+                                                  update_statement, table)
+        values.update(pk_params(ident))
+        if self.mapper.cache:
+            self.invalidate(table, ident)
+        return self._execute_cached(model, statement, values).rowcount
+
+    def use_primary(self):
+        """Pin the session to the primary databases
+        """
+        self.primary = True
+
+    def get_bind(self, mapper=None, clause=None):
+        try:
+            engine = super().get_bind(mapper, clause)
+        except UnboundExecutionError:
+            # tables of lazy models built after the session was created
+            tables = [t for t in self.mapper.binds if t not in self._bound]
+            if not tables:
+                raise
+            for table in tables:
+                self.bind_table(table, self.mapper.binds[table])
+                self._bound.add(table)
+            engine = super().get_bind(mapper, clause)
+        if not is_read_only(clause) or self._flushing:
+            self._written.add(engine)
+        elif not self.primary and engine not in self._written:
+            replica = self._replica_binds.get(engine)
+            if replica is None:
+                replicas = self.mapper.replicas(engine)
+                if replicas and replicas.available():
+                    replica = replicas.get()
+                    self._replica_binds[engine] = replica
+            if replica is not None:
+                return replica
+        return engine
+
+    def commit(self):
+        nested = self.transaction is not None and self.transaction.nested
+        super().commit()
+        if not nested:
+            self._end_transaction(True)
+
+    def rollback(self):
+        nested = self.transaction is not None and self.transaction.nested
+        super().rollback()
+        if not nested:
+            self._end_transaction(False)
+
+    def close(self):
+        super().close()
+        self._end_transaction(False)
+
+    def flush(self, objects=None):
+        cache = self.mapper.cache
+        if cache:
+            for instance in chain(self.dirty, self.deleted):
+                if cache.ttl_for(type(instance)) is not None:
+                    key = instance_state(instance).key
+                    if key:
+                        self.invalidate(object_mapper(instance).local_table,
+                                        key[1])
+        super().flush(objects)
+
+    def invalidate(self, table, ident=None):
+        """Invalidate the cache entry of a row of ``table``, all entries of
+        ``table`` when ``ident`` is ``None``, now and once the transaction
+        is committed
+        """
+        self.mapper.cache.invalidate(table, ident)
+        self._invalidated.append((table, ident))
+
+    def write_connection(self, bind):
+        """Connection to the primary ``bind`` for writes, such as bulk
+        operations, which do not select their bind via :meth:`get_bind`.
+
+        The write is recorded so that following reads of the session go
+        to the primary and the replica lag starts when committing.
+        """
+        self._written.add(bind)
+        return self.connection(bind=bind)
+
+    def get_many(self, model, idents, chunk_size=500):
+        """Return instances of ``model`` given their primary keys.
+
+        Instances not already in the identity map are loaded with one
+        ``SELECT ... WHERE pk IN (...)`` statement for every ``chunk_size``
+        primary keys rather than one statement per instance.
+
+        :param model: a mapped model
+        :param idents: iterable over primary keys
+        :return: a list of instances in the same order as ``idents``,
+            ``None`` for primary keys not found
+        """
+        idents = list(idents)
+        mapper = class_mapper(model)
+        if len(mapper.primary_key) != 1:
+            query = self.query(model)
+            return [query.get(ident) for ident in idents]
+
+        found = {}
+        missing = []
+        for ident in idents:
+            if ident in found:
+                continue
+            key = mapper.identity_key_from_primary_key((ident,))
+            instance = self.identity_map.get(key)
+            if instance is None:
+                missing.append(ident)
+            found[ident] = instance
+
+        pk = mapper.primary_key[0]
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start+chunk_size]
+            query = self.query(model).filter(pk.in_(chunk))
+            for instance in query:
+                ident = mapper.primary_key_from_instance(instance)[0]
+                found[ident] = instance
+
+        return [found[ident] for ident in idents]
+
+    def _end_transaction(self, committed):
+        if committed:
+            for engine in self._written:
+                replicas = self.mapper.replicas(engine)
+                if replicas:
+                    replicas.written()
+        for table, ident in self._invalidated:
+            # rows could have been cached again before the transaction end
+            self.mapper.cache.invalidate(table, ident)
+        self._written.clear()
+        self._replica_binds.clear()
+        self._invalidated = []
+
+    def _get(self, model, ident):
+        return self.mapper.queries.get(self, model, ident)
+
+    def _shard_connection(self, mapper, instance):
+        # Connection for flushing an instance
+        shards = self.mapper.shards(mapper.local_table)
+        if shards is None:
+            return self.connection(mapper)
+        value = getattr(instance, shards.key)
+        return self.connection(mapper, bind=shards.engine(value))
+
+    def _execute_cached(self, model, statement, params, clause=None):
+        conn = self.connection(mapper=class_mapper(model), clause=clause)
+        return self.mapper.queries.execute(conn, statement, params)
+
+
+def _bulk_invalidate(context):
+    # Query.update() and Query.delete() can change any row of the model
+    session = context.session
+    cache = session.mapper.cache
+    if cache and cache.ttl_for(context.mapper.class_) is not None:
+        session.invalidate(context.mapper.local_table)
+
+
+event.listen(OdmSession, 'after_bulk_update', _bulk_invalidate)
+event.listen(OdmSession, 'after_bulk_delete', _bulk_invalidate)
@@ -0,0 +1,261 @@
+"""Metrics of statements, connection pools and greenlet switches"""
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.sql.expression import Alias, Join, Select
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+SWITCH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+STATEMENT_TYPES = frozenset(('select', 'insert', 'update', 'delete'))
+
+
+class Histogram:
+    """Observations counted in buckets of upper bounds ``buckets``
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """List of ``(upper bound, cumulative count)`` pairs, the last
+        bound being ``+Inf``
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """Collect metrics of the engines of a :class:`.Mapper`.
+
+    * ``odm_statement_seconds`` histogram of statement latencies by table
+      and statement type
+    * ``odm_statement_switches`` histogram of greenlet switches waiting
+      for the database, for each statement on a green dialect
+    * ``odm_statement_rows_total`` rows returned, or affected, by
+      statements
+    * ``odm_pool_wait_seconds`` histogram of the time spent queuing for a
+      connection of a :class:`.GreenletPool`
+    * ``odm_pool_size`` and ``odm_pool_available`` gauges, read from the
+      pools when metrics are exported
+
+    Metrics are exported in the Prometheus text format via
+    :meth:`prometheus` and, when given, passed to
+    ``callback(name, value, labels)`` as they are observed.
+    Engines are instrumented via :meth:`attach` only, an engine without
+    metrics has no overhead.
+
+    :param buckets: upper bounds of the latency buckets in seconds
+    :param callback: optional callable invoked at each observation
+    """
+    def __init__(self, buckets=None, callback=None):
+        self.buckets = tuple(buckets or LATENCY_BUCKETS)
+        self.callback = callback
+        self.latency = {}
+        self.switches = {}
+        self.rows = {}
+        self.pool_wait = {}
+        self._engines = {}
+
+    def attach(self, engine, name=None):
+        """Instrument ``engine``, labelled as ``name`` (the url of the
+        engine without password by default)
+        """
+        if engine in self._engines:
+            return
+        name = name or repr(engine.url)
+        self._engines[engine] = name
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+        if hasattr(engine.pool, 'on_wait'):
+            engine.pool.on_wait = lambda waited: self._waited(name, waited)
+
+    def detach(self, engine=None):
+        """Remove instrumentation from ``engine`` or from all engines
+        """
+        engines = list(self._engines) if engine is None else [engine]
+        for engine in engines:
+            if self._engines.pop(engine, None) is None:
+                continue
+            event.remove(engine, 'before_cursor_execute', self._before)
+            event.remove(engine, 'after_cursor_execute', self._after)
+            if hasattr(engine.pool, 'on_wait'):
+                engine.pool.on_wait = None
+
+    def engines(self):
+        """Dictionary of instrumented engine-name pairs
+        """
+        return self._engines.copy()
+
+    def observe(self, name, value, **labels):
+        """Observe a ``value`` of metric ``name``
+        """
+        if name == 'odm_statement_seconds':
+            self._histogram(self.latency, labels, self.buckets, value)
+        elif name == 'odm_statement_switches':
+            self._histogram(self.switches, labels, SWITCH_BUCKETS, value)
+        elif name == 'odm_statement_rows_total':
+            key = _key(labels)
+            self.rows[key] = self.rows.get(key, 0) + value
+        elif name == 'odm_pool_wait_seconds':
+            self._histogram(self.pool_wait, labels, self.buckets, value)
+        else:
+            raise ValueError('Unknown metric "%s"' % name)
+        if self.callback:
+            self.callback(name, value, labels)
+
+    def pools(self):
+        """Dictionary of ``size`` and ``available`` connections by engine
+        name
+        """
+        pools = {}
+        for engine, name in self._engines.items():
+            stats = pool_stats(engine.pool)
+            if stats:
+                pools[name] = stats
+        return pools
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for name, histograms in (('odm_statement_seconds', self.latency),
+                                 ('odm_statement_switches', self.switches),
+                                 ('odm_pool_wait_seconds', self.pool_wait)):
+            if histograms:
+                lines.append('# TYPE %s histogram' % name)
+            for key, histogram in sorted(histograms.items()):
+                for bound, count in histogram.cumulative():
+                    lines.append('%s_bucket%s %s' % (
+                        name, _labels(key + (('le', bound),)), count))
+                lines.append('%s_sum%s %s' % (name, _labels(key),
+                                              histogram.sum))
+                lines.append('%s_count%s %s' % (name, _labels(key),
+                                                histogram.count))
+        if self.rows:
+            lines.append('# TYPE odm_statement_rows_total counter')
+            for key, value in sorted(self.rows.items()):
+                lines.append('odm_statement_rows_total%s %s' % (
+                    _labels(key), value))
+        pools = self.pools()
+        for gauge in ('size', 'available'):
+            if pools:
+                lines.append('# TYPE odm_pool_%s gauge' % gauge)
+            for name, stats in sorted(pools.items()):
+                lines.append('odm_pool_%s%s %s' % (
+                    gauge, _labels((('engine', name),)), stats[gauge]))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def clear(self):
+        self.latency.clear()
+        self.switches.clear()
+        self.rows.clear()
+        self.pool_wait.clear()
+
+    # INTERNALS
+    def _histogram(self, histograms, labels, buckets, value):
+        key = _key(labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = Histogram(buckets)
+            histograms[key] = histogram
+        histogram.observe(value)
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        if context is None:
+            return
+        switches = getattr(conn.dialect.dbapi, 'switches', None)
+        context._odm_metrics = (
+            time.perf_counter(),
+            switches(cursor.connection) if switches else None
+        )
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        started = getattr(context, '_odm_metrics', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started[0]
+        table = statement_table(context.compiled)
+        kind = statement_type(statement)
+        self.observe('odm_statement_seconds', elapsed,
+                     table=table, type=kind)
+        if started[1] is not None:
+            switches = conn.dialect.dbapi.switches(cursor.connection)
+            self.observe('odm_statement_switches', switches - started[1],
+                         table=table, type=kind)
+        rows = getattr(cursor, 'rowcount', -1)
+        if rows is not None and rows >= 0:
+            self.observe('odm_statement_rows_total', rows,
+                         table=table, type=kind)
+
+    def _waited(self, name, waited):
+        self.observe('odm_pool_wait_seconds', waited, engine=name)
+
+
+def statement_type(sql):
+    """The type of a ``sql`` statement, ``other`` for statements which
+    are not a select, insert, update or delete
+    """
+    kind = sql.lstrip()[:6].lower()
+    return kind if kind in STATEMENT_TYPES else 'other'
+
+
+def statement_table(compiled):
+    """The name of the table of a compiled statement, the first table
+    of the ``FROM`` clause of selects, an empty string if not available
+    """
+    statement = getattr(compiled, 'statement', None)
+    table = getattr(statement, 'table', statement)
+    while True:
+        if isinstance(table, Join):
+            table = table.left
+        elif isinstance(table, Alias):
+            table = table.original
+        elif isinstance(table, Select):
+            froms = table.froms
+            table = froms[0] if froms else None
+        else:
+            return getattr(table, 'name', None) or ''
+
+
+def pool_stats(pool):
+    """Dictionary with the ``size`` and ``available`` connections of a
+    ``pool``, ``None`` if not available
+    """
+    if hasattr(pool, 'stats'):
+        stats = pool.stats()
+        return dict(size=stats['size'], available=stats['available'])
+    elif hasattr(pool, 'checkedin') and hasattr(pool, 'checkedout'):
+        return dict(size=pool.checkedin() + pool.checkedout(),
+                    available=pool.checkedin())
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _labels(pairs):
+    return '{%s}' % ','.join('%s="%s"' % (key, _escape(value))
+                             for key, value in pairs)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
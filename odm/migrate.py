@@ -0,0 +1,394 @@
+"""Differences between tables and a live database and online migrations"""
+import re
+
+from sqlalchemy import inspect, types, text
+from sqlalchemy.schema import (CreateTable, CreateIndex, CreateColumn,
+                               AddConstraint, sort_tables, CheckConstraint,
+                               ForeignKeyConstraint, UniqueConstraint)
+from sqlalchemy.dialects.postgresql.base import CreateEnumType
+
+from .types import ChoiceType
+
+
+CREATE_INDEX = re.compile(r'^CREATE (UNIQUE )?INDEX ')
+ADD = re.compile(r'\bADD ')
+INVALID_INDEXES = text(
+    'SELECT c.relname FROM pg_index i '
+    'JOIN pg_class c ON c.oid = i.indexrelid '
+    'JOIN pg_class t ON t.oid = i.indrelid '
+    'JOIN pg_namespace n ON n.oid = t.relnamespace '
+    'WHERE NOT i.indisvalid AND t.relname = :table AND n.nspname = :schema')
+
+
+class SchemaChange:
+    """A change of the schema of a table.
+
+    ``statements`` are the SQL statements applying the change, ``reason``
+    explains why changes which cannot be applied online, without
+    statements, are only reported.
+    """
+    __slots__ = ('kind', 'table', 'name', 'statements', 'reason')
+
+    def __init__(self, kind, table, name=None, statements=None, reason=None):
+        self.kind = kind
+        self.table = table
+        self.name = name
+        self.statements = statements or []
+        self.reason = reason
+
+    def __repr__(self):
+        name = '%s.%s' % (self.table, self.name) if self.name else self.table
+        return '%s %s' % (self.kind, name)
+
+    @property
+    def applicable(self):
+        return bool(self.statements)
+
+
+class Migration:
+    """The changes bringing the schema of the database of ``engine`` in
+    line with the tables of a mapper
+    """
+    def __init__(self, engine, changes, bind=None):
+        self.engine = engine
+        self.changes = changes
+        self.bind = bind
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def __str__(self):
+        lines = ['-- %s (%r)' % (self.bind, self.engine.url)]
+        for change in self.changes:
+            if change.applicable:
+                lines.extend('%s;' % sql for sql in change.statements)
+            else:
+                lines.append('-- not applied: %r, %s' % (change,
+                                                         change.reason))
+        return '\n'.join(lines)
+
+    def statements(self):
+        """List of statements applying the changes
+        """
+        return [sql for change in self.changes for sql in change.statements]
+
+    def apply(self):
+        """Execute the statements of the changes, one at the time.
+
+        On postgresql statements run outside transactions, as required by
+        ``CREATE INDEX CONCURRENTLY``, otherwise each statement is
+        committed once executed.
+        """
+        statements = self.statements()
+        if not statements:
+            return
+        conn = self.engine.raw_connection()
+        autocommit = self.engine.dialect.name == 'postgresql'
+        try:
+            if autocommit:
+                conn.connection.autocommit = True
+            cursor = conn.cursor()
+            for sql in statements:
+                cursor.execute(sql)
+                if not autocommit:
+                    conn.commit()
+            cursor.close()
+        finally:
+            if autocommit:
+                conn.connection.autocommit = False
+            conn.close()
+
+
+def schema_diff(engine, tables, bind=None, convert_choices=False):
+    """The :class:`.Migration` of ``tables`` for the database of ``engine``.
+
+    Only additive changes are applied: missing tables are created and
+    columns, indexes and constraints added. On postgresql indexes are
+    created ``CONCURRENTLY`` and foreign key and check constraints are
+    added ``NOT VALID`` and validated afterwards, unique constraints
+    are added using a unique index created concurrently. Columns which
+    are not nullable and without a server default and columns of the
+    database not in the tables are reported, but not changed. Invalid
+    indexes, left by a failed ``CREATE INDEX CONCURRENTLY``, are dropped
+    and created again.
+
+    Varchar columns of a :class:`.ChoiceType` with enum or smallint
+    storage are converted, on postgresql, only when ``convert_choices``
+    is true, since the table is locked while rewritten. Native enum types
+    are created before the columns using them.
+    """
+    dialect = engine.dialect
+    inspector = inspect(engine)
+    existing = {}
+    enums = None
+    if dialect.name == 'postgresql':
+        enums = set((enum['schema'], enum['name'])
+                    for enum in inspector.get_enums('*'))
+    changes = []
+    for table in sort_tables(tables):
+        names = existing.get(table.schema)
+        if names is None:
+            names = set(inspector.get_table_names(schema=table.schema))
+            existing[table.schema] = names
+        if table.name not in names:
+            table_changes = [SchemaChange(
+                'create_table', table.name, statements=[
+                    _sql(CreateTable(table), dialect)
+                ] + [_sql(CreateIndex(index), dialect)
+                     for index in _sorted(table.indexes)])]
+        else:
+            table_changes = table_diff(inspector, dialect, table,
+                                       convert_choices)
+        if enums is not None:
+            changes.extend(enum_changes(table, table_changes, dialect, enums,
+                                        inspector.default_schema_name))
+        changes.extend(table_changes)
+    return Migration(engine, changes, bind)
+
+
+def table_diff(inspector, dialect, table, convert_choices=False):
+    """Changes of an existing ``table``
+    """
+    changes = []
+    name, schema = table.name, table.schema
+    preparer = dialect.identifier_preparer
+    reflected = dict((c['name'], c['type'])
+                     for c in inspector.get_columns(name, schema))
+    columns = set(reflected)
+    for column in table.columns:
+        if column.name in columns:
+            change = choice_change(column, reflected[column.name], dialect,
+                                   convert_choices)
+            if change:
+                changes.append(change)
+            continue
+        change = SchemaChange('add_column', name, column.name)
+        if column.primary_key:
+            change.reason = 'primary key column'
+        elif not column.nullable and column.server_default is None:
+            change.reason = 'not nullable column without a server default'
+        else:
+            change.statements.append('ALTER TABLE %s ADD COLUMN %s' % (
+                preparer.format_table(table),
+                _sql(CreateColumn(column), dialect)))
+        changes.append(change)
+    for column in sorted(columns - set(c.name for c in table.columns)):
+        changes.append(SchemaChange('extra_column', name, column,
+                                    reason='column not in the table'))
+
+    invalid = invalid_indexes(inspector, dialect, table)
+    indexes = [index for index in inspector.get_indexes(name, schema)
+               if index['name'] not in invalid]
+    index_names = set(index['name'] for index in indexes)
+    index_columns = set(tuple(index['column_names']) for index in indexes)
+    for index in _sorted(table.indexes):
+        keys = tuple(column.name for column in index.columns)
+        if index.name not in invalid and (index.name in index_names or
+                                          keys in index_columns):
+            continue
+        changes.append(SchemaChange(
+            'create_index', name, index.name,
+            drop_invalid(invalid, table, index.name, dialect) +
+            [concurrently(_sql(CreateIndex(index), dialect), dialect)]))
+
+    uniques = set(tuple(unique['column_names']) for unique in
+                  inspector.get_unique_constraints(name, schema))
+    uniques.update(tuple(index['column_names']) for index in indexes
+                   if index['unique'])
+    foreign_keys = set(
+        (tuple(fk['constrained_columns']), fk['referred_table'])
+        for fk in inspector.get_foreign_keys(name, schema))
+    try:
+        checks = set(check['name'] for check in
+                     inspector.get_check_constraints(name, schema))
+    except NotImplementedError:
+        checks = None
+    for constraint in sorted(table.constraints, key=_constraint_order):
+        keys = tuple(column.name for column in constraint.columns)
+        if isinstance(constraint, UniqueConstraint):
+            if keys in uniques:
+                continue
+            kind = 'add_unique'
+        elif isinstance(constraint, ForeignKeyConstraint):
+            if (keys, constraint.referred_table.name) in foreign_keys:
+                continue
+            kind = 'add_foreign_key'
+        elif isinstance(constraint, CheckConstraint):
+            if (checks is None or not constraint.name or
+                    constraint.name in checks):
+                continue
+            kind = 'add_check'
+        else:
+            continue
+        change = SchemaChange(kind, name, constraint_name(constraint))
+        if dialect.name == 'postgresql':
+            change.statements = constraint_statements(constraint, dialect)
+            if kind == 'add_unique':
+                change.statements[:0] = drop_invalid(invalid, table,
+                                                     change.name, dialect)
+        else:
+            change.reason = 'constraints are added on postgresql only'
+        changes.append(change)
+    return changes
+
+
+def invalid_indexes(inspector, dialect, table):
+    """Names of the invalid indexes of ``table`` on postgresql, left by a
+    failed ``CREATE INDEX CONCURRENTLY``
+    """
+    if dialect.name != 'postgresql':
+        return set()
+    schema = table.schema or inspector.default_schema_name
+    result = inspector.bind.execute(INVALID_INDEXES, table=table.name,
+                                    schema=schema)
+    return set(row[0] for row in result)
+
+
+def drop_invalid(invalid, table, name, dialect):
+    """Statements dropping the index ``name`` of ``table`` if invalid
+    """
+    if name not in invalid:
+        return []
+    preparer = dialect.identifier_preparer
+    name = preparer.quote(name)
+    if table.schema:
+        name = '%s.%s' % (preparer.quote_schema(table.schema), name)
+    return ['DROP INDEX CONCURRENTLY %s' % name]
+
+
+def constraint_statements(constraint, dialect):
+    """Statements adding ``constraint`` to an existing postgresql table
+    without locking it for the time needed to check existing rows.
+    """
+    preparer = dialect.identifier_preparer
+    table = preparer.format_table(constraint.table)
+    name = preparer.quote(constraint_name(constraint))
+    if isinstance(constraint, UniqueConstraint):
+        return [
+            'CREATE UNIQUE INDEX CONCURRENTLY %s ON %s (%s)' % (
+                name, table, ', '.join(preparer.quote(column.name)
+                                       for column in constraint.columns)),
+            'ALTER TABLE %s ADD CONSTRAINT %s UNIQUE USING INDEX %s' % (
+                table, name, name)
+        ]
+    sql = _sql(AddConstraint(constraint), dialect)
+    if not constraint.name:
+        sql = ADD.sub('ADD CONSTRAINT %s ' % name, sql, count=1)
+    return ['%s NOT VALID' % sql,
+            'ALTER TABLE %s VALIDATE CONSTRAINT %s' % (table, name)]
+
+
+def choice_change(column, existing, dialect, convert=False):
+    """The change converting ``column``, of ``existing`` varchar type, to
+    the storage of its :class:`.ChoiceType`, if needed
+    """
+    type_ = column.type
+    if (not isinstance(type_, ChoiceType) or type_.storage == 'varchar' or
+            not isinstance(existing, types.String) or
+            isinstance(existing, types.Enum)):
+        return
+    change = SchemaChange('convert_choice', column.table.name, column.name)
+    if dialect.name != 'postgresql':
+        change.reason = 'choices are converted on postgresql only'
+    elif not convert:
+        change.reason = 'rewrites the table, use convert_choices'
+    else:
+        change.statements = choice_statements(column, dialect)
+    return change
+
+
+def choice_statements(column, dialect):
+    """Statements converting the varchar ``column`` of a
+    :class:`.ChoiceType` to its native enum or smallint storage.
+
+    Stored codes different from the varchar ones are mapped, other
+    values cast, so that invalid values fail the conversion.
+    """
+    type_ = column.type
+    preparer = dialect.identifier_preparer
+    name = preparer.quote(column.name)
+    target = dialect.type_compiler.process(type_.impl)
+    using = name
+    if type_.stored is not None:
+        literal = types.String().literal_processor(dialect)
+        using = '(CASE %s %s ELSE %s END)' % (name, ' '.join(
+            'WHEN %s THEN %s' % (literal(str(code)), literal(str(stored)))
+            for code, stored in sorted(type_.stored.items(),
+                                       key=lambda item: str(item[0]))), name)
+    return ['ALTER TABLE %s ALTER COLUMN %s TYPE %s USING %s::%s' % (
+        preparer.format_table(column.table), name, target, using, target)]
+
+
+def enum_changes(table, changes, dialect, enums, schema=None):
+    """Changes creating the native enum types, not in ``enums``, of the
+    columns of ``table`` created or converted by ``changes``
+    """
+    created = []
+    for change in changes:
+        if not change.applicable:
+            continue
+        if change.kind == 'create_table':
+            columns = table.columns
+        elif change.kind in ('add_column', 'convert_choice'):
+            columns = [c for c in table.columns if c.name == change.name]
+        else:
+            continue
+        for column in columns:
+            enum = native_enum(column.type)
+            if enum is None:
+                continue
+            key = (enum.schema or schema, enum.name)
+            if key not in enums:
+                enums.add(key)
+                created.append(SchemaChange(
+                    'create_enum', table.name, enum.name,
+                    [_sql(CreateEnumType(enum), dialect)]))
+    return created
+
+
+def native_enum(type_):
+    """The native enum type of a column of ``type_``, if any
+    """
+    impl = getattr(type_, 'impl', type_)
+    if isinstance(impl, types.Enum) and impl.native_enum and impl.name:
+        return impl
+
+
+def constraint_name(constraint):
+    """The name of ``constraint``, the postgresql default name when not
+    given
+    """
+    if constraint.name:
+        return constraint.name
+    suffix = 'fkey' if isinstance(constraint, ForeignKeyConstraint) else 'key'
+    return '_'.join([constraint.table.name] +
+                    [column.name for column in constraint.columns] +
+                    [suffix])
+
+
+def concurrently(sql, dialect):
+    """Create an index ``CONCURRENTLY`` on postgresql
+    """
+    if dialect.name == 'postgresql':
+        sql = CREATE_INDEX.sub(
+            lambda m: 'CREATE %sINDEX CONCURRENTLY ' % (m.group(1) or ''),
+            sql)
+    return sql
+
+
+def _sql(element, dialect):
+    return str(element.compile(dialect=dialect)).strip()
+
+
+def _sorted(indexes):
+    return sorted(indexes, key=lambda index: index.name or '')
+
+
+def _constraint_order(constraint):
+    # unique constraints first, as they may be referenced by foreign keys
+    return (not isinstance(constraint, UniqueConstraint),
+            type(constraint).__name__, constraint.name or '',
+            tuple(column.name for column in constraint.columns))
@@ -0,0 +1,71 @@
+"""Queries built once per model and lookup pattern"""
+from sqlalchemy import and_, bindparam, exists, select, util
+from sqlalchemy.ext import baked
+
+
+class QueryCache:
+    """Cache of queries and statements keyed by their shape.
+
+    ORM queries are baked so that neither the query nor its compiled
+    form are built again, core statements are built once and their compiled
+    form stored, per dialect, in the :attr:`compiled` cache.
+
+    :param size: maximum number of compiled queries and statements
+    """
+    def __init__(self, size=500):
+        self.size = size
+        self.bakery = baked.bakery(size)
+        self.compiled = util.LRUCache(size)
+        self._queries = {}
+        self._statements = {}
+
+    def get(self, session, model, ident):
+        """Instance of ``model`` with primary key ``ident`` or ``None``
+        """
+        query = self._queries.get(model)
+        if query is None:
+            query = self.bakery(lambda session: session.query(model), model)
+            self._queries[model] = query
+        return query(session).get(ident)
+
+    def statement(self, key, factory, *args):
+        """The statement for ``key``, built by ``factory(*args)`` the
+        first time
+        """
+        statement = self._statements.get(key)
+        if statement is None:
+            statement = factory(*args)
+            self._statements[key] = statement
+        return statement
+
+    def execute(self, conn, statement, params=None):
+        """Execute a cached ``statement`` without compiling it again
+        """
+        conn = conn.execution_options(compiled_cache=self.compiled)
+        return conn.execute(statement, params or {})
+
+    def clear(self):
+        self.bakery = baked.bakery(self.size)
+        self.compiled.clear()
+        self._queries.clear()
+        self._statements.clear()
+
+
+def pk_params(ident):
+    """Parameters of the statements selecting a row by primary key
+    """
+    ident = util.to_list(ident)
+    return dict((('pk_%d' % i, value) for i, value in enumerate(ident)))
+
+
+def pk_clause(table):
+    return and_(*[column == bindparam('pk_%d' % i)
+                  for i, column in enumerate(table.primary_key)])
+
+
+def exists_statement(table):
+    return select([exists().where(pk_clause(table))])
+
+
+def update_statement(table):
+    return table.update().where(pk_clause(table))
@@ -0,0 +1,86 @@
+"""Routing of read-only statements to replica databases"""
+import time
+from itertools import cycle
+
+from sqlalchemy import event
+from sqlalchemy.sql.expression import Select, CompoundSelect
+
+from pulsar.api import ImproperlyConfigured
+
+
+class Replicas:
+    """Engines of the read replicas of a primary database.
+
+    :param engines: list of replica engines
+    :param routing: ``round_robin`` cycles through the replicas,
+        ``least_outstanding`` picks the replica with less connections
+        checked out
+    :param lag: seconds during which, after a session has written to the
+        primary, reads are routed to the primary as well. It should be
+        larger than the replication lag for sessions to read their writes
+    """
+    routings = ('round_robin', 'least_outstanding')
+
+    def __init__(self, engines, routing=None, lag=0):
+        routing = routing or self.routings[0]
+        if routing not in self.routings:
+            raise ImproperlyConfigured('Unknown replica routing "%s"'
+                                       % routing)
+        self.engines = list(engines)
+        self.routing = routing
+        self.lag = lag
+        self.last_write = 0
+        self.outstanding = dict(((engine, 0) for engine in self.engines))
+        self._cycle = cycle(self.engines)
+        for engine in self.engines:
+            event.listen(engine, 'checkout', self._checkout(engine))
+            event.listen(engine, 'checkin', self._checkin(engine))
+
+    def __len__(self):
+        return len(self.engines)
+
+    def available(self):
+        """True if reads can be routed to the replicas
+        """
+        return bool(self.engines and
+                    time.time() - self.last_write >= self.lag)
+
+    def get(self):
+        """Pick the replica engine for a session
+        """
+        if self.routing == 'least_outstanding':
+            return min(self.engines, key=self.outstanding.__getitem__)
+        return next(self._cycle)
+
+    def written(self):
+        """Record a write to the primary
+        """
+        self.last_write = time.time()
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+    def reset(self):
+        """Reset the counts of outstanding connections, in a forked process
+        """
+        self.outstanding = dict(((engine, 0) for engine in self.engines))
+
+    def _checkout(self, engine):
+        def _(dbapi_connection, record, proxy):
+            self.outstanding[engine] += 1
+        return _
+
+    def _checkin(self, engine):
+        def _(dbapi_connection, record):
+            self.outstanding[engine] = max(self.outstanding[engine] - 1, 0)
+        return _
+
+
+def is_read_only(clause):
+    """True if ``clause`` is a select statement not locking rows
+    """
+    if isinstance(clause, CompoundSelect):
+        return True
+    return (isinstance(clause, Select) and
+            getattr(clause, '_for_update_arg', None) is None)
@@ -0,0 +1,211 @@
+"""Horizontal sharding of tables across engines"""
+from zlib import crc32
+from asyncio import get_event_loop, gather
+
+from sqlalchemy import util
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.exc import UnmappedColumnError
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.expression import UnaryExpression, Alias, Select
+from sqlalchemy.sql.functions import FunctionElement
+
+from pulsar.apps.greenio import wait, run_in_greenlet, getcurrent
+
+
+# Aggregate functions, whose results cannot be merged across shards
+AGGREGATES = frozenset(('count', 'max', 'min', 'sum', 'avg', 'array_agg',
+                        'string_agg', 'json_agg', 'jsonb_agg', 'bool_and',
+                        'bool_or', 'every', 'stddev', 'variance'))
+
+
+def shard_hash(value, size):
+    """Default shard function, the index of the shard of ``value``.
+
+    It does not depend on the python hash seed so that all processes
+    agree on the shard of a value.
+    """
+    return crc32(str(value).encode('utf-8')) % size
+
+
+class Shards:
+    """The engines of a table sharded by the values of the ``key`` column.
+
+    :param engines: list of engines, one for each shard
+    :param key: the key of the column defining the shard of a row
+    :param function: a function returning the index of the shard given
+        a value of the ``key`` column and the number of shards
+    """
+    def __init__(self, engines, key, function=None):
+        self.engines = list(engines)
+        self.key = key
+        self.function = function or shard_hash
+
+    def __len__(self):
+        return len(self.engines)
+
+    def engine(self, value):
+        """The engine of the shard of a shard key ``value``
+        """
+        return self.engines[self.function(value, len(self.engines))]
+
+
+class ShardedQuery(Query):
+    """Query of a session with sharded tables.
+
+    Queries on a sharded model run on all shards concurrently, on separate
+    greenlets with a green dialect, and their results are merged. Ordering
+    is applied to the merged instances while ``limit`` and ``offset``
+    are pushed down as a ``limit`` on each shard. :meth:`count` sums the
+    counts of all shards, while other aggregates, grouping and queries
+    from subqueries, such as ``from_self``, raise ``NotImplementedError``
+    unless restricted to one shard.
+    A query can be restricted to the shard of a shard key value via
+    :meth:`shard`, while :meth:`get` queries the shard of the primary key
+    when it is the shard key.
+    """
+    _shard_engine = None
+
+    def shard(self, value):
+        """A new query limited to the shard of shard key ``value``
+        """
+        shards = self._shards()
+        query = self._clone()
+        if shards is not None:
+            query._shard_engine = shards.engine(value)
+        return query
+
+    def count(self):
+        shards = self._shards()
+        if shards is None or self._shard_engine is not None:
+            return super().count()
+        if self._limit is not None or self._offset:
+            raise NotImplementedError('Cannot count cross-shard queries '
+                                      'with limit or offset')
+        total = 0
+        for engine in shards.engines:
+            query = self._clone()
+            query._shard_engine = engine
+            total += query.count()
+        return total
+
+    def get(self, ident):
+        shards = self._shards()
+        if shards is None or self._shard_engine is not None:
+            return super().get(ident)
+        mapper = self._mapper_zero()
+        idents = util.to_list(ident)
+        keys = [mapper.get_property_by_column(column).key
+                for column in mapper.primary_key]
+        if shards.key in keys:
+            return self.shard(idents[keys.index(shards.key)]).get(ident)
+        for engine in shards.engines:
+            query = self._clone()
+            query._shard_engine = engine
+            instance = query.get(ident)
+            if instance is not None:
+                return instance
+
+    def _shards(self):
+        mapper = self._bind_mapper()
+        if mapper is not None:
+            return self.session.mapper.shards(mapper.local_table)
+
+    def _connection_from_session(self, **kw):
+        if self._shard_engine is not None:
+            kw['bind'] = self._shard_engine
+        return super()._connection_from_session(**kw)
+
+    def _execute_and_instances(self, context):
+        shards = self._shards()
+        if shards is None or self._shard_engine is not None:
+            return super()._execute_and_instances(context)
+        self._check_cross_shard()
+        query = self
+        offset = self._offset or 0
+        if self._offset or self._limit is not None:
+            query = self._clone()
+            query._offset = None
+            if self._limit is not None:
+                query._limit = offset + self._limit
+            context = query._compile_context()
+            context.statement.use_labels = True
+
+        mapper = self._bind_mapper()
+        conns = [self._connection_from_session(mapper=mapper,
+                                               bind=engine,
+                                               close_with_result=True)
+                 for engine in shards.engines]
+        if self.session.mapper.is_green and getcurrent().parent:
+            results = wait(gather(*[
+                _green_execute(conn, context.statement, self._params)
+                for conn in conns
+            ], loop=get_event_loop()))
+        else:
+            results = [_execute(conn, context.statement, self._params)
+                       for conn in conns]
+
+        instances = []
+        for result in results:
+            instances.extend(query.instances(result, context))
+        if self._order_by and len(shards) > 1:
+            self._sort(instances)
+        if offset or self._limit is not None:
+            end = None if self._limit is None else offset + self._limit
+            instances = instances[offset:end]
+        return iter(instances)
+
+    def _check_cross_shard(self):
+        # Raise for queries whose results cannot be merged across shards
+        if self._group_by or self._having is not None:
+            raise NotImplementedError('Cannot group cross-shard queries')
+        for selectable in self._from_obj:
+            if isinstance(selectable, Alias) and isinstance(
+                    selectable.original, Select):
+                raise NotImplementedError('Cannot select cross-shard '
+                                          'queries from subqueries')
+        for entity in self._entities:
+            column = getattr(entity, 'column', None)
+            if column is None:
+                continue
+            for element in visitors.iterate(column, {}):
+                if (isinstance(element, FunctionElement) and
+                        element.name.lower() in AGGREGATES):
+                    raise NotImplementedError(
+                        'Cannot aggregate cross-shard queries, other than '
+                        'with count(), restrict them to a shard')
+
+    def _sort(self, instances):
+        if len(self._entities) > 1:
+            raise NotImplementedError('Cannot order cross-shard queries '
+                                      'with more than one entity')
+        mapper = self._mapper_zero()
+        # sort by the last ordering column first, the sort is stable
+        for clause in reversed(self._order_by):
+            reverse = False
+            if isinstance(clause, UnaryExpression):
+                reverse = clause.modifier is operators.desc_op
+                clause = clause.element
+            element = getattr(clause, 'element', None)
+            if isinstance(element, str):
+                # ordering by the name of a column
+                clause = mapper.columns[element]
+            try:
+                key = mapper.get_property_by_column(clause).key
+            except UnmappedColumnError:
+                raise NotImplementedError('Cross-shard queries can only be '
+                                          'ordered by columns of the model')
+            instances.sort(key=lambda instance: _sort_key(instance, key),
+                           reverse=reverse)
+
+
+def _sort_key(instance, key):
+    # nulls sort last in ascending order as in postgresql
+    value = getattr(instance, key)
+    return (value is None, 0 if value is None else value)
+
+
+def _execute(conn, statement, params):
+    return conn.execute(statement, params)
+
+
+_green_execute = run_in_greenlet(_execute)
@@ -0,0 +1,190 @@
+"""Log of slow statements with optional capture of their plans"""
+import os
+import sys
+import time
+import random
+import logging
+from asyncio import ensure_future, get_event_loop
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+from pulsar.apps.greenio import run_in_greenlet
+
+from .metrics import statement_type
+
+
+logger = logging.getLogger('pulsar.odm')
+
+# Modules skipped when looking for the site calling a statement
+INTERNAL_MODULES = ('odm.', 'sqlalchemy.', 'pulsar.', 'asyncio.',
+                    'concurrent.', 'contextlib', 'threading')
+
+
+class SlowQuery:
+    """A statement which took longer than the threshold of a
+    :class:`.SlowQueryLog`.
+
+    ``plan`` is the output of ``EXPLAIN`` once captured, ``None`` otherwise.
+    """
+    __slots__ = ('statement', 'parameters', 'bind', 'elapsed', 'site',
+                 'timestamp', 'plan')
+
+    def __init__(self, statement, parameters, bind, elapsed, site):
+        self.statement = statement
+        self.parameters = parameters
+        self.bind = bind
+        self.elapsed = elapsed
+        self.site = site
+        self.timestamp = time.time()
+        self.plan = None
+
+    def __repr__(self):
+        return '%.3fs %s %s' % (self.elapsed, self.bind, self.statement)
+
+    def as_dict(self):
+        return dict(((name, getattr(self, name)) for name in self.__slots__))
+
+
+class SlowQueryLog:
+    """Record statements slower than ``threshold`` seconds in a bounded
+    ring buffer, :attr:`entries`, of :class:`.SlowQuery`.
+
+    Parameter values are replaced by their type name unless ``redact`` is
+    ``False``. On postgresql, a ``explain`` fraction of slow select,
+    insert, update and delete statements are explained, via
+    ``EXPLAIN (ANALYZE off)`` on a different connection, in the background:
+    on a new greenlet with a green dialect, on a thread otherwise.
+
+    :param threshold: minimum elapsed time, in seconds, of a slow statement
+    :param size: maximum number of entries
+    :param explain: fraction, between 0 and 1, of entries to explain
+    :param redact: redact parameters
+    """
+    def __init__(self, threshold=1, size=100, explain=0, redact=True):
+        self.threshold = threshold
+        self.entries = deque(maxlen=size)
+        self.explain = explain
+        self.redact = redact
+        self._engines = {}
+        self._executor = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(tuple(self.entries))
+
+    def attach(self, engine, bind='default'):
+        """Log slow statements of ``engine``, labelled as ``bind``
+        """
+        if engine in self._engines:
+            return
+        self._engines[engine] = bind
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def detach(self, engine=None):
+        """Stop logging statements of ``engine`` or of all engines
+        """
+        engines = list(self._engines) if engine is None else [engine]
+        for engine in engines:
+            if self._engines.pop(engine, None) is None:
+                continue
+            event.remove(engine, 'before_cursor_execute', self._before)
+            event.remove(engine, 'after_cursor_execute', self._after)
+
+    def clear(self):
+        self.entries.clear()
+
+    def close(self):
+        self.detach()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    # INTERNALS
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        if context is not None:
+            context._odm_slow = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        started = getattr(context, '_odm_slow', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold:
+            return
+        engine = conn.engine
+        entry = SlowQuery(statement,
+                          redact(parameters) if self.redact else parameters,
+                          self._engines.get(engine), elapsed, call_site())
+        self.entries.append(entry)
+        logger.warning('Slow statement %r at %s', entry, entry.site)
+        if (self.explain and conn.dialect.name == 'postgresql' and
+                statement_type(statement) != 'other' and
+                random.random() < self.explain):
+            if executemany:
+                parameters = parameters[0]
+            self._explain_later(engine, entry, statement, parameters)
+
+    def _explain_later(self, engine, entry, statement, parameters):
+        if getattr(engine.dialect, 'is_green', False):
+            ensure_future(_green_explain(engine, entry, statement, parameters),
+                          loop=get_event_loop())
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._executor.submit(_explain, engine, entry, statement,
+                                  parameters)
+
+
+def redact(parameters):
+    """Replace values of ``parameters`` with the name of their type
+    """
+    if isinstance(parameters, dict):
+        return dict(((key, _redacted(value))
+                     for key, value in parameters.items()))
+    elif isinstance(parameters, (list, tuple)):
+        return type(parameters)(redact(value) if isinstance(
+            value, (dict, list, tuple)) else _redacted(value)
+            for value in parameters)
+    return parameters
+
+
+def call_site():
+    """``path:line in function`` of the first frame outside odm and its
+    dependencies
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_globals.get('__name__', '')
+        if not name.startswith(INTERNAL_MODULES):
+            code = frame.f_code
+            return '%s:%d in %s' % (os.path.relpath(code.co_filename),
+                                    frame.f_lineno, code.co_name)
+        frame = frame.f_back
+    return ''
+
+
+def _redacted(value):
+    return None if value is None else '<%s>' % type(value).__name__
+
+
+def _explain(engine, entry, statement, parameters):
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('EXPLAIN (ANALYZE off) %s' % statement, parameters)
+        entry.plan = '\n'.join(row[0] for row in cursor.fetchall())
+        cursor.close()
+    except Exception:
+        logger.exception('Could not explain slow statement %r', entry)
+    finally:
+        conn.close()
+
+
+_green_explain = run_in_greenlet(_explain)
@@ -0,0 +1,106 @@
+"""Stream large result sets"""
+from collections import deque
+from itertools import islice
+
+from sqlalchemy.orm import Query
+
+from pulsar.apps.greenio import run_in_greenlet, getcurrent
+
+
+class ResultStream:
+    """Iterate over the result of a query without loading it in memory.
+
+    Rows are fetched ``batch_size`` at a time from a server side cursor
+    (a named cursor with psycopg2) on a dedicated session, kept open
+    until the iteration ends or :meth:`close` is called.
+
+    From a greenlet the stream is a plain iterator::
+
+        for row in mapper.stream(query):
+            ...
+
+    from asyncio code it is an asynchronous iterator::
+
+        async for row in mapper.stream(query, pool=green_pool):
+            ...
+
+    and every batch is fetched in a greenlet, of ``pool`` when given.
+    A new batch is only fetched once all rows of the previous one have
+    been consumed.
+
+    :param mapper: the :class:`.Mapper` providing the session
+    :param query: a :class:`~sqlalchemy.orm.Query` or a core selectable
+    :param batch_size: number of rows fetched at each database round trip
+    :param pool: optional :class:`.GreenPool` fetching batches for
+        asynchronous iteration
+    """
+    def __init__(self, mapper, query, batch_size=1000, pool=None):
+        self.mapper = mapper
+        self.query = query
+        self.batch_size = batch_size
+        self.pool = pool
+        self._rows = None
+        self._batch = deque()
+
+    def __iter__(self):
+        with self.mapper.begin() as session:
+            if isinstance(self.query, Query):
+                yield from self.query.with_session(session).yield_per(
+                    self.batch_size)
+            else:
+                yield from self._execute(session)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._batch:
+            if self.pool:
+                batch = await self.pool.submit(self._fetch)
+            else:
+                batch = await self._green_fetch()
+            if not batch:
+                raise StopAsyncIteration
+            self._batch.extend(batch)
+        return self._batch.popleft()
+
+    def close(self):
+        """Close the cursor and release the connection of a stream
+        not fully consumed.
+
+        When invoked from the main greenlet it returns an awaitable.
+        """
+        if getcurrent().parent:
+            self._close()
+        elif self.pool:
+            return self.pool.submit(self._close)
+        else:
+            return self._green_close()
+
+    def _execute(self, session):
+        conn = session.connection(clause=self.query)
+        result = conn.execution_options(
+            stream_results=True,
+            max_row_buffer=self.batch_size
+        ).execute(self.query)
+        try:
+            while True:
+                rows = result.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            result.close()
+
+    def _fetch(self):
+        if self._rows is None:
+            self._rows = iter(self)
+        return list(islice(self._rows, self.batch_size))
+
+    def _close(self):
+        self._batch.clear()
+        if self._rows is not None:
+            self._rows.close()
+
+    _green_fetch = run_in_greenlet(_fetch)
+    _green_close = run_in_greenlet(_close)
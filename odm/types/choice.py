@@ -1,5 +1,6 @@
 from inspect import isclass
 from enum import Enum
+from collections.abc import Mapping
 
 from sqlalchemy import types
 
@@ -15,6 +16,8 @@ class ScalarCoercible(object):
 
 
 class Choice(object):
+    __slots__ = ('code', 'value')
+
     def __init__(self, code, value):
         self.code = code
         self.value = value
@@ -27,6 +30,9 @@ class Choice(object):
     def __ne__(self, other):
         return not (self == other)
 
+    def __hash__(self):
+        return hash(self.code)
+
     def __str__(self):
         return str(self.value)
 
@@ -38,21 +44,81 @@ class Choice(object):
 
 
 class ChoiceType(types.TypeDecorator, ScalarCoercible):
+    """A column of choices, stored as varchar by default.
+
+    With ``storage='enum'`` codes are stored in a native enum type named
+    ``name``, the lower case name of the enum class by default, created
+    and dropped with the tables using it. Members of an enum class are
+    stored by name.
+
+    With ``storage='smallint'`` codes are stored as small integers,
+    given by the ``codes`` dictionary of codes and integers or numbered
+    from 1 in the order of ``choices``. Integer values of an enum class
+    are stored as they are. New choices must be added last, or given
+    in ``codes``, for stored integers not to change.
+
+    Python values are the same for all storages.
+    """
     impl = types.Unicode(255)
+    storages = ('varchar', 'enum', 'smallint')
 
-    def __init__(self, choices, impl=None, **kwargs):
+    def __init__(self, choices, impl=None, storage=None, name=None,
+                 codes=None, **kwargs):
         self.choices = choices
+        self.storage = storage or 'varchar'
+        self.stored = self.loaded = None
 
         if isinstance(choices, type) and issubclass(choices, Enum):
             self.type_impl = EnumTypeImpl(enum_class=choices, **kwargs)
+            name = name or choices.__name__.lower()
         else:
             self.type_impl = ChoiceTypeImpl(choices=choices, **kwargs)
 
+        if self.storage == 'enum':
+            if not name:
+                raise ImproperlyConfigured(
+                    'ChoiceType with enum storage needs a name.'
+                )
+            labels = self.type_impl.labels()
+            self.store(labels)
+            impl = types.Enum(*[label for _, label in labels], name=name)
+        elif self.storage == 'smallint':
+            self.store(self.type_impl.numbers(codes))
+            impl = types.SmallInteger
+        elif self.storage != 'varchar':
+            raise ImproperlyConfigured(
+                'ChoiceType storage must be one of %s.' %
+                ', '.join(self.storages)
+            )
+
         if impl:
             if isclass(impl):
                 impl = impl()
             self.impl = impl
 
+    def store(self, pairs):
+        """Store codes as the values they are paired with in ``pairs``
+        """
+        pairs = list(pairs)
+        if any((code != stored for code, stored in pairs)):
+            self.stored = dict(pairs)
+            self.loaded = dict(((stored, code) for code, stored in pairs))
+
+    def stored_value(self, code):
+        """The value stored in the database for ``code``
+        """
+        if self.stored is None or code is None:
+            return code
+        try:
+            return self.stored[code]
+        except (KeyError, TypeError):
+            raise ValueError('%r is not a valid choice' % (code,))
+
+    def _set_parent(self, column):
+        # TypeDecorator attaches the impl to the column both here and in
+        # _set_parent_with_dispatch, creating enum constraints twice
+        pass
+
     @property
     def python_type(self):
         return self.impl.python_type
@@ -61,28 +127,55 @@ class ChoiceType(types.TypeDecorator, ScalarCoercible):
         return self.type_impl._coerce(value)
 
     def process_bind_param(self, value, dialect):
-        return self.type_impl.process_bind_param(value, dialect)
+        value = self.type_impl.process_bind_param(value, dialect)
+        if self.stored is not None and value is not None:
+            value = self.stored_value(value)
+        return value
 
     def process_result_value(self, value, dialect):
+        if self.loaded is not None and value is not None:
+            value = self.loaded[value]
         return self.type_impl.process_result_value(value, dialect)
 
 
 class ChoiceTypeImpl(object):
-    """The implementation for the ``Choice`` usage."""
+    """The implementation for the ``Choice`` usage.
+
+    A single :class:`.Choice` is created for each code, and shared by
+    all values with that code.
+    """
 
     def __init__(self, choices):
         if not choices:
             raise ImproperlyConfigured(
                 'ChoiceType needs list of choices defined.'
             )
+        if isinstance(choices, Mapping):
+            choices = choices.items()
+        choices = list(choices)
+        self.codes = [code for code, _ in choices]
         self.choices_dict = dict(choices)
+        self.choices = dict(((code, Choice(code, value))
+                             for code, value in self.choices_dict.items()))
+
+    def labels(self):
+        """Pairs of codes and labels of a native enum
+        """
+        return [(code, str(code)) for code in self.codes]
+
+    def numbers(self, codes=None):
+        """Pairs of codes and small integers
+        """
+        if codes:
+            return [(code, codes[code]) for code in self.codes]
+        return [(code, n) for n, code in enumerate(self.codes, 1)]
 
     def _coerce(self, value):
         if value is None:
             return value
         if isinstance(value, Choice):
             return value
-        return Choice(value, self.choices_dict[value])
+        return self.choices[value]
 
     def process_bind_param(self, value, dialect):
         if value and isinstance(value, Choice):
@@ -91,31 +184,59 @@ class ChoiceTypeImpl(object):
 
     def process_result_value(self, value, dialect):
         if value:
-            return Choice(value, self.choices_dict[value])
+            return self.choices[value]
         return value
 
 
 class EnumTypeImpl(object):
-    """The implementation for the ``Enum`` usage."""
+    """The implementation for the ``Enum`` usage.
+
+    Members are looked up by value, and by case insensitive name when
+    binding by name, in dictionaries built once.
+    """
 
     def __init__(self, enum_class, bind_by_name=True):
         self.enum_class = enum_class
         self.bind_by_name = bind_by_name
+        self.members = dict(((e.value, e) for e in enum_class))
+        self.names = dict(((e.name.lower(), e.value) for e in enum_class))
+
+    def labels(self):
+        """Pairs of values and labels, the names of members, of a native
+        enum
+        """
+        return [(e.value, e.name) for e in self.enum_class]
+
+    def numbers(self, codes=None):
+        """Pairs of values and small integers
+        """
+        values = [e.value for e in self.enum_class]
+        if codes:
+            return [(value, codes[value]) for value in values]
+        if all((isinstance(value, int) for value in values)):
+            return [(value, value) for value in values]
+        return [(value, n) for n, value in enumerate(values, 1)]
 
     def _coerce(self, value):
-        return self.enum_class(value) if value else None
+        return self.member(value) if value else None
+
+    def member(self, value):
+        """The member of the enum with ``value``
+        """
+        try:
+            return self.members[value]
+        except (KeyError, TypeError):
+            return self.enum_class(value)
 
     def process_bind_param(self, value, dialect):
         ret = None
         if isinstance(value, Enum):
             ret = value.value
         elif self.bind_by_name and isinstance(value, str):
-            for e in self.enum_class:
-                if e.name.lower() == value.lower():
-                    ret = e.value
+            ret = self.names.get(value.lower())
         elif value:
-            ret = self.enum_class(value).value
+            ret = self.member(value).value
         return ret
 
     def process_result_value(self, value, dialect):
-        return self.enum_class(value) if value else None
+        return self.member(value) if value else None
@@ -1,8 +1,220 @@
 """JSONType definition."""
 import json
+from collections import OrderedDict
 
 import sqlalchemy as sa
-from sqlalchemy.dialects.postgresql import JSON, JSONB
+from sqlalchemy.dialects.postgresql import JSON, JSONB, ARRAY
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import Function
+
+from pulsar.api import ImproperlyConfigured
+
+
+class JSONCodec:
+    """A JSON encoder, ``dumps``, and decoder, ``loads``
+    """
+    __slots__ = ('name', 'dumps', 'loads')
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return 'JSONCodec(%s)' % self.name
+
+
+def _orjson():
+    import orjson
+
+    def dumps(value):
+        # orjson encodes to bytes and fails on keys other than strings
+        try:
+            return orjson.dumps(value).decode('utf-8')
+        except TypeError:
+            return json.dumps(value)
+
+    return JSONCodec('orjson', dumps, orjson.loads)
+
+
+def _ujson():
+    import ujson
+    return JSONCodec('ujson', ujson.dumps, ujson.loads)
+
+
+def _json():
+    return JSONCodec('json', json.dumps, json.loads)
+
+
+# Codecs by name, fastest first
+CODECS = OrderedDict((('orjson', _orjson),
+                      ('ujson', _ujson),
+                      ('json', _json)))
+
+_codecs = {}
+
+
+def json_codec(codec=None):
+    """The :class:`.JSONCodec` named ``codec``, the standard library json
+    module by default, or the fastest installed among orjson, ujson and
+    the standard library when ``codec`` is ``fastest``.
+
+    Fast codecs are opt-in since their output differs from the standard
+    library: orjson encodes NaN and infinity as ``null`` and accepts
+    datetime and UUID values, for example.
+
+    ``codec`` can also be any object with ``dumps`` and ``loads``
+    functions, such as a module, returned as it is.
+    """
+    if hasattr(codec, 'loads'):
+        return codec
+    fastest = codec == 'fastest'
+    names = list(CODECS) if fastest else [codec or 'json']
+    for name in names:
+        if name not in _codecs:
+            if name not in CODECS:
+                raise ImproperlyConfigured('Unknown JSON codec "%s"' % name)
+            try:
+                _codecs[name] = CODECS[name]()
+            except ImportError:
+                if not fastest:
+                    raise ImproperlyConfigured(
+                        'JSON codec "%s" is not installed' % name)
+                continue
+        return _codecs[name]
+
+
+class LazyJSON:
+    """A JSON document decoded with ``loads`` on first access.
+
+    Items, iteration and attributes, such as ``get`` or ``keys``, are those
+    of the decoded :attr:`value`; :attr:`raw` is the encoded text.
+    """
+    __slots__ = ('raw', '_loads', '_value')
+
+    def __init__(self, raw, loads):
+        self.raw = raw
+        self._loads = loads
+        self._value = None
+
+    @property
+    def value(self):
+        if self._loads is not None:
+            self._value = self._loads(self.raw)
+            self._loads = None
+        return self._value
+
+    @property
+    def decoded(self):
+        return self._loads is None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.value, name)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __contains__(self, key):
+        return key in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyJSON):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        if self.decoded:
+            return repr(self.value)
+        return 'LazyJSON(%s)' % self.raw
+
+
+class LazyText(sa.types.TypeDecorator):
+    """Text of a json column, loaded as :class:`.LazyJSON`
+    """
+    impl = sa.UnicodeText
+
+    def __init__(self, codec):
+        self.codec = codec
+        super().__init__()
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            return LazyJSON(value, self.codec.loads)
+
+
+class JSONPath(Function):
+    """The value at ``path``, a sequence of keys and array indexes, of the
+    json ``column``, as json or, when ``astext`` is true, as text.
+
+    On PostgreSQL it compiles to the ``->``, ``#>``, ``->>`` and ``#>>``
+    operators, on other databases to ``json_extract``, as on sqlite.
+    Keys with double quotes or backslashes are supported on PostgreSQL
+    only.
+    """
+    def __init__(self, column, path, astext=False):
+        if not path:
+            raise ValueError('JSONPath needs at least one key')
+        self.path = tuple(path)
+        self.astext = astext
+        if astext:
+            type_ = sa.UnicodeText()
+        else:
+            type_ = JSONType(binary=getattr(column.type, 'binary', True),
+                             codec=getattr(column.type, 'codec', None))
+        super().__init__('json_path', column, type_=type_)
+
+    @property
+    def column(self):
+        return self.clauses.clauses[0]
+
+
+@compiles(JSONPath)
+def _json_path(element, compiler, **kw):
+    path = '$' + ''.join(
+        '[%d]' % key if isinstance(key, int) else '."%s"' % _path_key(key)
+        for key in element.path)
+    sql = 'json_extract(%s, %s)' % (compiler.process(element.column, **kw),
+                                    compiler.process(sa.literal(path), **kw))
+    return sql if element.astext else 'json_quote(%s)' % sql
+
+
+def _path_key(key):
+    # sqlite ends a quoted key at the first double quote and compares it
+    # with the key as escaped in the json text, there is no escaping
+    # matching all documents
+    if '"' in key or '\\' in key:
+        raise ValueError('JSON path key %r with a double quote or a '
+                         'backslash is not supported' % key)
+    return key
+
+
+@compiles(JSONPath, 'postgresql')
+def _pg_json_path(element, compiler, **kw):
+    if len(element.path) == 1:
+        operator = '->>' if element.astext else '->'
+        path = sa.literal(element.path[0])
+    else:
+        operator = '#>>' if element.astext else '#>'
+        path = sa.cast(sa.literal([str(key) for key in element.path]),
+                       ARRAY(sa.UnicodeText))
+    return '(%s %s %s)' % (compiler.process(element.column, **kw), operator,
+                           compiler.process(path, **kw))
 
 
 class JSONType(sa.types.TypeDecorator):
@@ -31,12 +243,37 @@ class JSONType(sa.types.TypeDecorator):
             'max-speed': '400 mph'
         }
         session.commit()
+
+    Values are encoded and decoded with ``codec``, see :func:`.json_codec`.
+    On PostgreSQL they are encoded and decoded by the dialect instead,
+    using the ``json_serializer`` and ``json_deserializer`` engine options
+    or, with the green dialect, its ``json_codec``.
+
+    Parts of documents are selected with ``path``, which compiles to json
+    operators and only fetches and decodes the selected value::
+
+        session.query(Product.id, Product.details.path('color', astext=True))
+
+    When ``lazy`` is true, the column is selected as text and loaded as a
+    :class:`.LazyJSON`, decoded by ``codec`` on first access.
     """
     impl = sa.UnicodeText
 
-    def __init__(self, binary=True, impl=sa.UnicodeText, *args, **kwargs):
+    class Comparator(sa.types.TypeDecorator.Comparator):
+
+        def path(self, *keys, astext=False):
+            """The value at the path of ``keys`` of documents
+            """
+            return JSONPath(self.expr, keys, astext)
+
+    comparator_factory = Comparator
+
+    def __init__(self, binary=True, impl=sa.UnicodeText, codec=None,
+                 lazy=False, *args, **kwargs):
         self.binary = binary
         self.impl = impl
+        self.codec = json_codec(codec)
+        self.lazy = lazy
         super().__init__(*args, **kwargs)
 
     def load_dialect_impl(self, dialect):
@@ -49,11 +286,20 @@ class JSONType(sa.types.TypeDecorator):
         else:
             return dialect.type_descriptor(self.impl)
 
+    def column_expression(self, colexpr):
+        if self.lazy:
+            return sa.cast(colexpr, LazyText(self.codec))
+        return colexpr
+
     def process_bind_param(self, value, dialect):
+        if isinstance(value, LazyJSON):
+            if not value.decoded and dialect.name != 'postgresql':
+                return value.raw
+            value = value.value
         if dialect.name == 'postgresql':
             return value
         elif value is not None:
-            return json.dumps(value)
+            return self.codec.dumps(value)
         else:
             return value
 
@@ -61,6 +307,6 @@ class JSONType(sa.types.TypeDecorator):
         if dialect.name == 'postgresql':
             return value
         elif value is not None:
-            return json.loads(value)
+            return self.codec.loads(value)
         else:
             return value
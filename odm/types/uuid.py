@@ -1,4 +1,8 @@
+import os
+import time
 import uuid
+from threading import Lock
+from weakref import WeakSet
 
 from sqlalchemy import types
 from sqlalchemy.dialects import postgresql
@@ -6,11 +10,97 @@ from sqlalchemy.dialects import postgresql
 from .choice import ScalarCoercible
 
 
+class UUID7:
+    """Generate time ordered UUIDs, version 7 of RFC 9562.
+
+    The 48 most significant bits are the unix time in milliseconds,
+    followed by a 12 bits counter, starting at a random value each
+    millisecond, and 62 random bits, read from ``os.urandom`` for ``batch``
+    UUIDs at a time. UUIDs of a generator are strictly increasing, so
+    that rows inserted with them as primary keys are appended to the
+    index rather than scattered across it.
+
+    The random bits and the counter are reset in forked processes, see
+    :func:`reset_generators`, so that they differ from the parent ones.
+    """
+    __slots__ = ('batch', '_random', '_offset', '_ms', '_counter', '_lock',
+                 '__weakref__')
+
+    def __init__(self, batch=256):
+        self.batch = batch
+        self.reset()
+        _generators.add(self)
+
+    def reset(self):
+        """Discard random bits and start a new counter
+        """
+        self._random = b''
+        self._offset = 0
+        self._ms = 0
+        self._counter = 0
+        self._lock = Lock()
+
+    def __call__(self):
+        with self._lock:
+            ms = int(time.time() * 1000)
+            random = self._random_bits()
+            if ms > self._ms:
+                self._ms = ms
+                # leave room for the counter to grow within the millisecond
+                self._counter = self._random_bits() >> 53
+            else:
+                self._counter += 1
+                if self._counter > 0xfff:
+                    self._ms += 1
+                    self._counter = 0
+            return uuid.UUID(int=(self._ms << 80 | 0x7000 << 64 |
+                                  self._counter << 64 | 0x2 << 62 |
+                                  random & 0x3fffffffffffffff))
+
+    def _random_bits(self):
+        if self._offset >= len(self._random):
+            self._random = os.urandom(8*self.batch)
+            self._offset = 0
+        offset = self._offset
+        self._offset += 8
+        return int.from_bytes(self._random[offset:offset+8], 'big')
+
+
+_generators = WeakSet()
+
+
+def reset_generators():
+    """Reset all :class:`.UUID7` generators in a forked process.
+
+    It is called in the child process after ``os.fork`` on python 3.7 and
+    above, and by :meth:`.Mapper.after_fork`.
+    """
+    for generator in list(_generators):
+        generator.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_generators)
+
+
+uuid7 = UUID7()
+
+
 class UUIDType(types.TypeDecorator, ScalarCoercible):
     """
     Stores a UUID in the database natively when it can and falls back to
     a BINARY(16) or a CHAR(32) when it can't.
 
+    On postgresql dialects with native UUIDs, such as psycopg2 and the
+    green dialect, :class:`uuid.UUID` values are bound and loaded as they
+    are, through the UUID adapter and typecaster of psycopg2, without
+    converting them to and from strings.
+
+    Time ordered UUIDs are generated by :func:`uuid7`, a :class:`.UUID7`
+    generator, which can be the default of primary keys::
+
+        id = sa.Column(UUIDType, primary_key=True, default=uuid7)
+
     ::
 
         from odm.types import UUIDType
@@ -35,8 +125,10 @@ class UUIDType(types.TypeDecorator, ScalarCoercible):
 
     def load_dialect_impl(self, dialect):
         if dialect.name == 'postgresql' and self.native:
-            # Use the native UUID type.
-            return dialect.type_descriptor(postgresql.UUID())
+            # Use the native UUID type, with UUID values when the dialect
+            # adapts them
+            return dialect.type_descriptor(postgresql.UUID(
+                as_uuid=getattr(dialect, 'use_native_uuid', False)))
 
         else:
             # Fallback to either a BINARY or a CHAR.
@@ -46,12 +138,11 @@ class UUIDType(types.TypeDecorator, ScalarCoercible):
     @staticmethod
     def _coerce(value):
         if value and not isinstance(value, uuid.UUID):
-            try:
+            if isinstance(value, (bytes, bytearray)):
+                value = uuid.UUID(bytes=bytes(value))
+            else:
                 value = uuid.UUID(value)
 
-            except (TypeError, ValueError):
-                value = uuid.UUID(bytes=value)
-
         return value
 
     def process_bind_param(self, value, dialect):
@@ -62,6 +153,8 @@ class UUIDType(types.TypeDecorator, ScalarCoercible):
             value = self._coerce(value)
 
         if self.native and dialect.name == 'postgresql':
+            if getattr(dialect, 'use_native_uuid', False):
+                return value
             return str(value)
 
         return value.bytes if self.binary else value.hex
@@ -70,6 +163,9 @@ class UUIDType(types.TypeDecorator, ScalarCoercible):
         if value is None:
             return value
 
+        if isinstance(value, uuid.UUID):
+            return value
+
         if self.native and dialect.name == 'postgresql':
             return uuid.UUID(value)
 
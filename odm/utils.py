@@ -37,6 +37,12 @@ def get_columns(mixed):
     return sa.inspect(mixed).columns
 
 
+def as_bool(value):
+    """Convert a string, from a url query for example, into a boolean
+    """
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
 def database_operation(engine, oper, *args):
     operation = _database_operation(engine, oper)
     return operation(engine, *args)
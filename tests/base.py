@@ -233,6 +233,65 @@ class MapperMixin:
             self.assertTrue(tasks)
             self.assertEqual(user.sex, 'male')
 
+    def test_get_many(self):
+        mapper = self.mapper
+
+        with mapper.begin() as session:
+            users = [mapper.employee(name='user%d' % n) for n in range(3)]
+            session.add_all(users)
+
+        ids = [user.id for user in users]
+        with mapper.begin() as session:
+            users = session.get_many(mapper.employee,
+                                     [ids[2], -1, ids[0], ids[2]])
+            self.assertEqual(users[0].id, ids[2])
+            self.assertEqual(users[1], None)
+            self.assertEqual(users[2].id, ids[0])
+            self.assertEqual(users[3], users[0])
+            users = session.get_many(mapper.employee, ids, chunk_size=2)
+            self.assertEqual([user.id for user in users], ids)
+
+    def test_bulk_update(self):
+        mapper = self.mapper
+
+        with mapper.begin() as session:
+            tasks = [mapper.task(id=uuid4(), subject='bulk %d' % n)
+                     for n in range(3)]
+            session.add_all(tasks)
+
+        rows = [dict(id=task.id, done=True, info=dict(n=n))
+                for n, task in enumerate(tasks[:2])]
+        self.assertEqual(mapper.bulk_update(mapper.task, rows), 2)
+
+        with mapper.begin() as session:
+            tasks = session.get_many(mapper.task, [t.id for t in tasks])
+        self.assertEqual([task.done for task in tasks], [True, True, False])
+        self.assertEqual(tasks[1].info, dict(n=1))
+
+    def test_bulk_load(self):
+        mapper = self.mapper
+        rows = [dict(id=uuid4(), subject='load %d' % n) for n in range(5)]
+        self.assertEqual(mapper.bulk_load(mapper.task, rows, chunk_size=2),
+                         5)
+        with mapper.begin() as session:
+            tasks = session.get_many(mapper.task, [r['id'] for r in rows])
+        self.assertEqual([task.subject for task in tasks],
+                         [row['subject'] for row in rows])
+
+    def test_stream(self):
+        mapper = self.mapper
+
+        with mapper.begin() as session:
+            session.add_all([mapper.employee(name='stream%d' % n)
+                             for n in range(5)])
+
+        with mapper.begin() as session:
+            query = session.query(mapper.employee).filter(
+                mapper.employee.name.startswith('stream')
+            ).order_by(mapper.employee.id)
+        names = [user.name for user in mapper.stream(query, batch_size=2)]
+        self.assertEqual(names, ['stream%d' % n for n in range(5)])
+
     def test_view(self):
         mapper = self.mapper
 
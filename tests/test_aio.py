@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from sqlalchemy import Column, Integer, String, select, func
+
+from pulsar.apps.greenio import GreenPool, getcurrent, wait
+
+from odm import mapper
+from odm.aio import AsyncMapper, GreenContext
+from odm.cache import ModelCache
+
+
+Model = mapper.model_base('testaio')
+
+
+class Item(Model):
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100))
+
+
+class TestAsyncMapper(unittest.TestCase):
+
+    def amapper(self):
+        mp = mapper.Mapper('sqlite:///')
+        mp.register(Item)
+        mp.table_create()
+        return AsyncMapper(mp)
+
+    async def test_begin(self):
+        amp = self.amapper()
+        async with amp.begin() as session:
+            session.add(amp.item(name='foo'))
+        async with amp.begin() as session:
+            item = await session.get(amp.item, 1)
+            self.assertEqual(item.name, 'foo')
+            item.name = 'bar'
+        async with amp.begin() as session:
+            count = await session.scalar(select([func.count(amp.item.id)]))
+            self.assertEqual(count, 1)
+            result = await session.execute(amp.item.__table__.select())
+            self.assertEqual(result.fetchall(), [(1, 'bar')])
+
+    async def test_get_cache(self):
+        mp = mapper.Mapper('sqlite:///', cache=ModelCache())
+        mp.register(Item)
+        mp.table_create()
+        amp = AsyncMapper(mp)
+        amp.item.__cache__ = True
+        async with amp.begin() as session:
+            session.add(amp.item(name='foo'))
+        for _ in range(2):
+            async with amp.begin() as session:
+                item = await session.get(amp.item, 1)
+                self.assertEqual(item.name, 'foo')
+        self.assertEqual(mp.cache.stats()['item'],
+                         dict(hits=1, misses=1, evictions=0))
+
+    async def test_rollback(self):
+        amp = self.amapper()
+        with self.assertRaises(ValueError):
+            async with amp.begin() as session:
+                session.add(amp.item(name='foo'))
+                await session.flush()
+                raise ValueError
+        async with amp.begin() as session:
+            self.assertEqual(await session.get(amp.item, 1), None)
+
+    async def test_one_greenlet_per_transaction(self):
+        amp = self.amapper()
+
+        def current(session):
+            wait(asyncio.sleep(0.01), True)
+            return getcurrent()
+
+        async with amp.begin() as session:
+            green1 = await session.run(current)
+            green2 = await session.run(current)
+        self.assertEqual(green1, green2)
+        self.assertTrue(green1.dead)
+
+    async def test_child_greenlet(self):
+        amp = self.amapper()
+
+        def get():
+            session = amp.begin()
+            try:
+                return session.get(amp.item, 1)
+            finally:
+                session.close()
+
+        self.assertEqual(await GreenPool().submit(get), None)
+        self.assertEqual(await amp.run(amp.table_create), None)
+
+    async def test_context_error(self):
+        context = GreenContext()
+
+        def fail():
+            wait(asyncio.sleep(0), True)
+            raise RuntimeError('fail')
+
+        with self.assertRaises(RuntimeError):
+            await context(fail)
+        self.assertEqual(await context(lambda: 5), 5)
+        context.close()
@@ -0,0 +1,93 @@
+import asyncio
+import socket
+import unittest
+
+from pulsar.apps.greenio import GreenPool, run_in_greenlet, wait
+
+from odm.dialects.postgresql import green
+
+
+class FakeConnection:
+    """Mimic an asynchronous psycopg2 connection which needs ``polls``
+    read events on its socket before being ready
+    """
+    def __init__(self, polls):
+        self.polls = polls
+        self.sock, self.server = socket.socketpair()
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def poll(self):
+        try:
+            self.sock.recv(1)
+        except BlockingIOError:
+            pass
+        if not self.polls:
+            return green.extensions.POLL_OK
+        self.polls -= 1
+        self.server.send(b'x')
+        return green.extensions.POLL_READ
+
+    def close(self):
+        self.sock.close()
+        self.server.close()
+
+
+def query(conn, polls):
+    conn.polls = polls
+    green.psycopg2_wait_callback(conn)
+    return conn.polls
+
+
+class TestWaitCallback(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.green_pool = GreenPool()
+
+    async def test_green_pool(self):
+        conn = FakeConnection(0)
+        self.assertEqual(await self.green_pool.submit(query, conn, 5), 0)
+        waiter = green._get_waiter(conn)
+        self.assertTrue(waiter.direct)
+        self.assertEqual(waiter.future, None)
+        self.assertEqual(waiter.green, None)
+        conn.close()
+
+    async def test_run_in_greenlet(self):
+        conn = FakeConnection(0)
+        self.assertEqual(await run_in_greenlet(query)(conn, 5), 0)
+        self.assertFalse(green._get_waiter(conn).direct)
+        conn.close()
+
+    async def test_wait_other(self):
+        conns = [FakeConnection(0) for _ in range(3)]
+
+        def queries(conn):
+            query(conn, 3)
+            result = wait(asyncio.sleep(0.01, 'slept'))
+            query(conn, 3)
+            return result
+
+        result = await asyncio.gather(
+            *[self.green_pool.submit(queries, conn) for conn in conns]
+        )
+        self.assertEqual(result, ['slept'] * 3)
+        for conn in conns:
+            conn.close()
+
+    async def test_concurrent(self):
+        conns = [FakeConnection(0) for _ in range(10)]
+        results = await asyncio.gather(
+            *[self.green_pool.submit(query, conn, 4) for conn in conns]
+        )
+        self.assertEqual(results, [0]*10)
+        for conn in conns:
+            conn.close()
+
+    def test_main_greenlet(self):
+        conn = FakeConnection(1)
+        self.assertRaises(AssertionError, green.psycopg2_wait_callback, conn)
+        conn.close()
@@ -0,0 +1,344 @@
+import os
+import json
+import unittest
+from enum import Enum
+from unittest import mock
+from uuid import UUID, uuid4, RFC_4122
+
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, select
+from sqlalchemy.dialects import postgresql
+
+from pulsar.api import ImproperlyConfigured
+
+from odm.types import ChoiceType, JSONType, UUIDType
+from odm.types.choice import Choice
+from odm.types.json import json_codec, LazyJSON
+from odm import mapper
+from odm.types.uuid import UUID7
+from odm.dialects.postgresql import PGDGreen
+from odm.migrate import schema_diff, choice_statements, enum_changes
+
+
+class Color(Enum):
+    red = 1
+    green = 2
+
+
+class TestChoiceType(unittest.TestCase):
+
+    def test_choices(self):
+        type_ = ChoiceType({'f': 'female', 'm': 'male'})
+        female = type_.process_result_value('f', None)
+        self.assertEqual(female, Choice('f', 'female'))
+        self.assertEqual(female, 'f')
+        self.assertTrue(type_.process_result_value('f', None) is female)
+        self.assertTrue(type_._coerce('f') is female)
+        self.assertEqual(type_.process_result_value(None, None), None)
+        self.assertEqual(type_.process_bind_param(female, None), 'f')
+        self.assertEqual(set([female, Choice('f', 'female')]), set(['f']))
+        with self.assertRaises(AttributeError):
+            female.label = 'F'
+
+    def test_enum(self):
+        type_ = ChoiceType(Color, impl=Integer)
+        self.assertEqual(type_.process_bind_param(Color.red, None), 1)
+        self.assertEqual(type_.process_bind_param('GREEN', None), 2)
+        self.assertEqual(type_.process_bind_param('blue', None), None)
+        self.assertEqual(type_.process_bind_param(2, None), 2)
+        self.assertRaises(ValueError, type_.process_bind_param, 3, None)
+        self.assertEqual(type_.process_result_value(1, None), Color.red)
+        self.assertEqual(type_.process_result_value(None, None), None)
+        self.assertEqual(type_._coerce(2), Color.green)
+        type_ = ChoiceType(Color, impl=Integer, bind_by_name=False)
+        self.assertRaises(ValueError, type_.process_bind_param, 'red', None)
+
+    def test_enum_storage(self):
+        self.assertRaises(ImproperlyConfigured, ChoiceType,
+                          {'f': 'female'}, storage='enum')
+        self.assertRaises(ImproperlyConfigured, ChoiceType,
+                          {'f': 'female'}, storage='char')
+        type_ = ChoiceType(Color, storage='enum')
+        self.assertEqual(type_.impl.name, 'color')
+        self.assertEqual(type_.impl.enums, ['red', 'green'])
+        self.assertEqual(type_.process_bind_param(Color.green, None),
+                         'green')
+        self.assertEqual(type_.process_bind_param('RED', None), 'red')
+        self.assertEqual(type_.process_result_value('green', None),
+                         Color.green)
+        type_ = ChoiceType([('f', 'female'), ('m', 'male')],
+                           storage='enum', name='gender')
+        self.assertEqual(type_.stored, None)
+        self.assertEqual(type_.process_bind_param('m', None), 'm')
+
+    def test_smallint_storage(self):
+        type_ = ChoiceType([('f', 'female'), ('m', 'male')],
+                           storage='smallint')
+        female = type_.process_result_value(1, None)
+        self.assertEqual(female, Choice('f', 'female'))
+        self.assertEqual(type_.process_bind_param(female, None), 1)
+        self.assertEqual(type_.process_bind_param('m', None), 2)
+        self.assertRaises(ValueError, type_.process_bind_param, 'x', None)
+        type_ = ChoiceType({'f': 'female', 'm': 'male'}, storage='smallint',
+                           codes={'f': 5, 'm': 7})
+        self.assertEqual(type_.process_bind_param('m', None), 7)
+        type_ = ChoiceType(Color, storage='smallint')
+        self.assertEqual(type_.stored, None)
+        self.assertEqual(type_.process_bind_param('green', None), 2)
+
+    def test_storage_table(self):
+        metadata = MetaData()
+        table = Table(
+            'clothes', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('color', ChoiceType(Color, storage='enum')),
+            Column('size', ChoiceType([('s', 'small'), ('l', 'large')],
+                                      storage='smallint')))
+        engine = create_engine('sqlite:///')
+        metadata.create_all(engine)
+        engine.execute(table.insert(), id=1, color=Color.green, size='l')
+        self.assertEqual(list(engine.execute('SELECT * FROM clothes')),
+                         [(1, 'green', 2)])
+        row = engine.execute(select([table])).first()
+        self.assertEqual(row.color, Color.green)
+        self.assertEqual(row.size, Choice('l', 'large'))
+        metadata.drop_all(engine)
+
+    def test_convert_choices(self):
+        metadata = MetaData()
+        table = Table(
+            'clothes', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('color', ChoiceType(Color, storage='enum')),
+            Column('size', ChoiceType([('s', 'small'), ('l', 'large')],
+                                      storage='smallint')))
+        engine = create_engine('sqlite:///')
+        engine.execute('CREATE TABLE clothes (id INTEGER PRIMARY KEY, '
+                       'color VARCHAR(255), size VARCHAR(255))')
+        migration = schema_diff(engine, [table], convert_choices=True)
+        self.assertEqual(
+            [(change.kind, change.name, change.applicable)
+             for change in migration],
+            [('convert_choice', 'color', False),
+             ('convert_choice', 'size', False),
+             ('add_check', 'color', False)])
+        dialect = postgresql.dialect()
+        self.assertEqual(
+            choice_statements(table.c.color, dialect),
+            ["ALTER TABLE clothes ALTER COLUMN color TYPE color USING "
+             "(CASE color WHEN '1' THEN 'red' WHEN '2' THEN 'green' "
+             "ELSE color END)::color"])
+        self.assertEqual(
+            choice_statements(table.c.size, dialect),
+            ["ALTER TABLE clothes ALTER COLUMN size TYPE SMALLINT USING "
+             "(CASE size WHEN 'l' THEN '2' WHEN 's' THEN '1' "
+             "ELSE size END)::SMALLINT"])
+        changes = enum_changes(table, list(migration), dialect, set())
+        self.assertEqual(changes, [])
+        for change in migration:
+            change.statements = choice_statements(table.c[change.name],
+                                                  dialect)
+        changes = enum_changes(table, list(migration), dialect, set())
+        self.assertEqual([change.kind for change in changes],
+                         ['create_enum'])
+        self.assertEqual(changes[0].statements,
+                         ["CREATE TYPE color AS ENUM ('red', 'green')"])
+
+
+class Codec:
+    dumps = staticmethod(lambda value: 'x' + json.dumps(value))
+    loads = staticmethod(lambda value: json.loads(value[1:]))
+
+
+class TestJSONType(unittest.TestCase):
+
+    def test_json_codec(self):
+        self.assertEqual(json_codec().name, 'json')
+        self.assertTrue(json_codec() is json_codec('json'))
+        self.assertEqual(JSONType().codec.name, 'json')
+        self.assertEqual(PGDGreen().json_codec.name, 'json')
+        codec = json_codec('fastest')
+        self.assertTrue(codec.name in ('orjson', 'ujson', 'json'))
+        self.assertEqual(json_codec('json').name, 'json')
+        self.assertEqual(json_codec('json').loads('{"a": [1]}'),
+                         {'a': [1]})
+        self.assertTrue(json_codec(json) is json)
+        self.assertRaises(ImproperlyConfigured, json_codec, 'yaml')
+        codec = json_codec(codec.name)
+        self.assertEqual(codec.loads(codec.dumps({'a': 1})), {'a': 1})
+        # the default codec keeps the standard library output
+        self.assertEqual(json_codec().dumps({'a': float('nan')}),
+                         '{"a": NaN}')
+        self.assertRaises(TypeError, json_codec().dumps, {'a': Codec})
+
+    def test_codec(self):
+        metadata = MetaData()
+        table = Table('events', metadata,
+                      Column('id', Integer, primary_key=True),
+                      Column('payload', JSONType(codec=Codec)))
+        engine = create_engine('sqlite:///')
+        metadata.create_all(engine)
+        engine.execute(table.insert(), id=1, payload={'a': [1, 2]})
+        self.assertEqual(engine.execute('SELECT payload FROM events').scalar(),
+                         'x{"a": [1, 2]}')
+        self.assertEqual(engine.execute(select([table.c.payload])).scalar(),
+                         {'a': [1, 2]})
+
+    def test_green_dialect(self):
+        dialect = PGDGreen(json_codec='json')
+        self.assertEqual(dialect.json_codec.name, 'json')
+        self.assertTrue(dialect._json_deserializer is
+                        dialect.json_codec.loads)
+        dialect = PGDGreen(json_deserializer=Codec.loads)
+        self.assertTrue(dialect._json_deserializer is Codec.loads)
+        self.assertTrue(dialect._json_serializer is dialect.json_codec.dumps)
+
+    def events(self):
+        metadata = MetaData()
+        table = Table('events', metadata,
+                      Column('id', Integer, primary_key=True),
+                      Column('payload', JSONType),
+                      Column('lazy', JSONType(lazy=True)))
+        engine = create_engine('sqlite:///')
+        metadata.create_all(engine)
+        payload = {'user': {'name': 'luca', 'tags': ['a', 'b']}}
+        engine.execute(table.insert(), id=1, payload=payload, lazy=payload)
+        return engine, table
+
+    def test_path(self):
+        engine, table = self.events()
+        payload = table.c.payload
+        columns = [payload.path('user'),
+                   payload.path('user', 'name', astext=True),
+                   payload.path('user', 'tags', 1),
+                   payload.path('missing')]
+        self.assertEqual(list(engine.execute(select(columns)).first()),
+                         [{'name': 'luca', 'tags': ['a', 'b']}, 'luca', 'b',
+                          None])
+        query = select([table.c.id]).where(
+            payload.path('user', 'name', astext=True) == 'luca')
+        self.assertEqual(engine.execute(query).scalar(), 1)
+        dialect = postgresql.dialect()
+        self.assertEqual(
+            [str(column.compile(dialect=dialect)) for column in columns],
+            ['(events.payload -> %(param_1)s)',
+             '(events.payload #>> CAST(%(param_1)s AS TEXT[]))',
+             '(events.payload #> CAST(%(param_1)s AS TEXT[]))',
+             '(events.payload -> %(param_1)s)'])
+        self.assertRaises(ValueError, payload.path)
+        key = 'a "quoted" key'
+        self.assertEqual(str(payload.path(key).compile(dialect=dialect)),
+                         '(events.payload -> %(param_1)s)')
+        self.assertRaises(ValueError, engine.execute,
+                          select([payload.path(key)]))
+        self.assertRaises(ValueError, engine.execute,
+                          select([payload.path('user', 'a\\b')]))
+        engine.execute(table.update(), payload={'a.b': 1})
+        self.assertEqual(engine.execute(
+            select([payload.path('a.b', astext=True)])).scalar(), 1)
+
+    def test_lazy(self):
+        engine, table = self.events()
+        lazy = engine.execute(select([table.c.lazy])).scalar()
+        self.assertTrue(isinstance(lazy, LazyJSON))
+        self.assertFalse(lazy.decoded)
+        self.assertEqual(lazy.raw,
+                         '{"user": {"name": "luca", "tags": ["a", "b"]}}')
+        self.assertEqual(lazy['user']['name'], 'luca')
+        self.assertTrue(lazy.decoded)
+        self.assertEqual(list(lazy.keys()), ['user'])
+        self.assertEqual(lazy, engine.execute(
+            select([table.c.payload])).scalar())
+        self.assertEqual(
+            str(select([table.c.lazy]).compile(dialect=postgresql.dialect())),
+            'SELECT CAST(events.lazy AS TEXT) AS lazy \nFROM events')
+        lazy = engine.execute(select([table.c.lazy])).scalar()
+        engine.execute(table.insert(), id=2, payload=lazy, lazy=lazy)
+        self.assertFalse(lazy.decoded)
+        self.assertEqual(
+            engine.execute(select([table.c.payload]).where(
+                table.c.id == 2)).scalar(),
+            {'user': {'name': 'luca', 'tags': ['a', 'b']}})
+
+
+class TestUUIDType(unittest.TestCase):
+
+    def test_coerce(self):
+        value = uuid4()
+        self.assertEqual(UUIDType._coerce(str(value)), value)
+        self.assertEqual(UUIDType._coerce(value.hex), value)
+        self.assertEqual(UUIDType._coerce(value.bytes), value)
+        self.assertEqual(UUIDType._coerce(bytearray(value.bytes)), value)
+        self.assertTrue(UUIDType._coerce(value) is value)
+        self.assertEqual(UUIDType._coerce(None), None)
+        self.assertRaises(ValueError, UUIDType._coerce, 'foo')
+
+    def test_postgresql(self):
+        value = uuid4()
+        type_ = UUIDType()
+        dialect = PGDGreen()
+        self.assertTrue(type_.dialect_impl(dialect).impl.as_uuid)
+        bind = type_.dialect_impl(dialect).bind_processor(dialect)
+        result = type_.dialect_impl(dialect).result_processor(dialect, None)
+        self.assertTrue(bind(value) is value)
+        self.assertEqual(bind(str(value)), value)
+        self.assertTrue(result(value) is value)
+        self.assertEqual(result(None), None)
+        dialect = postgresql.dialect(use_native_uuid=False)
+        self.assertFalse(type_.dialect_impl(dialect).impl.as_uuid)
+        bind = type_.dialect_impl(dialect).bind_processor(dialect)
+        result = type_.dialect_impl(dialect).result_processor(dialect, None)
+        self.assertEqual(bind(value), str(value))
+        self.assertEqual(result(str(value)), value)
+
+    def test_sqlite(self):
+        metadata = MetaData()
+        table = Table('items', metadata,
+                      Column('id', UUIDType, primary_key=True),
+                      Column('ref', UUIDType(binary=False)))
+        engine = create_engine('sqlite:///')
+        metadata.create_all(engine)
+        value = uuid4()
+        engine.execute(table.insert(), id=value, ref=str(value))
+        self.assertEqual(list(engine.execute(select([table])).first()),
+                         [value, value])
+        self.assertEqual(engine.execute('SELECT ref FROM items').scalar(),
+                         value.hex)
+
+    def test_uuid7(self):
+        generate = UUID7(batch=4)
+        values = [generate() for _ in range(100)]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(set(values)), 100)
+        self.assertEqual(values[0].version, 7)
+        self.assertEqual(values[0].variant, RFC_4122)
+        generate = UUID7()
+        with mock.patch('odm.types.uuid.time.time', return_value=1.5):
+            first = generate()
+            self.assertEqual(first.int >> 80, 1500)
+            generate._counter = 0xfff
+            second = generate()
+        self.assertEqual(second.int >> 80, 1501)
+        self.assertTrue(first < second < generate())
+        self.assertTrue(isinstance(UUID(str(first)), UUID))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_uuid7_fork(self):
+        generate = UUID7()
+        generate()
+        read, write = os.pipe()
+        pid = os.fork()
+        if not pid:
+            try:
+                if not hasattr(os, 'register_at_fork'):
+                    mapper.Mapper('sqlite:///').after_fork()
+                os.write(write, generate().bytes)
+            finally:
+                os._exit(0)
+        os.close(write)
+        child = UUID(bytes=os.read(read, 16))
+        os.close(read)
+        os.waitpid(pid, 0)
+        parent = generate()
+        # the 62 random bits
+        mask = (1 << 62) - 1
+        self.assertNotEqual(child.int & mask, parent.int & mask)
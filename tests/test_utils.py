@@ -1,11 +1,30 @@
+import os
 import unittest
+import asyncio
+import threading
+from unittest import mock
+from uuid import UUID
 from inspect import isclass, getmodule
 
-from sqlalchemy import Column, Integer, String, Table
+from sqlalchemy import (Column, Integer, String, Table, ForeignKey,
+                        MetaData, create_engine, func)
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import QueuePool
 
 from odm import mapper
+from odm.bulk import CopyData, insert_columns, bulk_operation
+from odm.cache import ModelCache, MemoryCache
+from odm.metrics import Metrics
+from odm.slow import redact
+from odm.concurrency import engines_map, EngineErrors
+from odm.migrate import constraint_statements, concurrently, table_diff
+from odm import fork
+from odm.dialects.postgresql import PGDGreen
 
-from tests.base import Employee, Engineer
+from pulsar.apps.greenio import GreenPool, wait
+
+from tests.base import Employee, Engineer, Task, TaskType
 
 
 Model = mapper.model_base('testutil')
@@ -16,6 +35,13 @@ class Foo(Model):
     name = Column(String(100))
 
 
+class Shard(Model):
+    __shard_key__ = 'id'
+    __shard_function__ = staticmethod(lambda value, size: value % size)
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100))
+
+
 table = Model.create_table(
     'bla',
     Column('id', Integer, primary_key=True),
@@ -67,13 +93,600 @@ class TestUtils(unittest.TestCase):
         mp.register_module(getmodule(self))
         self.assertTrue(mp.foo)
         self.assertRaises(AttributeError, lambda: mp.bla)
-        self.assertEqual(len(mp.metadata.tables), 2)
+        self.assertEqual(len(mp.metadata.tables), 3)
         bla = mp.metadata.tables['bla']
         self.assertTrue(bla.key, 'bla')
 
+    def test_lazy(self):
+        mp = mapper.Mapper('sqlite:///', lazy=True)
+        mp.register_module('tests.base')
+        self.assertEqual(list(mp._pending),
+                         ['personaltasks', 'employee', 'engineer', 'task'])
+        self.assertFalse(mp.binds)
+        with mp.begin() as session:
+            task = mp.task
+            self.assertEqual(task.__name__, 'Task')
+            self.assertFalse('task' in mp._pending)
+            self.assertTrue('employee' in mp._pending)
+            # the relationship builds the employee model
+            query = session.query(task)
+            self.assertEqual(list(mp._pending), ['personaltasks', 'engineer'])
+            employee = mp['employee']
+            self.assertTrue(employee is task.employee.mapper.class_)
+            task.metadata.create_all(
+                mp.get_engine(), tables=[employee.__table__, task.__table__])
+            self.assertEqual(query.count(), 0)
+        self.assertEqual(len(mp.metadata.tables), 4)
+        self.assertFalse(mp._pending)
+        self.assertRaises(AttributeError, lambda: mp.foo)
+
     def test_no_binds(self):
         self.assertRaises(mapper.ImproperlyConfigured, mapper.Mapper, None)
 
+    def test_bulk_update(self):
+        mp = mapper.Mapper('sqlite:///')
+        mp.register(Foo)
+        mp.table_create()
+        with mp.begin() as session:
+            session.add_all([mp.foo(name='foo%d' % n) for n in range(4)])
+        updated = mp.bulk_update('foo', [dict(id=1, name='bar1'),
+                                         dict(id=3, name='bar3')])
+        self.assertEqual(updated, 2)
+        table = mp.foo.__table__
+        rows = mp.get_engine().execute(table.select().order_by(table.c.id))
+        names = [row.name for row in rows]
+        self.assertEqual(names, ['bar1', 'foo1', 'bar3', 'foo3'])
+        self.assertEqual(mp.bulk_update(mp.foo, []), 0)
+
+    def test_bulk_load(self):
+        mp = mapper.Mapper('sqlite:///')
+        mp.register(Foo)
+        mp.table_create()
+        rows = (dict(name='foo%d' % n) for n in range(25))
+        self.assertEqual(mp.bulk_load(mp.foo, rows, chunk_size=10), 25)
+        table = mp.foo.__table__
+        count = mp.get_engine().execute(table.count()).scalar()
+        self.assertEqual(count, 25)
+
+    async def test_stream(self):
+        mp = mapper.Mapper('sqlite:///')
+        mp.register(Foo)
+        mp.table_create()
+        mp.bulk_load(mp.foo, (dict(name='foo%d' % n) for n in range(7)))
+        table = mp.foo.__table__
+        stream = mp.stream(table.select().order_by(table.c.id), batch_size=3)
+        rows = []
+        async for row in stream:
+            rows.append(row)
+        self.assertEqual([row.name for row in rows],
+                         ['foo%d' % n for n in range(7)])
+        stream = mp.stream(table.select(), batch_size=2)
+        row = await stream.__anext__()
+        self.assertEqual(row.id, 1)
+        self.assertEqual(len(stream._batch), 1)
+        await stream.close()
+        async for row in stream:
+            self.fail('stream is closed')
+
+    def test_query_cache(self):
+        mp = mapper.Mapper('sqlite:///')
+        mp.register(Foo)
+        mp.table_create()
+        mp.bulk_load(mp.foo, (dict(name='foo%d' % n) for n in range(3)))
+        with mp.begin() as session:
+            self.assertEqual(session.get(mp.foo, 2).name, 'foo1')
+            self.assertEqual(session.get(mp.foo, 5), None)
+            self.assertTrue(session.exists(mp.foo, 3))
+            self.assertFalse(session.exists(mp.foo, 4))
+            self.assertEqual(session.update_by_pk(mp.foo, 3, name='bar'), 1)
+            self.assertEqual(session.update_by_pk(mp.foo, 4, name='bar'), 0)
+        compiled = len(mp.queries.compiled)
+        with mp.begin() as session:
+            self.assertEqual(session.get(mp.foo, 3).name, 'bar')
+            self.assertEqual(session.get(mp.foo, 3), session.get(mp.foo, 3))
+            self.assertTrue(session.exists(mp.foo, 1))
+            session.update_by_pk(mp.foo, 1, name='bar')
+        self.assertEqual(len(mp.queries.compiled), compiled)
+
+    def test_model_cache(self):
+        mp = mapper.Mapper('sqlite:///', cache=ModelCache(MemoryCache(2)))
+        mp.register(Foo)
+        mp.table_create()
+        mp.bulk_load(mp.foo, (dict(name='foo%d' % n) for n in range(4)))
+        with mp.begin() as session:
+            self.assertEqual(session.get(mp.foo, 1).name, 'foo0')
+        self.assertEqual(mp.cache.stats(), {})
+        mp.foo.__cache__ = True
+        for _ in range(2):
+            with mp.begin() as session:
+                foo = session.get(mp.foo, 1)
+                self.assertEqual(foo.name, 'foo0')
+                self.assertEqual(session.get(mp.foo, 1), foo)
+        self.assertEqual(mp.cache.stats()['foo'],
+                         dict(hits=1, misses=1, evictions=0))
+        # the row is not read again
+        mp.get_engine().execute(mp.foo.__table__.update().values(name='x'))
+        with mp.begin() as session:
+            foo = session.get(mp.foo, 1)
+            self.assertEqual(foo.name, 'foo0')
+            foo.name = 'bar'
+        with mp.begin() as session:
+            self.assertEqual(session.get(mp.foo, 1).name, 'bar')
+            session.update_by_pk(mp.foo, 1, name='baz')
+        with mp.begin() as session:
+            self.assertEqual(session.get(mp.foo, 1).name, 'baz')
+            session.get(mp.foo, 2)
+            session.get(mp.foo, 3)
+        self.assertEqual(mp.cache.stats()['foo'],
+                         dict(hits=2, misses=5, evictions=1))
+        # Query.update() and Query.delete() invalidate the model
+        with mp.begin() as session:
+            session.query(mp.foo).filter_by(id=1).update(
+                {'name': 'bulk'}, synchronize_session=False)
+        with mp.begin() as session:
+            self.assertEqual(session.get(mp.foo, 1).name, 'bulk')
+        with mp.begin() as session:
+            session.query(mp.foo).filter_by(id=1).delete(
+                synchronize_session=False)
+        with mp.begin() as session:
+            self.assertEqual(session.get(mp.foo, 1), None)
+
+    def test_replicas(self):
+        mp = mapper.Mapper({'default': {'primary': 'sqlite:///',
+                                        'replicas': ['sqlite:///',
+                                                     'sqlite:///']}})
+        mp.register(Foo)
+        mp.table_create()
+        replicas = mp.replicas(mp.get_engine())
+        self.assertEqual(len(replicas), 2)
+        for n, engine in enumerate(replicas.engines):
+            mp.metadata.create_all(engine)
+            engine.execute(mp.foo.__table__.insert(), name='replica%d' % n)
+
+        def names(session):
+            return [foo.name for foo in session.query(mp.foo).order_by('id')]
+
+        with mp.begin() as session:
+            session.add(mp.foo(name='primary'))
+        with mp.begin() as session:
+            self.assertEqual(names(session), ['replica0'])
+            self.assertEqual(names(session), ['replica0'])
+        with mp.begin() as session:
+            self.assertEqual(names(session), ['replica1'])
+            session.add(mp.foo(name='primary2'))
+            session.flush()
+            self.assertEqual(names(session), ['primary', 'primary2'])
+        with mp.begin(primary=True) as session:
+            self.assertEqual(names(session), ['primary', 'primary2'])
+        replicas.lag = 60
+        with mp.begin() as session:
+            self.assertEqual(names(session), ['primary', 'primary2'])
+        # bulk operations write to the primary
+        replicas.last_write = 0
+        with mp.begin() as session:
+            mp.bulk_update(mp.foo, [dict(id=1, name='bulk')],
+                           session=session)
+            self.assertEqual(names(session), ['bulk', 'primary2'])
+        self.assertTrue(replicas.last_write)
+        with mp.begin() as session:
+            self.assertEqual(names(session), ['bulk', 'primary2'])
+        replicas.routing = 'least_outstanding'
+        replicas.lag = 0
+        conn = replicas.engines[0].connect()
+        with mp.begin() as session:
+            self.assertEqual(names(session), ['replica1'])
+        conn.close()
+
+    def test_shards(self):
+        mp = mapper.Mapper({'default': {'shards': ['sqlite:///',
+                                                   'sqlite:///',
+                                                   'sqlite:///']}})
+        mp.register(Shard)
+        mp.table_create()
+        shards = mp.shards(mp.shard.__table__)
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(len(mp.engines()), 3)
+        with mp.begin() as session:
+            session.add_all([mp.shard(id=n, name='s%d' % (10 - n))
+                             for n in range(1, 8)])
+        for n, engine in enumerate(shards.engines):
+            rows = engine.execute(mp.shard.__table__.select()).fetchall()
+            self.assertEqual([row.id % 3 for row in rows], [n]*len(rows))
+        with mp.begin() as session:
+            shard = session.query(mp.shard).get(5)
+            self.assertEqual(shard.name, 's5')
+            shard.name = 'updated'
+        with mp.begin() as session:
+            query = session.query(mp.shard)
+            self.assertEqual(query.get(5).name, 'updated')
+            self.assertEqual(query.get(9), None)
+            ids = [s.id for s in query.order_by(mp.shard.id)]
+            self.assertEqual(ids, [1, 2, 3, 4, 5, 6, 7])
+            names = [s.name for s in query.order_by(mp.shard.name.desc())
+                     .offset(1).limit(3)]
+            self.assertEqual(names, ['s9', 's8', 's7'])
+            ids = [s.id for s in query.shard(4)]
+            self.assertEqual(ids, [1, 4, 7])
+
+    def test_shards_aggregate(self):
+        mp = mapper.Mapper({'default': {'shards': ['sqlite:///',
+                                                   'sqlite:///',
+                                                   'sqlite:///']}})
+        mp.register(Shard)
+        mp.table_create()
+        with mp.begin() as session:
+            session.add_all([mp.shard(id=n, name='s%d' % n)
+                             for n in range(1, 8)])
+        with mp.begin() as session:
+            query = session.query(mp.shard)
+            self.assertEqual(query.count(), 7)
+            self.assertEqual(query.filter(mp.shard.id > 2).count(), 5)
+            self.assertEqual(query.shard(4).count(), 3)
+            self.assertRaises(NotImplementedError,
+                              query.limit(2).count)
+            maximum = session.query(func.max(mp.shard.id))
+            self.assertRaises(NotImplementedError, maximum.all)
+            self.assertEqual(maximum.shard(4).scalar(), 7)
+            self.assertRaises(NotImplementedError,
+                              session.query(mp.shard.name)
+                              .group_by(mp.shard.name).all)
+            self.assertRaises(NotImplementedError, query.from_self().all)
+
+    def test_shards_bulk(self):
+        mp = mapper.Mapper({'default': {'shards': ['sqlite:///',
+                                                   'sqlite:///',
+                                                   'sqlite:///']}})
+        mp.register(Shard)
+        mp.table_create()
+        rows = [dict(id=n, name='s%d' % n) for n in range(1, 7)]
+        self.assertEqual(mp.bulk_load(mp.shard, rows, chunk_size=4), 6)
+        shards = mp.shards(mp.shard.__table__)
+        for n, engine in enumerate(shards.engines):
+            rows = engine.execute(mp.shard.__table__.select()).fetchall()
+            self.assertEqual([row.id % 3 for row in rows], [n, n])
+        rows = [dict(id=n, name='u%d' % n) for n in (2, 3, 4)]
+        self.assertEqual(mp.bulk_update(mp.shard, rows), 3)
+        with mp.begin() as session:
+            query = session.query(mp.shard)
+            self.assertEqual(query.count(), 6)
+            self.assertEqual([query.get(n).name for n in range(1, 7)],
+                             ['s1', 'u2', 'u3', 'u4', 's5', 's6'])
+        self.assertRaises(ValueError, mp.bulk_load, mp.shard,
+                          [dict(name='nokey')])
+        self.assertRaises(ValueError, mp.bulk_update, mp.shard,
+                          [dict(name='nokey')])
+
+    def test_copy_options(self):
+        cache = ModelCache()
+        mp = mapper.Mapper('sqlite:///', cache=cache, metrics=True,
+                           slow_queries=0.5, lazy=True)
+        mp2 = mp.database_create('odmtest.db')
+        self.assertEqual(str(mp2.get_engine().url), 'sqlite:///odmtest.db')
+        self.assertEqual(mp2.cache, cache)
+        self.assertTrue(mp2.lazy)
+        self.assertIsInstance(mp2.metrics, Metrics)
+        self.assertNotEqual(mp2.metrics, mp.metrics)
+        self.assertEqual(mp2.slow_queries.threshold, 0.5)
+        mp3 = mapper.Mapper('sqlite:///').copy()
+        self.assertEqual((mp3.cache, mp3.lazy, mp3.metrics,
+                          mp3.slow_queries), (None, False, None, None))
+
+    def test_database_shards_replicas(self):
+        mp = mapper.Mapper({'default': {'shards': ['sqlite:///',
+                                                   'sqlite:///']},
+                            'other': {'primary': 'sqlite:///',
+                                      'replicas': ['sqlite:///'],
+                                      'replica_lag': 2}})
+        self.assertEqual(mp.database_exist(), {'default:shard0': True,
+                                               'default:shard1': True,
+                                               'other': True})
+        names = dict(((engine, 'odmtest%d.db' % n)
+                      for n, engine in enumerate(mp.engines())))
+        mp2 = mp.database_create(names.__getitem__)
+        self.assertEqual(
+            sorted(str(e.url) for e in mp2.engines()),
+            sorted('sqlite:///%s' % name for name in names.values()))
+        self.assertEqual(mp2.database_exist(), {'default:shard0': False,
+                                                'default:shard1': False,
+                                                'other': False})
+        replicas = mp2.replicas(mp2.get_engine('other'))
+        self.assertEqual(replicas.lag, 2)
+        self.assertEqual(str(replicas.engines[0].url),
+                         str(mp2.get_engine('other').url))
+
+    def test_metrics(self):
+        observed = []
+        mp = mapper.Mapper('sqlite:///', metrics=True)
+        mp.register(Foo)
+        mp.table_create()
+        metrics = mp.metrics
+        self.assertIsInstance(metrics, Metrics)
+        metrics.callback = lambda *args: observed.append(args)
+        with mp.begin() as session:
+            session.add(mp.foo(name='foo'))
+        with mp.begin() as session:
+            self.assertEqual(session.query(mp.foo).count(), 1)
+        self.assertEqual(metrics.latency[(('table', 'foo'),
+                                          ('type', 'insert'))].count, 1)
+        self.assertEqual(metrics.rows[(('table', 'foo'),
+                                       ('type', 'insert'))], 1)
+        self.assertTrue((('table', 'foo'), ('type', 'select'))
+                        in metrics.latency)
+        self.assertFalse(metrics.switches)
+        name, value, labels = observed[0]
+        self.assertEqual(name, 'odm_statement_seconds')
+        self.assertEqual(labels, dict(table='foo', type='insert'))
+        text = metrics.prometheus()
+        self.assertTrue('# TYPE odm_statement_seconds histogram' in text)
+        self.assertTrue('odm_statement_seconds_bucket{table="foo",'
+                        'type="insert",le="+Inf"} 1' in text)
+        self.assertTrue('odm_statement_rows_total{table="foo",'
+                        'type="insert"} 1' in text)
+        engine = create_engine('sqlite:///', poolclass=QueuePool)
+        metrics.attach(engine, 'queue')
+        self.assertTrue('odm_pool_size{engine="queue"} 0' in
+                        metrics.prometheus())
+        # disabled
+        mp.disable_metrics()
+        self.assertEqual(metrics.engines(), {})
+        with mp.begin() as session:
+            session.add(mp.foo(name='bla'))
+        self.assertEqual(metrics.latency[(('table', 'foo'),
+                                          ('type', 'insert'))].count, 1)
+
+    def test_slow_queries(self):
+        mp = mapper.Mapper('sqlite:///', slow_queries=0)
+        mp.register(Foo)
+        mp.table_create()
+        slow = mp.slow_queries
+        slow.entries = type(slow.entries)(maxlen=2)
+        with mp.begin() as session:
+            session.add(mp.foo(name='foo'))
+        self.assertEqual(len(slow), 1)
+        entry = list(slow)[0]
+        self.assertTrue(entry.statement.startswith('INSERT INTO foo'))
+        self.assertEqual(entry.parameters, ('<str>',))
+        self.assertEqual(entry.bind, 'default')
+        self.assertTrue(entry.elapsed >= 0)
+        self.assertTrue(entry.site.endswith('in test_slow_queries'))
+        self.assertEqual(entry.plan, None)
+        for name in ('a', 'b', 'c'):
+            mp.get_engine().execute(mp.foo.__table__.insert(), name=name)
+        self.assertEqual(len(slow), 2)
+        # threshold
+        slow.clear()
+        slow.threshold = 60
+        mp.get_engine().execute(mp.foo.__table__.select())
+        self.assertEqual(len(slow), 0)
+        mp.disable_slow_queries()
+        self.assertEqual(mp.slow_queries, None)
+
+    def test_redact(self):
+        self.assertEqual(redact({'a': 1, 'b': None, 'c': 'x'}),
+                         {'a': '<int>', 'b': None, 'c': '<str>'})
+        self.assertEqual(redact([(1, 2.5), (3, 4.5)]),
+                         [('<int>', '<float>'), ('<int>', '<float>')])
+
+    def test_engines_map(self):
+        engines = [create_engine('sqlite:///', poolclass=QueuePool)
+                   for _ in range(3)]
+        threads = set()
+
+        def operation(engine):
+            threads.add(threading.get_ident())
+            return engines.index(engine)
+
+        self.assertEqual(engines_map(operation, engines), [0, 1, 2])
+        self.assertFalse(threading.get_ident() in threads)
+
+        def fail(engine):
+            if engines.index(engine):
+                raise ValueError(engines.index(engine))
+
+        with self.assertRaises(EngineErrors) as cm:
+            engines_map(fail, engines)
+        self.assertEqual(set(cm.exception.errors), set(engines[1:]))
+        self.assertRaises(ValueError, engines_map, fail, engines[:2])
+        # engines with thread local connections
+        threads.clear()
+        engines = [create_engine('sqlite:///'), create_engine('sqlite:///')]
+        engines_map(operation, engines)
+        self.assertEqual(threads, set((threading.get_ident(),)))
+
+    async def test_engines_map_green(self):
+        engines = [create_engine('sqlite:///') for _ in range(5)]
+        running = []
+        counts = []
+
+        def operation(engine):
+            running.append(engine)
+            counts.append(len(running))
+            wait(asyncio.sleep(0.01))
+            running.remove(engine)
+            return engine
+
+        result = await GreenPool().submit(engines_map, operation, engines,
+                                          2, True)
+        self.assertEqual(result, engines)
+        self.assertEqual(max(counts), 2)
+
+    def migrated(self):
+        return Model.create_table(
+            'migrated',
+            Column('id', Integer, primary_key=True),
+            Column('name', String(40), index=True),
+            Column('code', String(10), unique=True),
+            Column('parent_id', Integer, ForeignKey('migrated.id')),
+            Column('required', Integer, nullable=False),
+            Column('flag', Integer, nullable=False, server_default='0'))
+
+    def test_schema_diff(self):
+        mp = mapper.Mapper('sqlite:///')
+        table = mp.register(self.migrated())
+        engine = mp.get_engine()
+        plan = mp.schema_diff()
+        self.assertEqual(list(plan), ['default'])
+        self.assertEqual([change.kind for change in plan['default']],
+                         ['create_table'])
+        engine.execute('CREATE TABLE migrated (id INTEGER PRIMARY KEY, '
+                       'old VARCHAR(10))')
+        migration = mp.schema_diff()['default']
+        self.assertEqual(
+            [(change.kind, change.name, change.applicable)
+             for change in migration],
+            [('add_column', 'name', True),
+             ('add_column', 'code', True),
+             ('add_column', 'parent_id', True),
+             ('add_column', 'required', False),
+             ('add_column', 'flag', True),
+             ('extra_column', 'old', False),
+             ('create_index', 'ix_migrated_name', True),
+             ('add_unique', 'migrated_code_key', False),
+             ('add_foreign_key', 'migrated_parent_id_fkey', False)])
+        self.assertEqual(migration.statements()[0],
+                         'ALTER TABLE migrated ADD COLUMN name VARCHAR(40)')
+        self.assertTrue('-- not applied: add_column migrated.required' in
+                        str(migration))
+        plan = mp.migrate(dry_run=True)
+        self.assertEqual(len(plan['default']), 9)
+        mp.migrate()
+        engine.execute(table.insert(), id=1, name='foo', flag=1)
+        migration = mp.schema_diff()['default']
+        self.assertEqual([change.kind for change in migration],
+                         ['add_column', 'extra_column', 'add_unique',
+                          'add_foreign_key'])
+        self.assertEqual(migration.statements(), [])
+
+    def test_migrate_postgresql(self):
+        table = self.migrated()
+        dialect = postgresql.dialect()
+        index = list(table.indexes)[0]
+        self.assertEqual(concurrently(str(CreateIndex(index).compile(
+            dialect=dialect)), dialect),
+            'CREATE INDEX CONCURRENTLY ix_migrated_name ON migrated (name)')
+        constraints = dict(((type(c).__name__, c) for c in table.constraints))
+        self.assertEqual(
+            constraint_statements(constraints['UniqueConstraint'], dialect),
+            ['CREATE UNIQUE INDEX CONCURRENTLY migrated_code_key ON '
+             'migrated (code)',
+             'ALTER TABLE migrated ADD CONSTRAINT migrated_code_key UNIQUE '
+             'USING INDEX migrated_code_key'])
+        self.assertEqual(
+            constraint_statements(constraints['ForeignKeyConstraint'],
+                                  dialect),
+            ['ALTER TABLE migrated ADD CONSTRAINT migrated_parent_id_fkey '
+             'FOREIGN KEY(parent_id) REFERENCES migrated (id) NOT VALID',
+             'ALTER TABLE migrated VALIDATE CONSTRAINT '
+             'migrated_parent_id_fkey'])
+
+    def test_migrate_invalid_index(self):
+        # a failed CREATE INDEX CONCURRENTLY leaves invalid indexes
+        table = self.migrated()
+        inspector = mock.Mock(default_schema_name='public')
+        inspector.get_columns.return_value = [
+            dict(name=column.name, type=column.type)
+            for column in table.columns]
+        inspector.get_indexes.return_value = [
+            dict(name='ix_migrated_name', column_names=['name'],
+                 unique=False),
+            dict(name='migrated_code_key', column_names=['code'],
+                 unique=True)]
+        inspector.get_unique_constraints.return_value = []
+        inspector.get_foreign_keys.return_value = [
+            dict(constrained_columns=['parent_id'],
+                 referred_table='migrated')]
+        inspector.get_check_constraints.return_value = []
+        inspector.bind.execute.return_value = [('ix_migrated_name',),
+                                               ('migrated_code_key',)]
+        changes = table_diff(inspector, postgresql.dialect(), table)
+        self.assertEqual([(change.kind, change.name) for change in changes],
+                         [('create_index', 'ix_migrated_name'),
+                          ('add_unique', 'migrated_code_key')])
+        self.assertEqual(changes[0].statements, [
+            'DROP INDEX CONCURRENTLY ix_migrated_name',
+            'CREATE INDEX CONCURRENTLY ix_migrated_name ON migrated (name)'])
+        self.assertEqual(changes[1].statements[:2], [
+            'DROP INDEX CONCURRENTLY migrated_code_key',
+            'CREATE UNIQUE INDEX CONCURRENTLY migrated_code_key ON '
+            'migrated (code)'])
+        self.assertEqual(inspector.bind.execute.call_args[1],
+                         dict(table='migrated', schema='public'))
+        inspector.bind.execute.return_value = []
+        self.assertEqual(table_diff(inspector, postgresql.dialect(), table),
+                         [])
+
+    def test_guard_pid(self):
+        engine = create_engine('sqlite:///', poolclass=QueuePool)
+        fork.guard_pid(engine)
+        conn = engine.connect()
+        dbapi_connection = conn.connection.connection
+        conn.close()
+        with mock.patch('odm.fork.os.getpid', return_value=os.getpid() + 1):
+            conn = engine.connect()
+            self.assertFalse(conn.connection.connection is dbapi_connection)
+            conn.close()
+        self.assertTrue(dbapi_connection in fork._inherited)
+        fork._inherited.remove(dbapi_connection)
+
+    def test_after_fork(self):
+        mp = mapper.Mapper({'default': {'primary': 'sqlite:///',
+                                        'replicas': ['sqlite:///']}})
+        mp.register(Foo)
+        mp.prefork()
+        replicas = mp.replicas(mp.get_engine())
+        replicas.outstanding[replicas.engines[0]] = 3
+        pools = [engine.pool for _, engine in mp.labelled_engines()]
+        mp.after_fork()
+        for pool, (_, engine) in zip(pools, mp.labelled_engines()):
+            self.assertFalse(engine.pool is pool)
+            self.assertTrue(pool in fork._inherited)
+            fork._inherited.remove(pool)
+        self.assertEqual(replicas.outstanding[replicas.engines[0]], 0)
+        mp.table_create()
+        with mp.begin() as session:
+            session.add(mp.foo(name='foo'))
+
+    def test_copy_data(self):
+        mp = mapper.Mapper('sqlite:///')
+        mp.register(Employee)
+        table = mp.register(Task).__table__
+        uuid = UUID('c0e1ad0d-4b1e-4aaa-9e01-bd1c2fc6bd3c')
+        rows = [dict(id=uuid, subject='tab\there', info={'a': 1},
+                     type=TaskType.personal, done=True),
+                dict(id=uuid.hex, subject=None)]
+        columns = insert_columns(table, rows[0])
+        self.assertEqual([c.key for c in columns],
+                         ['id', 'subject', 'done', 'created', 'info', 'type'])
+        data = CopyData(postgresql.psycopg2.dialect(), columns, iter(rows),
+                        chunk_size=1)
+        first = data.read().split('\t')
+        self.assertEqual(first[:3], [str(uuid), 'tab\\there', 't'])
+        self.assertEqual(first[4:], ['{"a": 1}', '2\n'])
+        second = data.read().split('\t')
+        self.assertEqual(second[:3], [str(uuid), '\\N', 'f'])
+        self.assertEqual(second[4:], ['\\N', '1\n'])
+        self.assertEqual(data.read(), '')
+        self.assertEqual(data.count, 2)
+        stamped = Table('stamped', MetaData(),
+                        Column('id', Integer, primary_key=True),
+                        Column('stamp', Integer, default=func.random()))
+        data = CopyData(postgresql.psycopg2.dialect(),
+                        insert_columns(stamped, {'id': 1}), iter([{'id': 1}]),
+                        chunk_size=1)
+        self.assertRaises(NotImplementedError, data.read)
+
+    def test_bulk_load_green(self):
+        # psycopg2 refuses COPY with the wait callback of the green dialect
+        mp = mapper.Mapper('sqlite:///')
+        mp.register(Employee)
+        table = mp.register(Task).__table__
+        conn = mock.Mock(dialect=PGDGreen())
+        rows = [dict(subject='task %d' % n) for n in range(3)]
+        self.assertEqual(bulk_operation(conn, 'load', table, iter(rows), 2),
+                         3)
+        self.assertEqual(conn.execute.call_count, 2)
+        self.assertFalse(conn.connection.cursor.called)
+
     def test_copy_modules(self):
         module = getmodule(self)
         models = mapper.get_models(module)